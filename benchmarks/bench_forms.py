@@ -0,0 +1,41 @@
+"""
+Rendering the checkout form through OgoneForm against the cached renderer.
+
+Run with ``python benchmarks/bench_forms.py``.
+"""
+
+from utils import setup_django, bench
+setup_django()
+
+from django_ogone import Ogone
+
+
+class Settings(object):
+    SHA_PRE_SECRET = 'test1234'
+    HASH_METHOD = 'sha512'
+    PSPID = 'mycutePS'
+    CURRENCY = 'EUR'
+
+
+CHECKOUT = {'orderID': 14, 'ownerstate': u'', 'cn': u'Kaast Achternaam', 'language': 'en_US', 'ownertown': u'Klaas', 'ownercty': u'NL', 'exceptionurl': u'http://127.0.0.1:8000/shop/checkout/ogone/failure/', 'ownerzip': u'Postcode', 'catalogurl': u'http://127.0.0.1:8000/shop/category/', 'currency': u'EUR', 'amount': u'579', 'declineurl': u'http://127.0.0.1:8000/shop/checkout/ogone/failure/', 'homeurl': u'http://127.0.0.1:8000/shop/', 'cancelurl': u'http://127.0.0.1:8000/shop/checkout/ogone/failure/', 'accepturl': u'http://127.0.0.1:8000/shop/checkout/ogone/success/', 'owneraddress': u'Straat', 'com': u'Order #14: Kaast Achternaam', 'email': u'mathijs@mathijsfietst.nl'}
+
+
+def render_form():
+    form = Ogone.get_form(CHECKOUT.copy(), settings=Settings)
+    return u''.join([unicode(field) for field in form])
+
+
+def render_html():
+    return Ogone.get_form_html(CHECKOUT.copy(), settings=Settings)
+
+
+def main(number=2000):
+    bench('get_form + rendering', render_form, number)
+    bench('get_form_html', render_html, number)
+    bench('get_post_data',
+          lambda: Ogone.get_post_data(CHECKOUT.copy(), settings=Settings),
+          number)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Rows per second of the streaming importer, and the peak memory use after
+importing a small and a large export.
+
+Run with ``python benchmarks/bench_importer.py``.
+"""
+
+import resource
+import tempfile
+import time
+
+from utils import setup_django
+setup_django()
+
+from django_ogone import importer
+
+HEADER = 'PAYID;ORDERID;STATUS;AMOUNT;TRXDATE;ED;CN;BRAND\n'
+ROW = '%d;%d;9;67.94;09/24/10;0111;S\xe9bastien Fievet;VISA\n'
+
+
+def write_export(rows):
+    f = tempfile.TemporaryFile()
+    f.write(HEADER)
+    for i in xrange(rows):
+        f.write(ROW % (8000000 + i, i))
+    f.seek(0)
+
+    return f
+
+
+def count(results):
+    for result in results:
+        result.transaction_date, result.expiry_date, result.amount
+
+
+def main():
+    for rows in (10000, 200000):
+        export = write_export(rows)
+
+        started = time.time()
+        report = importer.Importer(count).run(export)
+        seconds = time.time() - started
+        assert report['imported'] == rows
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print('%-40s %10.0f rows/sec, peak RSS %d kB' % (
+            'import %d rows' % rows, rows / seconds, peak))
+
+
+if __name__ == '__main__':
+    main()
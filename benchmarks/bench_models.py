@@ -0,0 +1,59 @@
+"""
+Storing postbacks one save() at a time against Payment.objects.bulk_upsert,
+in an in-memory SQLite database.
+
+Run with ``python benchmarks/bench_models.py``.
+"""
+
+import itertools
+
+from utils import setup_django, bench
+setup_django(
+    INSTALLED_APPS=['django_ogone'],
+    DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3',
+                           'NAME': ':memory:'}},
+)
+
+from django.core.management import call_command
+
+from django_ogone import loadgen
+from django_ogone.models import Payment
+from django_ogone.result import OgoneResult
+
+BATCH = 500
+
+numbers = itertools.count()
+
+
+def get_results():
+    """ The next BATCH postbacks, half of them for payments we've seen. """
+
+    start = next(numbers) * BATCH // 2
+    return [OgoneResult(dict(loadgen.POSTBACK, ORDERID=str(i),
+                             PAYID=str(8000000 + i)))
+            for i in range(start, start + BATCH)]
+
+
+def save_each(results):
+    for result in results:
+        fields = Payment.get_fields(result)
+        payment, created = Payment.objects.get_or_create(
+            payid=fields['payid'], defaults=fields)
+        if not created:
+            for name, value in fields.items():
+                setattr(payment, name, value)
+            payment.save()
+
+
+def main(number=5):
+    call_command('migrate', verbosity=0)
+
+    for name, func in (('save() per postback', save_each),
+                       ('bulk_upsert', Payment.objects.bulk_upsert)):
+        ops = bench('%s (batches of %d)' % (name, BATCH),
+                    lambda: func(get_results()), number)
+        print('%-40s %10.0f postbacks/sec' % ('', ops * BATCH))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Compare the streaming ncresponse parser with the old minidom based one.
+
+Run with ``python benchmarks/bench_parser.py``.
+"""
+
+import base64
+import xml.dom.minidom
+
+from utils import setup_django, bench
+setup_django()
+
+from django_ogone import parsers
+
+NCRESPONSE = '<?xml version="1.0"?><ncresponse orderID="13" PAYID="8285812" PAYIDSUB="1" NCSTATUS="0" NCERROR="0" NCERRORPLUS="!" ACCEPTANCE="test123" STATUS="91" amount="67.94" currency="EUR"></ncresponse>'
+
+HTML_ANSWER = base64.b64encode('<form name="downloadform3D">%s</form>' %
+                               ('<input type="hidden" value="x" />' * 200))
+NCRESPONSE_3DS = '<?xml version="1.0"?><ncresponse orderID="13" PAYID="8285812" NCSTATUS="5" NCERROR="0" STATUS="46"><HTML_ANSWER>%s</HTML_ANSWER></ncresponse>' % HTML_ANSWER
+
+
+def parse_minidom(xml_str):
+    doc = xml.dom.minidom.parseString(xml_str)
+    attrs = doc.documentElement.attributes
+    return dict([(attrs.item(i).name, attrs.item(i).value) \
+                for i in range(attrs.length)])
+
+
+def parse_minidom_html_answer(xml_str):
+    doc = xml.dom.minidom.parseString(xml_str)
+    result = parse_minidom(xml_str)
+    node = doc.getElementsByTagName('HTML_ANSWER')[0]
+    result['HTML_ANSWER'] = u''.join([n.data for n in node.childNodes])
+    return result
+
+
+def main(number=20000):
+    assert parse_minidom(NCRESPONSE) == parsers.parse_ncresponse(NCRESPONSE)
+    assert parse_minidom_html_answer(NCRESPONSE_3DS) == \
+        parsers.parse_ncresponse(NCRESPONSE_3DS, children=('HTML_ANSWER',))
+
+    bench('minidom', lambda: parse_minidom(NCRESPONSE), number)
+    bench('parse_ncresponse', lambda: parsers.parse_ncresponse(NCRESPONSE),
+          number)
+    bench('minidom (HTML_ANSWER)',
+          lambda: parse_minidom_html_answer(NCRESPONSE_3DS), number // 10)
+    bench('parse_ncresponse (HTML_ANSWER)',
+          lambda: parsers.parse_ncresponse(NCRESPONSE_3DS,
+                                           children=('HTML_ANSWER',)),
+          number // 10)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+How well processes sharing a file backed rate limit keep to it: eight
+processes take turns as fast as they can from a budget of 200 calls per
+second, and the combined calls are counted per 100ms.
+
+Run with ``python benchmarks/bench_ratelimit.py``.
+"""
+
+import multiprocessing
+import shutil
+import tempfile
+import time
+
+from utils import setup_django
+setup_django()
+
+from django_ogone import ratelimit
+
+PROCESSES = 8
+RATE = 200
+DURATION = 3
+
+
+def take_turns(args):
+    directory, until = args
+    limiter = ratelimit.RateLimiter({'*': (RATE, 10)},
+                                    ratelimit.FileBackend(directory))
+
+    turns = []
+    while time.time() < until:
+        limiter.acquire('mycutePS')
+        turns.append(time.time())
+
+    return turns
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        pool = multiprocessing.Pool(PROCESSES)
+        started = time.time() + 0.5
+        results = pool.map(take_turns,
+                           [(directory, started + DURATION)] * PROCESSES)
+        pool.close()
+    finally:
+        shutil.rmtree(directory)
+
+    turns = sorted(turn for result in results for turn in result
+                   if turn >= started)
+    slots = [0] * (DURATION * 10)
+    for turn in turns:
+        slots[min(len(slots) - 1, int((turn - started) * 10))] += 1
+
+    rates = [count * 10 for count in slots[1:]]
+    print('%d processes, budget %d/sec' % (PROCESSES, RATE))
+    print('calls/sec over 100ms slots: min %d, max %d, mean %.0f' % (
+        min(rates), max(rates), sum(rates) / float(len(rates))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""
+Throughput of OgoneSignature against the reusable OgoneSigner.
+
+Run with ``python benchmarks/bench_signing.py``.
+"""
+
+from utils import setup_django, bench
+setup_django()
+
+from django_ogone import security, parameters
+
+POSTBACK = {u'ORDERID': u'13', u'STATUS': u'9', u'CARDNO': u'XXXXXXXXXXXX1111', u'VC': u'NO', u'PAYID': u'8285812', u'CN': u'Kaast Achternaam', u'NCERROR': u'0', u'IP': u'82.139.114.10', u'IPCTY': u'NL', u'CURRENCY': u'EUR', u'CCCTY': u'US', u'AAVCHECK': u'NO', u'BRAND': u'VISA', u'ACCEPTANCE': u'test123', u'ECI': u'7', u'TRXDATE': u'09/24/10', u'AMOUNT': u'6794.81', u'CVCCHECK': u'NO', u'ED': u'0111', u'PM': u'CreditCard'}
+
+SECRET = 'test12345'
+
+
+def main(number=20000):
+    for hash_method in security.HASH_METHODS:
+        signer = security.OgoneSigner(hash_method, SECRET)
+        assert signer.sign(POSTBACK) == security.OgoneSignature(
+            POSTBACK, hash_method, SECRET).signature()
+
+        bench('OgoneSignature (%s)' % hash_method,
+              lambda: security.OgoneSignature(POSTBACK, hash_method,
+                                              SECRET).signature(),
+              number)
+        bench('OgoneSigner (%s)' % hash_method,
+              lambda: signer.sign(POSTBACK), number)
+        bench('get_signer().sign (%s)' % hash_method,
+              lambda: security.get_signer(hash_method, SECRET).sign(POSTBACK),
+              number)
+
+        signer = security.OgoneSigner(hash_method, SECRET,
+                                      parameters=parameters.SHA_OUT)
+        bench('OgoneSigner SHA-OUT table (%s)' % hash_method,
+              lambda: signer.sign(POSTBACK, normalized=True), number)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Cold start time of a process that verifies a postback, with and without
+Django loaded, against an empty interpreter.
+
+Every case runs in a fresh interpreter; the median of `RUNS` runs is
+reported. Run with ``python benchmarks/bench_startup.py``.
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+RUNS = 20
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+VERIFY = '''
+from django_ogone import Ogone, security
+params = {"ORDERID": "13", "STATUS": "9", "AMOUNT": "67.94"}
+params["SHASIGN"] = security.OgoneSignature(params, "sha512",
+                                            "out").signature()
+settings = type("Settings", (), {"HASH_METHOD": "sha512",
+                                 "SHA_POST_SECRET": "out"})
+assert Ogone(params, settings=settings).is_valid()
+'''
+
+CASES = [
+    ('python', 'pass'),
+    ('import security, sign', '''
+from django_ogone import security
+security.OgoneSignature({"ORDERID": "13"}, "sha512", "out").signature()
+'''),
+    ('import django_ogone, verify', VERIFY),
+    ('with Django configured, verify', '''
+from django.conf import settings
+settings.configure()
+import django.forms
+''' + VERIFY),
+]
+
+
+def run(script):
+    env = dict(os.environ)
+    env.pop('DJANGO_SETTINGS_MODULE', None)
+
+    timings = []
+    for i in range(RUNS):
+        started = time.time()
+        subprocess.check_call([sys.executable, '-c', script], cwd=ROOT,
+                              env=env)
+        timings.append(time.time() - started)
+
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def main():
+    for name, script in CASES:
+        print('%-40s %8.1f ms' % (name, run(script) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""
+The benchmark suite run before every release.
+
+Measures signing, postback verification, parameter parsing, form rendering,
+redirect urls and DirectLink requests (against a local stub server) with
+realistic payloads, and reports ops/sec and p50/p95/p99 latencies.
+
+Run with ``python benchmarks/suite.py``. Store a baseline with
+``--save baseline.json`` and check a later run against it with
+``--compare baseline.json``; the script exits with status 1 when any
+benchmark lost more than ``--tolerance`` of its ops/sec.
+"""
+
+import json
+import optparse
+import sys
+
+from utils import setup_django, measure
+setup_django()
+
+from django_ogone import security, transport, testserver, metrics, parameters
+from django_ogone import Ogone, OgoneDirectLink
+
+
+class Settings(object):
+    SHA_PRE_SECRET = 'test1234'
+    SHA_POST_SECRET = 'test12345'
+    HASH_METHOD = 'sha512'
+    PRODUCTION = False
+    PSPID = 'mycutePS'
+    CURRENCY = 'EUR'
+    TEST_URL = 'https://secure.ogone.com/ncol/test/orderstandard.asp'
+    PROD_URL = 'https://secure.ogone.com/ncol/prod/orderstandard.asp'
+    USERID = 'api'
+    PSWD = 'secret'
+
+
+# The postback from the tests
+ASCII_POSTBACK = {u'ORDERID': u'13', u'STATUS': u'9', u'CARDNO': u'XXXXXXXXXXXX1111', u'VC': u'NO', u'PAYID': u'8285812', u'CN': u'Kaast Achternaam', u'NCERROR': u'0', u'IP': u'82.139.114.10', u'IPCTY': u'NL', u'CURRENCY': u'EUR', u'CCCTY': u'US', u'AAVCHECK': u'NO', u'BRAND': u'VISA', u'ACCEPTANCE': u'test123', u'ECI': u'7', u'TRXDATE': u'09/24/10', u'AMOUNT': u'6794.81', u'CVCCHECK': u'NO', u'ED': u'0111', u'PM': u'CreditCard'}
+
+# The same with a name outside of ascii
+UNICODE_POSTBACK = dict(ASCII_POSTBACK, CN=u'J\xfcrgen M\xfcller-L\xfcdenscheid')
+
+CHECKOUT = {'orderID': 14, 'ownerstate': u'', 'cn': u'Kaast Achternaam', 'language': 'en_US', 'ownertown': u'Klaas', 'ownercty': u'NL', 'exceptionurl': u'http://127.0.0.1:8000/shop/checkout/ogone/failure/', 'ownerzip': u'Postcode', 'catalogurl': u'http://127.0.0.1:8000/shop/category/', 'currency': u'EUR', 'amount': u'579', 'declineurl': u'http://127.0.0.1:8000/shop/checkout/ogone/failure/', 'homeurl': u'http://127.0.0.1:8000/shop/', 'cancelurl': u'http://127.0.0.1:8000/shop/checkout/ogone/failure/', 'accepturl': u'http://127.0.0.1:8000/shop/checkout/ogone/success/', 'owneraddress': u'Straat', 'com': u'Order #14: Kaast Achternaam', 'email': u'mathijs@mathijsfietst.nl'}
+
+MAINTENANCE = {'PAYID': '8285812', 'OPERATION': 'SAS', 'amount': '679481'}
+
+
+def get_benchmarks(url, pooled):
+    """ Return (name, func, number) for every benchmark, sending the
+        DirectLink requests to `url`. """
+
+    benchmarks = []
+
+    # The signer Ogone.is_valid uses for the settings above
+    signer = security.get_signer(Settings.HASH_METHOD, Settings.SHA_POST_SECRET,
+                                 parameters=parameters.get_table(1, out=True))
+
+    for label, postback in (('ascii', ASCII_POSTBACK),
+                            ('unicode', UNICODE_POSTBACK)):
+        postback = dict(postback)
+        postback['SHASIGN'] = Ogone.sign(postback, out=True,
+                                         settings=Settings)
+
+        def sign(postback=postback):
+            return signer.sign(postback)
+
+        # Postback keys are upper case already
+        def sign_normalized(postback=postback):
+            return signer.sign(postback, normalized=True)
+
+        def is_valid(postback=postback):
+            assert Ogone(postback, settings=Settings).is_valid()
+
+        def parse_params(postback=postback):
+            result = Ogone(postback, settings=Settings).parse_params()
+            return (result.order_id, result.status, result.transaction_date,
+                    result.expiry_date, result.amount)
+
+        benchmarks.extend([
+            ('OgoneSigner.sign (%s)' % label, sign, 20000),
+            ('OgoneSigner.sign normalized (%s)' % label, sign_normalized,
+             20000),
+            ('Ogone.is_valid (%s)' % label, is_valid, 10000),
+            ('Ogone.parse_params (%s)' % label, parse_params, 10000),
+        ])
+
+    def get_form():
+        form = Ogone.get_form(CHECKOUT.copy(), settings=Settings)
+        return u''.join([unicode(field) for field in form])
+
+    benchmarks.extend([
+        ('Ogone.get_form', get_form, 1000),
+        ('Ogone.get_form_html',
+         lambda: Ogone.get_form_html(CHECKOUT.copy(), settings=Settings),
+         5000),
+        ('Ogone.get_redirect_url',
+         lambda: Ogone.get_redirect_url(CHECKOUT, settings=Settings),
+         5000),
+    ])
+
+    benchmarks.extend([
+        ('OgoneDirectLink.request (urllib)',
+         lambda: OgoneDirectLink.request(url, MAINTENANCE.copy(),
+                                         settings=Settings,
+                                         transport=transport.UrllibTransport()),
+         500),
+        ('OgoneDirectLink.request (pooled)',
+         lambda: OgoneDirectLink.request(url, MAINTENANCE.copy(),
+                                         settings=Settings, transport=pooled),
+         2000),
+    ])
+
+    return benchmarks
+
+
+def compare(results, baseline, tolerance):
+    """ Print how `results` compare to `baseline` and return the names of
+        the benchmarks that regressed. """
+
+    regressions = []
+
+    for name, result in results:
+        if name not in baseline:
+            continue
+
+        change = result['ops'] / baseline[name]['ops'] - 1
+        flag = ''
+        if change < -tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('%-40s %+7.1f%%%s' % (name, change * 100, flag))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--save', metavar='FILE',
+                      help='store the results as a baseline in FILE')
+    parser.add_option('--compare', metavar='FILE',
+                      help='compare the results to the baseline in FILE')
+    parser.add_option('--tolerance', type='float', default=0.2,
+                      help='the slowdown allowed before failing [%default]')
+    parser.add_option('--filter', default='',
+                      help='only run benchmarks whose name contains this')
+    parser.add_option('--scale', type='float', default=1.0,
+                      help='multiply the number of calls by this')
+    parser.add_option('--metrics', action='store_true',
+                      help='run with an in-memory metrics exporter enabled')
+    options, args = parser.parse_args(argv)
+
+    if options.metrics:
+        metrics.enable()
+
+    server = testserver.DirectLinkServer().start()
+    pooled = transport.PooledTransport(pool_size=1)
+    results = []
+
+    try:
+        print('%-40s %10s %9s %9s %9s' % ('', 'ops/sec', 'p50 us',
+                                         'p95 us', 'p99 us'))
+        for name, func, number in get_benchmarks(server.get_url(), pooled):
+            if options.filter not in name:
+                continue
+
+            # Warm up caches and connections first
+            for i in range(10):
+                func()
+
+            result = measure(func, max(1, int(number * options.scale)))
+            results.append((name, result))
+            print('%-40s %10.0f %9.1f %9.1f %9.1f' % (
+                name, result['ops'], result['p50'], result['p95'],
+                result['p99']))
+    finally:
+        pooled.close()
+        server.close()
+
+    if options.save:
+        with open(options.save, 'w') as f:
+            json.dump(dict(results), f, indent=2, sort_keys=True)
+
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+
+        print('')
+        if compare(results, baseline, options.tolerance):
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
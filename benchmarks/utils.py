@@ -0,0 +1,65 @@
+"""
+Helpers shared by the benchmark scripts in this directory.
+"""
+
+import os
+import sys
+import timeit
+
+# Benchmark the checkout we live in, not an installed copy
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def setup_django(**options):
+    """ Give django_ogone.settings something to read from. """
+
+    try:
+        from django.conf import settings
+    except ImportError:
+        return
+
+    if not settings.configured:
+        settings.configure(**options)
+
+        import django
+        if hasattr(django, 'setup'):
+            django.setup()
+
+
+def bench(name, func, number):
+    """ Print the best ops/sec of three runs of `number` calls. """
+
+    seconds = min(timeit.repeat(func, number=number, repeat=3))
+    ops = number / seconds
+    print('%-40s %10.0f ops/sec' % (name, ops))
+
+    return ops
+
+
+def percentile(values, fraction):
+    """ The `fraction` percentile of the sorted `values`. """
+
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def measure(func, number):
+    """ Call `func` `number` times, timing each call. Returns the ops/sec
+        and the p50/p95/p99 latencies in microseconds. """
+
+    timer = timeit.default_timer
+    latencies = []
+
+    start = timer()
+    for i in range(number):
+        before = timer()
+        func()
+        latencies.append(timer() - before)
+    seconds = timer() - start
+
+    latencies.sort()
+    result = {'ops': number / seconds}
+    for name, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+        result[name] = percentile(latencies, fraction) * 1e6
+
+    return result
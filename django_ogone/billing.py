@@ -0,0 +1,398 @@
+"""
+Recurring billing: charging stored cards (aliases) through DirectLink.
+
+A :class:`Biller` takes the charges that are due, as :class:`Charge`
+tuples from any iterable (a queryset of subscriptions, a file, ...), and
+sends a DirectLink order for each of them with
+:meth:`OgoneDirectLink.order <django_ogone.ogone.OgoneDirectLink.order>`,
+`workers` at a time and no more than `rate` per second. The outcomes are
+classified with :mod:`django_ogone.status_codes` and handed to an `apply`
+callable in batches, so you can mark subscriptions paid or start dunning.
+
+Every charge is written to a :class:`Journal` before its order is sent,
+again once Ogone answered and once its result was applied. Run the same
+charges with the same journal after a crash and charges whose results
+were applied are skipped, while those Ogone answered are applied without
+another order. Charges which were in flight are looked up with a status
+query first, and only sent again when Ogone never got them, so nobody is
+charged twice. The orderID is what
+identifies a charge, so it has to be unique for every charge.
+
+>>> charge = Charge('sub-12-2010-10', 'ALIAS12', 995)
+>>> charge.get_data()['ECI']
+9
+"""
+
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+from django_ogone import settings as ogone_settings
+from django_ogone import status_codes
+from django_ogone import exceptions as ogone_exceptions
+from django_ogone import pool as ogone_pool
+
+log = logging.getLogger('django_ogone')
+
+# Journal states: the order may have been sent, Ogone answered it, or it
+# certainly wasn't sent
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+# The NCERROR of a status query for an order Ogone never got
+UNKNOWN_ORDER_NCERROR = '50001130'
+
+# Electronic Commerce Indicator for recurring payments
+RECURRING_ECI = 9
+
+
+class Charge(collections.namedtuple('Charge',
+                                    'order_id alias amount currency params')):
+    """ A due charge of `amount` cents on the card stored as `alias`.
+        `params` are any further DirectLink parameters. """
+
+    __slots__ = ()
+
+    def __new__(cls, order_id, alias, amount, currency=None, params=None):
+        return super(Charge, cls).__new__(cls, order_id, alias, amount,
+                                          currency, params)
+
+    def get_data(self, settings=ogone_settings):
+        """ The (unsigned) DirectLink order parameters. """
+
+        data = {
+            'ECI': RECURRING_ECI,
+            'OPERATION': 'SAL',
+        }
+        data.update(self.params or {})
+        data.update({
+            'orderID': self.order_id,
+            'ALIAS': self.alias,
+            'amount': self.amount,
+            'currency': self.currency or getattr(settings, 'CURRENCY',
+                                                 ogone_settings.CURRENCY),
+        })
+
+        return data
+
+
+class ChargeResult(collections.namedtuple('ChargeResult',
+                                          'charge state status ncerror payid')):
+    """ What became of a charge. `state` is DONE when Ogone answered,
+        FAILED when the order wasn't sent and PENDING when we couldn't find
+        out (the next run will). """
+
+    __slots__ = ()
+
+    @property
+    def category(self):
+        """ The status category of the charge, 'error' for orders Ogone
+            turned down without a status, and None unless the state is
+            DONE. """
+
+        if self.state != DONE:
+            return None
+        if self.status is None:
+            return 'error'
+
+        info = status_codes.get_status_info(self.status)
+        if info is None:
+            return 'unknown'
+        return info.category or 'other'
+
+
+def _to_status(value):
+    if value is None or value == '':
+        return None
+    return int(value)
+
+
+class Journal(object):
+    """ An append-only file with a JSON line per charge state change, and
+        one for every batch of results applied. With `sync`, every line is
+        on disk before the order goes out. """
+
+    def __init__(self, path, sync=True):
+        self.path = path
+        self.sync = sync
+
+        self._file = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """ Return the last entry for every order id, with ``applied`` set
+            once its result was applied. """
+
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash; its charge is pending
+                    log.warning('Skipping a broken line in %s', self.path)
+                    continue
+
+                if 'applied' in entry:
+                    for order_id in entry['applied']:
+                        if order_id in entries:
+                            entries[order_id]['applied'] = True
+                else:
+                    entries[entry['order_id']] = entry
+
+        return entries
+
+    def record(self, order_id, state, **info):
+        info.update({'order_id': order_id, 'state': state})
+        self._write(info)
+
+    def record_applied(self, order_ids):
+        """ Record that the results of `order_ids` were applied. """
+
+        self._write({'applied': list(order_ids)})
+
+    def _write(self, entry):
+        line = json.dumps(entry) + '\n'
+
+        with self._lock:
+            if self._file is None:
+                self._file = self._open()
+            self._file.write(line)
+            self._file.flush()
+            if self.sync:
+                os.fsync(self._file.fileno())
+
+    def _open(self):
+        f = open(self.path, 'a')
+
+        if os.path.getsize(self.path):
+            with open(self.path, 'rb') as existing:
+                existing.seek(-1, os.SEEK_END)
+                if existing.read(1) != '\n':
+                    # A crash cut the last line short: end it, or the
+                    # next line would be lost along with it
+                    f.write('\n')
+
+        return f
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class Biller(object):
+    """
+    Charges due :class:`Charge` objects through DirectLink.
+
+    `apply` is called with a list of :class:`ChargeResult` for every
+    `batch_size` charges that were sent or resolved. `journal` is a path or
+    a :class:`Journal`; use a new one for every billing run.
+    """
+
+    def __init__(self, journal, apply=None, url=None, query_url=None,
+                 settings=ogone_settings, transport=None, workers=None,
+                 rate=None, batch_size=100):
+        from django_ogone.ogone import OgoneDirectLink
+
+        assert batch_size > 0
+
+        if url is None:
+            url = OgoneDirectLink.get_order_action(settings=settings)
+        if query_url is None:
+            query_url = OgoneDirectLink.get_query_action(settings=settings)
+        if workers is None:
+            workers = ogone_settings.BILLING_WORKERS
+        if rate is None:
+            rate = ogone_settings.BILLING_RATE
+        if isinstance(journal, basestring):
+            journal = Journal(journal)
+
+        self.journal = journal
+        self.apply = apply
+        self.url = url
+        self.query_url = query_url
+        self.settings = settings
+        self.transport = transport
+        self.workers = workers
+        self.rate = rate
+        self.batch_size = batch_size
+
+        self.report = self._new_report()
+
+    @staticmethod
+    def _new_report():
+        return {
+            'due': 0,
+            'skipped': 0,
+            'resolved': 0,
+            'charged': 0,
+            'failed': 0,
+            'uncertain': 0,
+            'categories': {},
+        }
+
+    def _result(self, charge, state, response=None):
+        status = ncerror = payid = None
+        if response is not None:
+            status = _to_status(response.get('STATUS'))
+            ncerror = response.get('NCERROR')
+            payid = response.get('PAYID')
+
+        self.journal.record(charge.order_id, state, status=status,
+                            ncerror=ncerror, payid=payid)
+        return ChargeResult(charge, state, status, ncerror, payid)
+
+    def charge(self, charge):
+        """ Send the order for `charge` and return its result. """
+
+        from django_ogone.ogone import OgoneDirectLink
+
+        self.journal.record(charge.order_id, PENDING)
+        try:
+            response = OgoneDirectLink.order(
+                self.url, charge.get_data(self.settings),
+                settings=self.settings, transport=self.transport)
+        except (ogone_exceptions.ConnectException,
+                ogone_exceptions.CircuitOpenException) as e:
+            log.warning('Could not send the order for %s: %r',
+                        charge.order_id, e)
+            return self._result(charge, FAILED)
+        except ogone_exceptions.TransportException as e:
+            # Ogone may well have received it
+            log.error('The outcome of the order for %s is unknown: %r',
+                      charge.order_id, e)
+            return ChargeResult(charge, PENDING, None, None, None)
+
+        return self._result(charge, DONE, response)
+
+    def resolve(self, charge):
+        """ Find out whether Ogone got the order for `charge`, which was in
+            flight when an earlier run ended. Returns its result, or None
+            if Ogone never got it. """
+
+        from django_ogone.ogone import OgoneDirectLink
+
+        try:
+            response = OgoneDirectLink.query(
+                self.query_url, {'orderID': charge.order_id},
+                settings=self.settings, transport=self.transport)
+        except ogone_exceptions.OgoneException as e:
+            log.error('Could not look up the order for %s: %r',
+                      charge.order_id, e)
+            return ChargeResult(charge, PENDING, None, None, None)
+
+        ncerror = response.get('NCERROR', '0')
+        if ncerror == UNKNOWN_ORDER_NCERROR:
+            return None
+        if ncerror != '0':
+            log.error('Could not look up the order for %s: NCERROR %s',
+                      charge.order_id, ncerror)
+            return ChargeResult(charge, PENDING, None, None, None)
+
+        log.info('Order for %s reached Ogone before', charge.order_id)
+        return self._result(charge, DONE, response)
+
+    def _process(self, item):
+        charge, entry = item
+        state = entry and entry['state']
+
+        if state == DONE:
+            # Answered before, but never applied
+            return ChargeResult(charge, DONE, entry.get('status'),
+                                entry.get('ncerror'), entry.get('payid')), True
+
+        if state == PENDING:
+            result = self.resolve(charge)
+            if result is not None:
+                return result, True
+
+        return self.charge(charge), False
+
+    def _schedule(self, charges):
+        """ Yield the charges to process, paced to `rate` per second, with
+            their journal entry of an earlier run. """
+
+        entries = self.journal.load()
+        interval = self.rate and 1.0 / self.rate or 0
+        due = time.time()
+
+        for charge in charges:
+            self.report['due'] += 1
+
+            entry = entries.get(charge.order_id)
+            state = entry and entry['state']
+            if state == DONE:
+                if entry.get('applied'):
+                    self.report['skipped'] += 1
+                else:
+                    yield charge, entry
+                continue
+
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            due = max(due, time.time() - interval) + interval
+
+            yield charge, entry
+
+    def run(self, charges):
+        """
+        Charge `charges`, an iterable of :class:`Charge`, and return the
+        report: the number of charges due, skipped because an earlier run
+        charged them and applied the result, resolved from such a run,
+        charged now, failed to send and of uncertain outcome, and the
+        charges per status category.
+        """
+
+        report = self.report
+        batch = []
+
+        try:
+            for item, outcome in ogone_pool.imap_unordered(
+                    self._process, self._schedule(charges),
+                    workers=self.workers):
+                if isinstance(outcome, Exception):
+                    # Leaves the charge pending, it is looked up next time
+                    log.error('Charging %s failed: %r', item[0].order_id,
+                              outcome)
+                    report['uncertain'] += 1
+                    continue
+
+                result, resolved = outcome
+                if result.state == FAILED:
+                    report['failed'] += 1
+                elif result.state == PENDING:
+                    report['uncertain'] += 1
+                else:
+                    report[resolved and 'resolved' or 'charged'] += 1
+                    categories = report['categories']
+                    categories[result.category] = \
+                        categories.get(result.category, 0) + 1
+
+                if result.state != PENDING:
+                    batch.append(result)
+                    if len(batch) >= self.batch_size:
+                        self._apply(batch)
+                        batch = []
+
+            if batch:
+                self._apply(batch)
+        finally:
+            self.journal.close()
+
+        return report
+
+    def _apply(self, results):
+        if self.apply is not None:
+            self.apply(results)
+        self.journal.record_applied([result.charge.order_id
+                                     for result in results])
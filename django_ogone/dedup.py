@@ -0,0 +1,210 @@
+"""
+Short-circuits duplicate postbacks.
+
+Ogone regularly notifies us of the same status more than once (the
+browser redirect plus its own server-to-server retries). A
+:class:`PostbackDeduplicator` remembers the verdict for every signed
+postback it has seen, keyed by a digest of all of its parameters, so a
+repeated postback neither pays for signature verification again nor fires
+``ogone_update_order`` twice. A postback differing in any parameter, say a
+forged AMOUNT with a genuine SHASIGN, is verified on its own.
+
+The verdicts are kept in-process (:class:`LocalCache`) or in Django's
+cache framework (:class:`DjangoCache`) when several processes handle
+postbacks. Choose with ``OGONE_POSTBACK_DEDUP_BACKEND``.
+"""
+
+import collections
+import hashlib
+import threading
+import time
+
+from django_ogone import settings as ogone_settings
+from django_ogone import dispatch as ogone_dispatch
+
+
+class LocalCache(object):
+    """
+    A bounded LRU cache whose entries expire after `ttl` seconds. Safe to
+    share between threads.
+
+    >>> cache = LocalCache(max_entries=2)
+    >>> cache.add('a', True), cache.add('b', False), cache.add('a', False)
+    (True, True, False)
+    >>> cache.add('c', True)
+    True
+    >>> cache.get('a'), cache.get('b'), cache.get('c')
+    (None, False, True)
+    >>> cache.delete('b')
+    >>> cache.add('b', True)
+    True
+    """
+
+    def __init__(self, max_entries=10000, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        # key -> (value, expires)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+
+            value, expires = entry
+            if expires < time.time():
+                return None
+
+            # Move it to the end, we evict from the front
+            self._entries[key] = entry
+            return value
+
+    def add(self, key, value):
+        """ Store `value` unless `key` is cached already. Returns whether
+            the value was stored. """
+
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] >= now:
+                return False
+
+            self._entries.pop(key, None)
+            self._entries[key] = (value, now + self.ttl)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class DjangoCache(object):
+    """ Keeps the verdicts in one of Django's caches. """
+
+    def __init__(self, alias='default', ttl=3600, prefix='ogone-postback:'):
+        try:
+            from django.core.cache import caches
+            self.cache = caches[alias]
+        except ImportError:
+            from django.core.cache import get_cache
+            self.cache = get_cache(alias)
+
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.cache.get(self.prefix + key)
+
+    def add(self, key, value):
+        return self.cache.add(self.prefix + key, value, self.ttl)
+
+    def delete(self, key):
+        self.cache.delete(self.prefix + key)
+
+
+class PostbackDeduplicator(object):
+    """ Verifies and dispatches each distinct postback only once. """
+
+    def __init__(self, cache=None):
+        if cache is None:
+            cache = LocalCache()
+
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(params):
+        """ The cache key for normalized `params`, a digest of every one of
+            them. None for unsigned postbacks. """
+
+        if 'SHASIGN' not in params:
+            return None
+
+        digest = hashlib.sha1()
+        for item in sorted(params.items()):
+            for part in item:
+                if isinstance(part, unicode):
+                    part = part.encode('utf8')
+                else:
+                    part = str(part)
+                # Length prefixed, so no two sets of params run together
+                digest.update('%d:%s' % (len(part), part))
+
+        return digest.hexdigest()
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def process(self, ogone, dispatch=True):
+        """ Return whether the postback handled by `ogone` is valid, and
+            send ogone_update_order for valid ones, unless we have seen
+            this postback before. """
+
+        key = self.get_key(ogone.params)
+        if key is not None:
+            valid = self.cache.get(key)
+            if valid is not None:
+                self._count(True)
+                return valid
+
+        self._count(False)
+        valid = ogone.is_valid()
+
+        # Only the first of several concurrent duplicates gets to dispatch
+        first = key is None or self.cache.add(key, valid)
+        if valid and dispatch and first:
+            # Forget postbacks we failed to dispatch, so a retry gets through
+            on_failure = None
+            if key is not None:
+                on_failure = lambda: self.cache.delete(key)
+            try:
+                dispatched = ogone_dispatch.dispatch_update(ogone, on_failure)
+            except Exception:
+                if key is not None:
+                    self.cache.delete(key)
+                raise
+            if not dispatched and key is not None:
+                self.cache.delete(key)
+
+        return valid
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+_deduplicator = None
+_deduplicator_lock = threading.Lock()
+
+
+def get_deduplicator():
+    """ Return the deduplicator configured in the settings. """
+
+    global _deduplicator
+
+    if _deduplicator is None:
+        with _deduplicator_lock:
+            if _deduplicator is None:
+                if ogone_settings.POSTBACK_DEDUP_BACKEND == 'django':
+                    cache = DjangoCache(
+                        ogone_settings.POSTBACK_DEDUP_CACHE_ALIAS,
+                        ttl=ogone_settings.POSTBACK_DEDUP_TTL)
+                else:
+                    cache = LocalCache(
+                        ogone_settings.POSTBACK_DEDUP_MAX_ENTRIES,
+                        ttl=ogone_settings.POSTBACK_DEDUP_TTL)
+                _deduplicator = PostbackDeduplicator(cache)
+
+    return _deduplicator
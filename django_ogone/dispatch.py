@@ -0,0 +1,201 @@
+"""
+Sending ``ogone_update_order`` off the request path.
+
+By default the signal is sent synchronously, so whatever the receivers do
+(database writes, emails, ...) adds to the response time Ogone sees. With
+``OGONE_DISPATCH_MODE = 'async'`` verified postbacks are put on a bounded
+queue and the signal is sent from a pool of worker threads instead.
+
+Postbacks for the same ORDERID always end up on the same worker, so
+receivers see the updates of an order in the order they arrived. When the
+queue is full, ``OGONE_DISPATCH_POLICY`` decides what happens:
+
+- ``'block'`` waits up to ``OGONE_DISPATCH_TIMEOUT`` seconds for room and
+  raises DispatchQueueFullException after that
+- ``'drop'`` logs an error and drops the update (Ogone will retry
+  postbacks we don't acknowledge, but this one we did)
+
+There is no policy sending the signal from the calling thread: that would
+overtake the updates of the order still in the queue.
+
+Pending updates are sent before the process exits. Dispatching after
+:meth:`AsyncDispatcher.shutdown` raises DispatcherShutdownException.
+"""
+
+import atexit
+import logging
+import threading
+import Queue
+
+from django_ogone import exceptions as ogone_exceptions
+from django_ogone import settings as ogone_settings
+
+log = logging.getLogger('django_ogone')
+
+POLICIES = ('block', 'drop')
+
+# Sentinel telling a worker thread to exit
+_STOP = object()
+
+
+def send_update(ogone, robust=False):
+    """ Send ogone_update_order for `ogone` from the current thread.
+        With `robust`, failing receivers are logged, not raised. """
+
+    from django_ogone import signals as ogone_signals
+
+    if not robust:
+        return ogone_signals.ogone_update_order.send(sender=ogone.__class__,
+                                                     ogone=ogone)
+
+    responses = ogone_signals.ogone_update_order.send_robust(
+        sender=ogone.__class__, ogone=ogone)
+    for receiver, response in responses:
+        if isinstance(response, Exception):
+            log.error('ogone_update_order receiver %r failed: %r',
+                      receiver, response)
+
+    return responses
+
+
+class AsyncDispatcher(object):
+    """ Sends ogone_update_order from `workers` threads. """
+
+    def __init__(self, workers=4, maxsize=1000, policy='block', timeout=None):
+        assert workers > 0
+        assert policy in POLICIES, 'Unknown dispatch policy %s' % policy
+
+        self.policy = policy
+        self.timeout = timeout
+        self._stopped = False
+        # Guards _stopped and counts the puts in progress, so shutdown
+        # queues _STOP behind every update it accepted
+        self._putting = 0
+        self._condition = threading.Condition()
+
+        # One queue per worker to keep the updates of an order in sequence
+        queue_size = max(1, maxsize // workers)
+        self._queues = [Queue.Queue(queue_size) for i in range(workers)]
+        self._threads = []
+        for queue in self._queues:
+            thread = threading.Thread(target=self._work, args=(queue,))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self, queue):
+        while True:
+            item = queue.get()
+            if item is _STOP:
+                return
+
+            ogone, on_failure = item
+            try:
+                responses = send_update(ogone, robust=True)
+                failed = any([isinstance(response, Exception)
+                              for receiver, response in responses])
+            except Exception:
+                log.exception('Failed to dispatch Ogone update')
+                failed = True
+
+            if failed and on_failure is not None:
+                try:
+                    on_failure()
+                except Exception:
+                    log.exception('Failure callback for Ogone update failed')
+
+    def _get_queue(self, ogone):
+        order_id = ogone.params.get('ORDERID')
+
+        return self._queues[hash(order_id) % len(self._queues)]
+
+    def dispatch(self, ogone, on_failure=None):
+        """ Queue `ogone` for dispatching. Returns False if it was dropped.
+            `on_failure` is called from the worker when a receiver fails. """
+
+        with self._condition:
+            if self._stopped:
+                raise ogone_exceptions.DispatcherShutdownException(
+                    'Dispatcher has been shut down')
+            self._putting += 1
+
+        queue = self._get_queue(ogone)
+        try:
+            if self.policy == 'block':
+                queue.put((ogone, on_failure), True, self.timeout)
+            else:
+                queue.put_nowait((ogone, on_failure))
+        except Queue.Full:
+            if self.policy == 'drop':
+                log.error('Dispatch queue full, dropped update for order %s',
+                          ogone.params.get('ORDERID'))
+                return False
+            else:
+                raise ogone_exceptions.DispatchQueueFullException(
+                    'No room in the dispatch queue after %s seconds' %
+                    self.timeout)
+        finally:
+            with self._condition:
+                self._putting -= 1
+                self._condition.notify_all()
+
+        return True
+
+    def pending(self):
+        """ The approximate number of queued updates. """
+
+        return sum([queue.qsize() for queue in self._queues])
+
+    def shutdown(self, wait=True):
+        """ Stop accepting updates and let the workers drain their queues. """
+
+        with self._condition:
+            if self._stopped:
+                return
+            self._stopped = True
+
+            while self._putting:
+                self._condition.wait()
+
+        for queue in self._queues:
+            queue.put(_STOP)
+
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """ Return the dispatcher configured in the settings. """
+
+    global _dispatcher
+
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = AsyncDispatcher(
+                    workers=ogone_settings.DISPATCH_WORKERS,
+                    maxsize=ogone_settings.DISPATCH_QUEUE_SIZE,
+                    policy=ogone_settings.DISPATCH_POLICY,
+                    timeout=ogone_settings.DISPATCH_TIMEOUT)
+                atexit.register(_dispatcher.shutdown)
+
+    return _dispatcher
+
+
+def dispatch_update(ogone, on_failure=None):
+    """ Send ogone_update_order for a verified postback, synchronously or
+        through the dispatcher depending on OGONE_DISPATCH_MODE.
+
+        Synchronously, failing receivers raise. When dispatching async,
+        `on_failure` is called once the worker sees a receiver fail. """
+
+    if ogone_settings.DISPATCH_MODE == 'async':
+        return get_dispatcher().dispatch(ogone, on_failure)
+
+    send_update(ogone)
+    return True
@@ -8,6 +8,35 @@ class InvalidSignatureException(OgoneException):
 class InvalidParamsException(OgoneException):
     pass
 
+class UnknownMerchantException(OgoneException):
+    pass
+
+class DispatchQueueFullException(OgoneException):
+    pass
+
+class DispatcherShutdownException(OgoneException):
+    pass
+
+class TransportException(OgoneException):
+    def __init__(self, message, status=None):
+        super(TransportException, self).__init__(message)
+
+        self.status = status
+
+class ConnectException(TransportException):
+    """ The connection to Ogone couldn't be made, so nothing was sent. """
+    pass
+
+class TimeoutException(TransportException):
+    pass
+
+class CircuitOpenException(OgoneException):
+    pass
+
+class RateLimitException(OgoneException):
+    """ A DirectLink call would have had to wait too long for its turn. """
+    pass
+
 class UnknownStatusException(OgoneException):
     def __init__(self, status):
         assert isinstance(status, int)
@@ -0,0 +1,203 @@
+"""
+Streaming import of Ogone transaction export files.
+
+The exports are read one row at a time and handed to a sink in batches of
+`batch_size` :class:`~django_ogone.result.OgoneResult` objects, so memory
+use doesn't depend on the size of the file. A sink is any callable taking
+a list of results; :class:`UpsertSink` stores them as
+:class:`~django_ogone.models.Payment` rows and :class:`BulkCreateSink`
+creates rows of a model of your own. Sinks with a `validate` method get to
+check every result first: rows it raises KeyError, TypeError or ValueError
+for are skipped as invalid, like rows without a usable ORDERID or STATUS.
+Such sinks are handed what `validate` returned instead of the results, so
+they don't have to convert the rows again.
+
+CSV files need a header row. XML files are read as a sequence of `tag`
+elements (PAYMENT by default), with the fields as attributes or as child
+elements. Column names are upper cased; rename the ones which differ from
+the Ogone parameter names with `columns`.
+
+>>> import StringIO
+>>> export = StringIO.StringIO('PAYID;ORDER;STATUS;TRXDATE\\n'
+...                            '8285812;13;9;09/24/10\\n'
+...                            '8285813;14;1;09/25/10\\n')
+>>> batches = []
+>>> report = Importer(batches.append, columns={'ORDER': 'ORDERID'}).run(export)
+>>> sorted(report.items())
+[('batches', 1), ('imported', 2), ('invalid', 0), ('rows', 2)]
+>>> [(r.order_id, r.status, r.transaction_date) for r in batches[0]]
+[(13, 9, datetime.date(2010, 9, 24)), (14, 1, datetime.date(2010, 9, 25))]
+"""
+
+import csv
+import logging
+from xml.etree import cElementTree
+
+from django_ogone import result as ogone_result
+
+log = logging.getLogger('django_ogone')
+
+FORMATS = ('csv', 'xml')
+
+
+def _normalize(row, columns):
+    params = {}
+    for key, value in row.items():
+        if key is None:
+            continue
+        key = key.strip().upper()
+        params[columns.get(key, key)] = value
+
+    return params
+
+
+def iter_csv(f, delimiter=None, columns=None, encoding='latin1'):
+    """ Yield the rows of the CSV export `f` as dicts of parameters. The
+        delimiter is guessed from the header unless given. """
+
+    columns = dict([(k.upper(), v) for k, v in (columns or {}).items()])
+
+    header = f.readline()
+    if delimiter is None:
+        delimiter = csv.Sniffer().sniff(header, ';,\t|').delimiter
+    fieldnames = next(csv.reader([header], delimiter=delimiter))
+
+    for row in csv.DictReader(f, fieldnames, delimiter=delimiter):
+        for key, value in row.items():
+            if isinstance(value, str):
+                row[key] = value.decode(encoding)
+        yield _normalize(row, columns)
+
+
+def iter_xml(f, tag='PAYMENT', columns=None):
+    """ Yield the `tag` elements of the XML export `f` as dicts of
+        parameters. """
+
+    columns = dict([(k.upper(), v) for k, v in (columns or {}).items()])
+    root = None
+
+    for event, element in cElementTree.iterparse(f, ('start', 'end')):
+        if root is None:
+            root = element
+        if event != 'end' or element.tag != tag:
+            continue
+
+        row = dict(element.attrib)
+        for child in element:
+            row[child.tag] = child.text or ''
+        yield _normalize(row, columns)
+
+        # Drop what we've read so the tree doesn't grow with the file
+        element.clear()
+        root.clear()
+
+
+class Importer(object):
+    """ Feeds the rows of export files to `sink` in batches. """
+
+    def __init__(self, sink, format='csv', batch_size=1000, **options):
+        assert format in FORMATS, 'Unknown export format %s' % format
+        assert batch_size > 0
+
+        self.sink = sink
+        self.format = format
+        self.batch_size = batch_size
+        self.options = options
+
+    def iter_rows(self, f):
+        if self.format == 'xml':
+            return iter_xml(f, **self.options)
+        return iter_csv(f, **self.options)
+
+    def iter_results(self, f, report):
+        """ Yield an OgoneResult for every row with a usable ORDERID and
+            STATUS, converting them the way postbacks are converted, which
+            the sink accepts. Yields what the sink's `validate` returned
+            for them instead, if it has one. """
+
+        validate = getattr(self.sink, 'validate', None)
+
+        for params in self.iter_rows(f):
+            report['rows'] += 1
+
+            result = ogone_result.OgoneResult(params)
+            try:
+                result.order_id, result.status
+                if validate is not None:
+                    result = validate(result)
+            # ArithmeticError for amounts Decimal can't read
+            except (KeyError, TypeError, ValueError, ArithmeticError):
+                log.warning('Skipping row %d of the export: %r',
+                            report['rows'], params)
+                report['invalid'] += 1
+                continue
+
+            yield result
+
+    def run(self, f):
+        """ Import the export file `f` (a path or an open file) and return
+            the number of rows read, imported and skipped as invalid and the
+            number of batches. """
+
+        if isinstance(f, basestring):
+            with open(f, 'rb') as opened:
+                return self.run(opened)
+
+        report = {'rows': 0, 'imported': 0, 'invalid': 0, 'batches': 0}
+
+        batch = []
+        for result in self.iter_results(f, report):
+            batch.append(result)
+            if len(batch) >= self.batch_size:
+                self._flush(batch, report)
+                batch = []
+
+        if batch:
+            self._flush(batch, report)
+
+        return report
+
+    def _flush(self, batch, report):
+        self.sink(batch)
+        report['imported'] += len(batch)
+        report['batches'] += 1
+
+
+class UpsertSink(object):
+    """ Stores results as Payments, see PaymentManager.bulk_upsert. """
+
+    def __init__(self, manager=None):
+        if manager is None:
+            from django_ogone.models import Payment
+            manager = Payment.objects
+
+        self.manager = manager
+
+    def validate(self, result):
+        from django_ogone.models import Payment
+
+        return Payment.get_fields(result)
+
+    def __call__(self, fields):
+        self.manager.bulk_upsert_fields(fields, batch_size=len(fields))
+
+
+class BulkCreateSink(object):
+    """ Creates a row of `model` for every result with bulk_create.
+        `get_fields` returns the field values for a result, by default
+        those of Payment.get_fields. """
+
+    def __init__(self, model, get_fields=None):
+        if get_fields is None:
+            from django_ogone.models import Payment
+            get_fields = Payment.get_fields
+
+        self.model = model
+        self.get_fields = get_fields
+
+    def validate(self, result):
+        return self.get_fields(result)
+
+    def __call__(self, fields):
+        self.model._default_manager.bulk_create(
+            [self.model(**values) for values in fields])
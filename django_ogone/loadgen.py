@@ -0,0 +1,274 @@
+"""
+Fires signed postbacks at your own order status view to find out how many
+it can handle.
+
+Every postback is the 20-field notification Ogone sends for a paid order,
+with a fresh ORDERID and PAYID, signed with your SHA-OUT secret through
+:class:`~django_ogone.security.OgoneSignature` so the view accepts it. The
+postbacks go out at a fixed rate (open loop) from a pool of worker threads,
+as a GET query string encoded in latin1 by default, like Ogone's
+redirects. A slow view doesn't hold the schedule back: postbacks queue up
+for a free worker instead, and latencies are measured from the time each
+postback was due, so that time spent queueing counts too. From the
+command line::
+
+    python -m django_ogone.loadgen http://127.0.0.1:8000/order_status_update/ \\
+        --secret <SHA_POST_SECRET> --rate 200 --duration 30
+
+>>> params = make_postback(7, 'test12345', hash_method='sha1')
+>>> params['ORDERID'], params['PAYID'], params['SHASIGN']
+('7', '8000007', '0AF18536A45802DF06380974EF398AE2096C3146')
+"""
+
+import httplib
+import logging
+import optparse
+import socket
+import sys
+import threading
+import time
+import urllib
+import urlparse
+
+from django_ogone import security as ogone_security
+from django_ogone import pool as ogone_pool
+
+log = logging.getLogger('django_ogone')
+
+# The postback Ogone sends for a paid order
+POSTBACK = {u'ORDERID': u'13', u'STATUS': u'9', u'CARDNO': u'XXXXXXXXXXXX1111', u'VC': u'NO', u'PAYID': u'8285812', u'CN': u'Kaast Achternaam', u'NCERROR': u'0', u'IP': u'82.139.114.10', u'IPCTY': u'NL', u'CURRENCY': u'EUR', u'CCCTY': u'US', u'AAVCHECK': u'NO', u'BRAND': u'VISA', u'ACCEPTANCE': u'test123', u'ECI': u'7', u'TRXDATE': u'09/24/10', u'AMOUNT': u'6794.81', u'CVCCHECK': u'NO', u'ED': u'0111', u'PM': u'CreditCard'}
+
+
+def make_postback(number, secret, hash_method='sha512', status=9,
+                  template=POSTBACK):
+    """ Return the signed postback parameters for the `number`th order. """
+
+    params = dict(template)
+    params['ORDERID'] = str(number)
+    params['PAYID'] = str(8000000 + number)
+    params['STATUS'] = str(status)
+    params['SHASIGN'] = ogone_security.OgoneSignature(
+        params, hash_method, secret).signature()
+
+    return params
+
+
+def encode_postback(params, encoding='latin1'):
+    """ Return `params` as a query string in `encoding`. """
+
+    return urllib.urlencode(sorted(
+        [(key, unicode(value).encode(encoding))
+         for key, value in params.items()]))
+
+
+class LoadReport(object):
+    """ What happened during a run. Latencies are in seconds. """
+
+    def __init__(self, latencies, statuses, errors, seconds):
+        self.latencies = sorted(latencies)
+        self.statuses = statuses
+        self.errors = errors
+        self.seconds = seconds
+
+    @property
+    def sent(self):
+        return len(self.latencies)
+
+    @property
+    def failed(self):
+        return sum(self.errors.values()) + sum(
+            [count for status, count in self.statuses.items()
+             if status >= 400])
+
+    @property
+    def rate(self):
+        return self.sent / self.seconds if self.seconds else 0.0
+
+    def percentile(self, fraction):
+        if not self.latencies:
+            return None
+
+        index = int(round(fraction * (len(self.latencies) - 1)))
+        return self.latencies[index]
+
+    def __str__(self):
+        lines = ['%d postbacks in %.1fs (%.1f/s), %d failed' % (
+            self.sent, self.seconds, self.rate, self.failed)]
+        if self.latencies:
+            lines.append('latency p50 %.1fms, p95 %.1fms, p99 %.1fms' % tuple(
+                [self.percentile(f) * 1000 for f in (0.5, 0.95, 0.99)]))
+        for status, count in sorted(self.statuses.items()):
+            lines.append('HTTP %d: %d' % (status, count))
+        for error, count in sorted(self.errors.items()):
+            lines.append('%s: %d' % (error, count))
+
+        return '\n'.join(lines)
+
+
+class LoadGenerator(object):
+    """ Sends postbacks to `url` at `rate` per second from `workers`
+        threads. """
+
+    def __init__(self, url, secret, hash_method='sha512', rate=50, workers=8,
+                 method='GET', encoding='latin1', status=9, timeout=10):
+        assert rate > 0
+        assert method in ('GET', 'POST')
+
+        parts = urlparse.urlsplit(url)
+        assert parts.scheme in ('http', 'https'), 'Unsupported url: %s' % url
+
+        self.url = url
+        self.secret = secret
+        self.hash_method = hash_method
+        self.rate = rate
+        self.workers = workers
+        self.method = method
+        self.encoding = encoding
+        self.status = status
+        self.timeout = timeout
+
+        self._address = (parts.scheme, parts.hostname,
+                         parts.port or (parts.scheme == 'https' and 443 or 80))
+        self._path = parts.path or '/'
+        self._local = threading.local()
+
+    def _get_connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            scheme, host, port = self._address
+            if scheme == 'https':
+                connection_class = httplib.HTTPSConnection
+            else:
+                connection_class = httplib.HTTPConnection
+            connection = connection_class(host, port, timeout=self.timeout)
+            self._local.connection = connection
+
+        return connection
+
+    def send(self, number):
+        """ Send the postback for the `number`th order. Returns the HTTP
+            status and the latency in seconds. """
+
+        params = make_postback(number, self.secret, self.hash_method,
+                               self.status)
+        query = encode_postback(params, self.encoding)
+
+        if self.method == 'GET':
+            path, body = '%s?%s' % (self._path, query), None
+            headers = {}
+        else:
+            path, body = self._path, query
+            headers = {'Content-Type': 'application/x-www-form-urlencoded; '
+                                       'charset=%s' % self.encoding}
+
+        started = time.time()
+        connection = self._get_connection()
+        try:
+            connection.request(self.method, path, body, headers)
+            response = connection.getresponse()
+            response.read()
+        except (httplib.HTTPException, socket.error):
+            connection.close()
+            self._local.connection = None
+            raise
+
+        if response.will_close:
+            connection.close()
+            self._local.connection = None
+
+        return response.status, time.time() - started
+
+    def _schedule(self, count, duration):
+        """ Yield order numbers with their time slot, each at that
+            time. """
+
+        interval = 1.0 / self.rate
+        started = time.time()
+        number = 0
+
+        while count is None or number < count:
+            due = started + number * interval
+            if duration is not None and due - started >= duration:
+                return
+
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+            yield number, due
+            number += 1
+
+    def run(self, count=None, duration=None):
+        """ Send `count` postbacks, or keep sending for `duration` seconds,
+            and return a :class:`LoadReport`. """
+
+        assert count is not None or duration is not None
+
+        latencies = []
+        statuses = {}
+        errors = {}
+
+        started = time.time()
+        # Never wait for responses before sending the next postback
+        for item, result in ogone_pool.imap_unordered(
+                self._timed_send, self._schedule(count, duration),
+                workers=self.workers, backlog=sys.maxsize):
+            outcome, latency = result
+            latencies.append(latency)
+            if isinstance(outcome, Exception):
+                name = outcome.__class__.__name__
+                errors[name] = errors.get(name, 0) + 1
+            else:
+                statuses[outcome] = statuses.get(outcome, 0) + 1
+
+        return LoadReport(latencies, statuses, errors, time.time() - started)
+
+    def _timed_send(self, item):
+        number, due = item
+        try:
+            outcome = self.send(number)[0]
+        except Exception as e:
+            log.debug('Postback %d failed: %r', number, e)
+            outcome = e
+
+        return outcome, time.time() - due
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options] URL')
+    parser.add_option('--secret', help='the SHA-OUT secret')
+    parser.add_option('--hash-method', default='sha512',
+                      choices=ogone_security.HASH_METHODS)
+    parser.add_option('--rate', type='float', default=50,
+                      help='postbacks per second [%default]')
+    parser.add_option('--duration', type='float', default=10,
+                      help='seconds to keep sending [%default]')
+    parser.add_option('--count', type='int',
+                      help='send this many postbacks instead')
+    parser.add_option('--workers', type='int', default=8,
+                      help='concurrent connections [%default]')
+    parser.add_option('--method', default='GET', choices=('GET', 'POST'))
+    parser.add_option('--encoding', default='latin1')
+    parser.add_option('--status', type='int', default=9,
+                      help='the STATUS to send [%default]')
+    options, args = parser.parse_args(argv)
+
+    if len(args) != 1 or not options.secret:
+        parser.error('Give the url of the view and --secret')
+
+    generator = LoadGenerator(args[0], options.secret,
+                              hash_method=options.hash_method,
+                              rate=options.rate, workers=options.workers,
+                              method=options.method,
+                              encoding=options.encoding,
+                              status=options.status)
+    if options.count is not None:
+        report = generator.run(count=options.count)
+    else:
+        report = generator.run(duration=options.duration)
+
+    print(report)
+
+
+if __name__ == '__main__':
+    main()
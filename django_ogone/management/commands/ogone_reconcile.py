@@ -0,0 +1,77 @@
+"""
+Reconcile the statuses of orders with Ogone.
+
+    python manage.py ogone_reconcile shop.Order --order-field=orderID \
+        --status-field=status --checkpoint=/var/tmp/reconcile.json
+
+Run it again with the same checkpoint to continue an interrupted run.
+"""
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from django_ogone import settings as ogone_settings
+from django_ogone import merchants
+from django_ogone import reconcile
+
+
+class Command(BaseCommand):
+    help = 'Compare the status of orders with Ogone and update the ones ' \
+           'that differ.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model',
+            help='the model holding the orders, as app_label.ModelName')
+        parser.add_argument('--order-field', default='orderID',
+            help='the field holding the orderID sent to Ogone')
+        parser.add_argument('--status-field', default='status',
+            help='the field holding the Ogone status')
+        parser.add_argument('--merchant',
+            help='the PSPID from OGONE_MERCHANTS the orders belong to')
+        parser.add_argument('--checkpoint',
+            help='file to record progress in, and resume from')
+        parser.add_argument('--workers', type=int,
+            default=ogone_settings.DIRECT_LINK_WORKERS,
+            help='the number of concurrent queries')
+        parser.add_argument('--batch-size', type=int, default=500,
+            help='the number of orders to check between checkpoints')
+        parser.add_argument('--url',
+            help='the querydirect url, by default from the settings')
+        parser.add_argument('--dry-run', action='store_true', default=False,
+            help='report the differences without updating anything')
+
+    def handle(self, *args, **options):
+        try:
+            model = apps.get_model(options['model'])
+        except (LookupError, ValueError) as e:
+            raise CommandError(str(e))
+
+        settings = ogone_settings
+        if options['merchant']:
+            settings = merchants.get_registry().get(options['merchant'])
+
+        order_field = options['order_field']
+        status_field = options['status_field']
+        queryset = model._default_manager.all()
+
+        reconciler = reconcile.Reconciler(
+            reconcile.QuerySetUpdater(queryset, order_field, status_field),
+            url=options['url'], settings=settings,
+            workers=options['workers'], batch_size=options['batch_size'],
+            checkpoint=options['checkpoint'], dry_run=options['dry_run'])
+
+        if reconciler.resume_after is not None:
+            self.stdout.write('Resuming after order %s, retrying %d failed '
+                              'queries' % (reconciler.resume_after,
+                                           len(reconciler.retry)))
+
+        report = reconciler.run(reconcile.iter_queryset(
+            queryset, order_field, status_field,
+            after=reconciler.resume_after))
+
+        self.stdout.write('Checked %(checked)d orders: %(unchanged)d '
+                          'unchanged, %(changed)d changed (%(applied)d '
+                          'applied), %(missing)d unknown to Ogone, '
+                          '%(failed)d failed' % report)
+        for category, count in sorted(report['categories'].items()):
+            self.stdout.write('  %s: %d' % (category, count))
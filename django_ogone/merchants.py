@@ -0,0 +1,137 @@
+"""
+Support for running several Ogone accounts (PSPIDs) from one site.
+
+Every merchant is configured once, in your Django settings::
+
+    OGONE_MERCHANTS = {
+        'myshopNL': {'SHA_PRE_SECRET': '...', 'SHA_POST_SECRET': '...',
+                     'USERID': 'api', 'PSWD': '...'},
+        'myshopBE': {'SHA_PRE_SECRET': '...', 'SHA_POST_SECRET': '...',
+                     'CURRENCY': 'EUR', 'HASH_METHOD': 'sha1'},
+    }
+
+Settings a merchant doesn't define fall back to the global OGONE_*
+settings, except for the credentials which are always per merchant. A
+:class:`Merchant` can be passed as `settings` to everything in
+:mod:`django_ogone.ogone`; its signers and DirectLink credentials are
+resolved up front.
+
+Postbacks are routed to their merchant with the PSPID parameter, or any
+other parameter through ``OGONE_MERCHANT_ROUTE_PARAM`` and a lookup table
+(``OGONE_MERCHANT_ROUTES``) from its values to PSPIDs.
+"""
+
+import threading
+
+from django_ogone import exceptions as ogone_exceptions
+from django_ogone import settings as ogone_settings
+from django_ogone.ogone import Ogone
+
+# Never inherited from the global settings
+CREDENTIALS = ('PSPID', 'SHA_PRE_SECRET', 'SHA_POST_SECRET', 'USERID', 'PSWD')
+
+
+class Merchant(object):
+    """ The settings for a single PSPID. """
+
+    def __init__(self, PSPID, defaults=ogone_settings, **config):
+        for name in dir(defaults):
+            if name.isupper() and name not in CREDENTIALS:
+                setattr(self, name, getattr(defaults, name))
+
+        for name, value in config.items():
+            assert name.isupper(), 'Unknown setting %s' % name
+            setattr(self, name, value)
+
+        self.PSPID = PSPID
+        for name in CREDENTIALS:
+            if not hasattr(self, name):
+                setattr(self, name, None)
+
+        # Picked up by Ogone.get_signer and OgoneDirectLink.get_data
+        self.SHA_IN_SIGNER = Ogone.get_signer(settings=self)
+        self.SHA_OUT_SIGNER = Ogone.get_signer(out=True, settings=self)
+        self.DIRECT_LINK_DATA = {
+            'PSPID': self.PSPID,
+            'USERID': self.USERID,
+            'PSWD': self.PSWD,
+        }
+
+    def __repr__(self):
+        return '<Merchant %s>' % self.PSPID
+
+
+class MerchantRegistry(object):
+    """ Looks up merchants by PSPID or by the parameters of a postback. """
+
+    def __init__(self, merchants=(), route_param='PSPID', routes=None):
+        self.route_param = route_param.upper()
+        self.routes = dict(routes or {})
+        self._merchants = {}
+
+        for merchant in merchants:
+            self.register(merchant)
+
+    def register(self, merchant):
+        self._merchants[merchant.PSPID] = merchant
+
+    def get(self, pspid):
+        try:
+            return self._merchants[pspid]
+        except KeyError:
+            raise ogone_exceptions.UnknownMerchantException(
+                'No merchant configured for %s' % pspid)
+
+    def __contains__(self, pspid):
+        return pspid in self._merchants
+
+    def __iter__(self):
+        return iter(self._merchants.values())
+
+    def for_params(self, params):
+        """ Return the merchant the postback `params` belong to. """
+
+        value = params.get(self.route_param)
+        if value is None:
+            for key, v in params.items():
+                if key.upper() == self.route_param:
+                    value = v
+                    break
+            else:
+                raise ogone_exceptions.UnknownMerchantException(
+                    'No %s parameter found' % self.route_param)
+
+        return self.get(self.routes.get(value, value))
+
+    def ogone(self, params):
+        """ Return an Ogone instance for the postback `params`, using the
+            settings of its merchant. """
+
+        from django_ogone.ogone import Ogone
+
+        return Ogone(params, settings=self.for_params(params))
+
+    @classmethod
+    def from_settings(cls, settings=ogone_settings):
+        merchants = [Merchant(pspid, **config)
+                     for pspid, config in settings.MERCHANTS.items()]
+
+        return cls(merchants, route_param=settings.MERCHANT_ROUTE_PARAM,
+                   routes=settings.MERCHANT_ROUTES)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """ Return the registry built from OGONE_MERCHANTS, loading it once. """
+
+    global _registry
+
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = MerchantRegistry.from_settings()
+
+    return _registry
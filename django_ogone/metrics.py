@@ -0,0 +1,265 @@
+"""
+Optional timing of the hot paths.
+
+Nothing is measured until an exporter is installed, either with
+:func:`enable` or through ``OGONE_METRICS_EXPORTER`` (the dotted path of
+an exporter class). Until then the instrumented functions cost one extra
+check per call.
+
+Once enabled, every instrumented call reports its duration to
+``exporter.observe(name, tags, seconds)`` and every call that raises to
+``exporter.increment(name + '.errors', tags)``. `tags` is a sorted tuple of
+``(key, value)`` pairs: the PSPID of the merchant whose settings were
+used, the DirectLink OPERATION and the endpoint, where they apply. The
+operations measured are:
+
+- ``signature``: OgoneSigner.sign, which Ogone uses to sign and verify,
+  tagged with the merchant the signer was built for (and
+  OgoneSignature.signature, untagged)
+- ``is_valid``, ``parse_params`` and ``get_form`` on Ogone
+- ``directlink.request``, ``directlink.order`` and ``directlink.query``,
+  including the waits for a turn under the rate limits, the retries and
+  their attempts, each made up of ``directlink.connect``,
+  ``directlink.send`` and ``directlink.wait`` (for the response, which is
+  parsed as it arrives)
+
+>>> exporter = enable()
+>>> with timer('example', merchant='myshop'):
+...     pass
+>>> histogram = exporter.get_histogram('example', merchant='myshop')
+>>> histogram.count
+1
+>>> disable()
+>>> with timer('example', merchant='myshop'):
+...     pass
+>>> histogram.count
+1
+"""
+
+import bisect
+import functools
+import threading
+import time
+
+from django_ogone import settings as ogone_settings
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+
+# The installed exporter, None while metrics are disabled
+exporter = None
+
+
+class Exporter(object):
+    """ Base class for exporters. """
+
+    def observe(self, name, tags, seconds):
+        """ Record that operation `name` took `seconds`. """
+        raise NotImplementedError
+
+    def increment(self, name, tags, value=1):
+        """ Add `value` to counter `name`. """
+        raise NotImplementedError
+
+
+class Histogram(object):
+    """ Counts observations per bucket of :data:`BUCKETS`. """
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def percentile(self, fraction):
+        """ The upper bound of the bucket holding the `fraction`
+            percentile. """
+
+        if not self.count:
+            return None
+
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+
+
+class InMemoryExporter(Exporter):
+    """
+    Keeps counters and histograms in memory, for tests or to be scraped by
+    your own monitoring.
+
+    >>> exporter = InMemoryExporter()
+    >>> exporter.increment('calls', (('merchant', 'myshop'),))
+    >>> exporter.observe('calls', (('merchant', 'myshop'),), 0.003)
+    >>> exporter.get_counter('calls', merchant='myshop')
+    1
+    >>> exporter.get_histogram('calls', merchant='myshop').percentile(0.5)
+    0.005
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, tags, seconds):
+        with self._lock:
+            histogram = self.histograms.get((name, tags))
+            if histogram is None:
+                histogram = self.histograms[(name, tags)] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, name, tags, value=1):
+        with self._lock:
+            self.counters[(name, tags)] = \
+                self.counters.get((name, tags), 0) + value
+
+    def get_counter(self, name, **tags):
+        return self.counters.get((name, make_tags(tags)), 0)
+
+    def get_histogram(self, name, **tags):
+        return self.histograms.get((name, make_tags(tags)))
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+def make_tags(tags):
+    return tuple(sorted(tags.items()))
+
+
+def enable(new_exporter=None):
+    """ Install `new_exporter` (an InMemoryExporter by default) and return
+        it. """
+
+    global exporter
+
+    if new_exporter is None:
+        new_exporter = InMemoryExporter()
+    exporter = new_exporter
+
+    return exporter
+
+
+def disable():
+    global exporter
+
+    exporter = None
+
+
+class _Timer(object):
+    def __init__(self, exporter, name, tags):
+        self.exporter = exporter
+        self.name = name
+        self.tags = tags
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.exporter.observe(self.name, self.tags, time.time() - self.started)
+        if exc_type is not None:
+            self.exporter.increment(self.name + '.errors', self.tags)
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+_null_timer = _NullTimer()
+
+
+def timer(name, **tags):
+    """ A context manager timing its block as operation `name`. """
+
+    if exporter is None:
+        return _null_timer
+
+    return _Timer(exporter, name, make_tags(tags))
+
+
+def increment(name, **tags):
+    """ Add one to counter `name`. """
+
+    if exporter is not None:
+        exporter.increment(name, make_tags(tags))
+
+
+def _get_merchant(settings):
+    return getattr(settings, 'PSPID', None)
+
+
+def timed(name, tags=None):
+    """
+    Decorator timing calls of the function as operation `name`, tagged
+    with the merchant from its `settings` argument (or ``self.settings``).
+    `tags`, if given, is called with the arguments of the call (as returned
+    by inspect.getcallargs) and returns a dict of additional tags.
+    """
+
+    def decorator(func):
+        code = func.__code__
+        args = code.co_varnames[:code.co_argcount]
+        settings_index = None
+        if 'settings' in args:
+            settings_index = args.index('settings')
+        uses_self = bool(args) and args[0] == 'self'
+
+        def get_tags(call_args, call_kwargs):
+            if tags is not None:
+                # Slow to import, and only needed once metrics are on
+                import inspect
+                extra = tags(inspect.getcallargs(func, *call_args,
+                                                 **call_kwargs))
+            else:
+                extra = {}
+
+            if settings_index is not None:
+                if 'settings' in call_kwargs:
+                    settings = call_kwargs['settings']
+                elif len(call_args) > settings_index:
+                    settings = call_args[settings_index]
+                else:
+                    settings = ogone_settings
+                extra['merchant'] = _get_merchant(settings)
+            elif uses_self and hasattr(call_args[0], 'settings'):
+                extra['merchant'] = _get_merchant(call_args[0].settings)
+
+            return make_tags(extra)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if exporter is None:
+                return func(*args, **kwargs)
+
+            with _Timer(exporter, name, get_tags(args, kwargs)):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _load_exporter(path):
+    module_name, class_name = path.rsplit('.', 1)
+    module = __import__(module_name, {}, {}, [class_name])
+
+    return getattr(module, class_name)()
+
+
+if ogone_settings.METRICS_EXPORTER:
+    enable(_load_exporter(ogone_settings.METRICS_EXPORTER))
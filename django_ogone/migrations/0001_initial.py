@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:04
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Payment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('orderid', models.CharField(db_index=True, max_length=30)),
+                ('payid', models.BigIntegerField(unique=True)),
+                ('status', models.PositiveSmallIntegerField()),
+                ('status_category', models.CharField(blank=True, max_length=10)),
+                ('ncerror', models.CharField(blank=True, max_length=10)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12, null=True)),
+                ('currency', models.CharField(blank=True, max_length=3)),
+                ('trxdate', models.DateField(blank=True, null=True)),
+                ('pm', models.CharField(blank=True, max_length=25)),
+                ('brand', models.CharField(blank=True, max_length=25)),
+                ('acceptance', models.CharField(blank=True, max_length=16)),
+                ('cardno', models.CharField(blank=True, max_length=21)),
+                ('ed', models.DateField(blank=True, null=True)),
+                ('cn', models.CharField(blank=True, max_length=35)),
+                ('cccty', models.CharField(blank=True, max_length=2)),
+                ('ip', models.CharField(blank=True, max_length=45)),
+                ('ipcty', models.CharField(blank=True, max_length=2)),
+                ('eci', models.CharField(blank=True, max_length=2)),
+                ('cvccheck', models.CharField(blank=True, max_length=2)),
+                ('aavcheck', models.CharField(blank=True, max_length=2)),
+                ('vc', models.CharField(blank=True, max_length=3)),
+                ('shasign', models.CharField(blank=True, max_length=128)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='payment',
+            index_together=set([('status', 'trxdate')]),
+        ),
+    ]
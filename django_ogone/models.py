@@ -1 +1,167 @@
-# Nothing
+"""
+A ready-made model for storing Ogone payments.
+
+Fields are named after the Ogone parameters they hold (lower case), like
+the Payment model in examples/models.py, but sized to what Ogone sends and
+indexed for the usual lookups: by order, by PAYID and by status and date.
+
+Store verified postbacks with :meth:`PaymentManager.bulk_upsert`, which
+writes them in batches instead of one INSERT or UPDATE per postback::
+
+    Payment.objects.bulk_upsert(ogone for ogone in postbacks
+                                if ogone.is_valid())
+"""
+
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
+
+from django_ogone import status_codes
+
+
+class PaymentManager(models.Manager):
+    def bulk_upsert(self, results, batch_size=500):
+        """
+        Store `results` (verified :class:`~django_ogone.ogone.Ogone`
+        instances or :class:`~django_ogone.result.OgoneResult`), creating
+        payments for new PAYIDs and updating the others. Payments only
+        move on to newer statuses (see status_codes.is_newer_status), so
+        postbacks arriving out of order can't undo a later one. Returns the
+        number of payments created and updated.
+        """
+
+        return self.bulk_upsert_fields((Payment.get_fields(result)
+                                        for result in results), batch_size)
+
+    def bulk_upsert_fields(self, field_values, batch_size=500):
+        """ Like bulk_upsert, for the field values Payment.get_fields
+            returned for the results. """
+
+        created = updated = 0
+
+        batch = {}
+        for fields in field_values:
+            previous = batch.get(fields['payid'])
+            if previous is None or status_codes.is_newer_status(
+                    fields['status'], previous['status']):
+                batch[fields['payid']] = fields
+
+            if len(batch) >= batch_size:
+                counts = self._upsert(batch)
+                created, updated = created + counts[0], updated + counts[1]
+                batch = {}
+
+        if batch:
+            counts = self._upsert(batch)
+            created, updated = created + counts[0], updated + counts[1]
+
+        return created, updated
+
+    def _upsert(self, batch):
+        try:
+            return self._upsert_batch(batch)
+        except IntegrityError:
+            # Someone else created some of these payments in the meantime,
+            # this time they are updated
+            return self._upsert_batch(batch)
+
+    def _upsert_batch(self, batch):
+        # Neither bulk_update nor update() fill in auto_now fields
+        now = timezone.now()
+
+        with transaction.atomic(using=self.db):
+            existing = dict([(payid, (pk, status)) for payid, pk, status in
+                             self.filter(payid__in=batch.keys())
+                                 .values_list('payid', 'pk', 'status')])
+
+            new = [Payment(**fields) for payid, fields in batch.items()
+                   if payid not in existing]
+            self.bulk_create(new)
+
+            changed = []
+            for payid, (pk, status) in existing.items():
+                if not status_codes.is_newer_status(batch[payid]['status'],
+                                                    status):
+                    continue
+                batch[payid]['updated_at'] = now
+                changed.append(Payment(pk=pk, **batch[payid]))
+
+            if hasattr(self, 'bulk_update'):
+                self.bulk_update(changed, Payment.UPSERT_FIELDS)
+            else:
+                # Older Django versions: at least do it in one transaction
+                for payment in changed:
+                    self.filter(pk=payment.pk).update(**batch[payment.payid])
+
+        return len(new), len(changed)
+
+
+class Payment(models.Model):
+    orderid = models.CharField(max_length=30, db_index=True)
+    payid = models.BigIntegerField(unique=True)
+    status = models.PositiveSmallIntegerField()
+    status_category = models.CharField(max_length=10, blank=True)
+    ncerror = models.CharField(max_length=10, blank=True)
+
+    amount = models.DecimalField(max_digits=12, decimal_places=2, null=True)
+    currency = models.CharField(max_length=3, blank=True)
+    trxdate = models.DateField(blank=True, null=True)
+
+    pm = models.CharField(max_length=25, blank=True)
+    brand = models.CharField(max_length=25, blank=True)
+    acceptance = models.CharField(max_length=16, blank=True)
+    cardno = models.CharField(max_length=21, blank=True)
+    ed = models.DateField(blank=True, null=True)
+    cn = models.CharField(max_length=35, blank=True)
+    cccty = models.CharField(max_length=2, blank=True)
+    ip = models.CharField(max_length=45, blank=True)
+    ipcty = models.CharField(max_length=2, blank=True)
+    eci = models.CharField(max_length=2, blank=True)
+    cvccheck = models.CharField(max_length=2, blank=True)
+    aavcheck = models.CharField(max_length=2, blank=True)
+    vc = models.CharField(max_length=3, blank=True)
+    shasign = models.CharField(max_length=128, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = PaymentManager()
+
+    # Taken from the Ogone parameters of the same (upper case) name as is
+    PARAMETER_FIELDS = ('ncerror', 'currency', 'pm', 'brand', 'acceptance',
+                        'cardno', 'cn', 'cccty', 'ip', 'ipcty', 'eci',
+                        'cvccheck', 'aavcheck', 'vc', 'shasign')
+
+    # Written by bulk_upsert when a payment exists already
+    UPSERT_FIELDS = ('orderid', 'status', 'status_category', 'amount',
+                     'trxdate', 'ed', 'updated_at') + PARAMETER_FIELDS
+
+    class Meta:
+        index_together = (('status', 'trxdate'),)
+
+    def __unicode__(self):
+        return u'Payment %s for order %s (%s)' % (self.payid, self.orderid,
+                                                  self.status)
+
+    @staticmethod
+    def get_fields(result):
+        """ Return the field values for an Ogone postback. """
+
+        if hasattr(result, 'parse_params'):
+            result = result.parse_params()
+        params = result.params
+
+        info = status_codes.get_status_info(result.status)
+        fields = {
+            'orderid': params['ORDERID'],
+            'payid': int(params['PAYID']),
+            'status': result.status,
+            'status_category': info and info.category or '',
+            'amount': result.amount if params.get('AMOUNT') else None,
+            'trxdate': result.transaction_date if params.get('TRXDATE')
+                       else None,
+            'ed': result.expiry_date if params.get('ED') else None,
+        }
+        for name in Payment.PARAMETER_FIELDS:
+            fields[name] = params.get(name.upper()) or ''
+
+        return fields
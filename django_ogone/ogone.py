@@ -1,8 +1,7 @@
 import logging
-import datetime
-import urllib
-import urllib2
-import xml.dom.minidom
+import threading
+import itertools
+import collections
 
 log = logging.getLogger('django_ogone')
 
@@ -11,7 +10,15 @@ from django_ogone import status_codes
 from django_ogone import exceptions as ogone_exceptions
 from django_ogone import settings as ogone_settings
 from django_ogone import security as ogone_security
-from django_ogone import forms as ogone_forms
+from django_ogone import parameters as ogone_parameters
+from django_ogone import rendering as ogone_rendering
+from django_ogone import pool as ogone_pool
+from django_ogone import parsers as ogone_parsers
+from django_ogone import result as ogone_result
+from django_ogone import metrics as ogone_metrics
+from django_ogone import resilience as ogone_resilience
+from django_ogone import router as ogone_router
+from django_ogone import ratelimit as ogone_ratelimit
 
 
 class Ogone(object):
@@ -40,7 +47,8 @@ class Ogone(object):
         # We allways want our data to be normalized
         self.params = self._normalize_params(params)
 
-        # We haven't parsed anything yet
+        # We haven't verified or parsed anything yet
+        self._valid = None
         self.parsed = False
 
     @staticmethod
@@ -64,7 +72,7 @@ class Ogone(object):
             return TEST_URL
 
     @classmethod
-    def get_data(cls, data, settings=ogone_settings):
+    def get_data(cls, data, settings=ogone_settings, encoding='utf8'):
         # Check for obligatory fields
         assert 'language' in data
         assert 'orderID' in data
@@ -74,12 +82,40 @@ class Ogone(object):
 
         data['currency'] = data.get('currency') or settings.CURRENCY
         data['PSPID'] = settings.PSPID
-        data['SHASign'] = cls.sign(data, settings=settings)
+        data['SHASign'] = cls.sign(data, settings=settings, encoding=encoding)
 
         return data
 
     @classmethod
+    def get_redirect_url(cls, data, settings=ogone_settings, encoding='utf8',
+                         production=None, action=None):
+        """ Return the checkout url with the signed `data` in the query
+            string, to redirect the customer to. Doesn't touch `data` and
+            doesn't need Django.
+
+            The values are encoded, and signed, as `encoding`. Ogone reads
+            latin1 at orderstandard.asp and utf8 at orderstandard_utf8.asp;
+            pass the one you use as `action` if it isn't get_action(). """
+
+        import urllib
+
+        data = cls.get_data(dict(data), settings, encoding)
+
+        if action is None:
+            action = cls.get_action(production, settings)
+
+        query = urllib.urlencode([
+            (key, ogone_rendering.force_unicode(value).encode(encoding))
+            for key, value in sorted(data.items())])
+
+        return '%s%s%s' % (action, '?' in action and '&' or '?', query)
+
+    @classmethod
+    @ogone_metrics.timed('get_form')
     def get_form(cls, data, settings=ogone_settings):
+        # Only the form needs Django
+        from django_ogone import forms as ogone_forms
+
         enriched_data = cls.get_data(data, settings)
 
         log.debug('Sending the following data to Ogone: %s', enriched_data)
@@ -87,15 +123,36 @@ class Ogone(object):
 
         return form
 
+    @classmethod
+    def get_form_html(cls, data, settings=ogone_settings):
+        """ Like get_form, but return the rendered hidden inputs. Much
+            cheaper if all you do is put the form in a template. """
+
+        enriched_data = cls.get_data(data, settings)
+
+        log.debug('Sending the following data to Ogone: %s', enriched_data)
+        return ogone_rendering.render_hidden_inputs(enriched_data)
+
+    @classmethod
+    def get_post_data(cls, data, settings=ogone_settings):
+        """ Return the signed data as a dict of unicode strings, ready to be
+            posted to get_action() by your own code. """
+
+        return ogone_rendering.to_post_data(cls.get_data(data, settings))
+
+    @ogone_metrics.timed('is_valid')
     def is_valid(self):
         """ Verify the signature for the current parameters. Used in Ogone
             OUT flow. Returns either True or False
         """
 
-        ogone_signature = self.get_ogone_signature()
-        signature = self.compute_signature(out=True)
+        if self._valid is None:
+            ogone_signature = self.get_ogone_signature()
+            signature = self.compute_signature(out=True)
+
+            self._valid = signature == ogone_signature
 
-        return signature == ogone_signature
+        return self._valid
 
     @staticmethod
     def _normalize_params(params):
@@ -120,14 +177,7 @@ class Ogone(object):
         v = params.get('TRXDATE')
 
         if v:
-            month, day, year = map(int, v.split('/'))
-            # Ogone responds with a year coded on 2 digits. Add, the 2000
-            # years delta.
-            year += 2000
-            # --//--
-            v = datetime.date(year, month, day)
-
-            params.update({'TRXDATE': v})
+            params.update({'TRXDATE': ogone_result.parse_trxdate(v)})
 
         return params
 
@@ -136,14 +186,18 @@ class Ogone(object):
         v = params.get('ED')
 
         if v:
-            month, year = int(v[:2]), int(v[-2:])
-            # Ogone responds with a year coded on 2 digits. Add, the 2000
-            # years delta.
-            year += 2000
-            # --//--
-            v = datetime.date(year, month, 1)
+            params.update({'ED': ogone_result.parse_ed(v)})
+
+        return params
 
-            params.update({'ED': v})
+    @classmethod
+    def _convert_params(cls, params):
+        """ Convert the eligible elements of normalized `params` in-place. """
+
+        cls._parse_trxdate(params)
+        cls._parse_ed(params)
+        cls._parse_status(params)
+        cls._parse_orderid(params)
 
         return params
 
@@ -154,11 +208,19 @@ class Ogone(object):
         if not 'settings' in kwargs:
             kwargs.update({'settings': self.settings})
 
+        # Our params are normalized already
+        kwargs.setdefault('normalized', True)
+
         return self.sign(self.params, *args, **kwargs)
 
+    @ogone_metrics.timed('parse_params')
     def parse_params(self):
-        """ Validate and convert the eligible elements to
-            native Python types. """
+        """ Validate the parameters and return an
+            :class:`~django_ogone.result.OgoneResult`, which converts the
+            eligible elements to native Python types on first access. """
+
+        if self.parsed:
+            return self.parsed_params
 
         assert self.params
 
@@ -166,14 +228,7 @@ class Ogone(object):
         if not self.is_valid():
             raise ogone_exceptions.InvalidSignatureException()
 
-        # This first one creates a copy of our params dict
-        self.parsed_params = self._normalize_params(self.params)
-
-        # These update the dict in-place
-        self._parse_trxdate(self.parsed_params)
-        self._parse_ed(self.parsed_params)
-        self._parse_status(self.parsed_params)
-        self._parse_orderid(self.parsed_params)
+        self.parsed_params = ogone_result.OgoneResult(self.params)
 
         # Mark ourselves as parsed
         self.parsed = True
@@ -181,29 +236,35 @@ class Ogone(object):
         return self.parsed_params
 
     def get_order_id(self):
-        self.parsed or self.parse_params()
-
-        return self.parsed_params['ORDERID']
+        return self.parse_params().order_id
 
     def get_status(self):
-        self.parsed or self.parse_params()
-
-        return self.parsed_params['STATUS']
+        return self.parse_params().status
 
     def get_transaction_date(self):
-        self.parsed or self.parse_params()
-
-        return self.parsed_params['TRXDATE']
+        return self.parse_params().transaction_date
 
     def get_expiry_date(self):
-        self.parsed or self.parse_params()
+        return self.parse_params().expiry_date
 
-        return self.parsed_params['ED']
+    def get_amount(self):
+        return self.parse_params().amount
 
     @staticmethod
     def sign(data, hash_method=None, secret=None, out=False,
-             settings=ogone_settings):
-        """ Sign the given data. """
+             settings=ogone_settings, normalized=False, encoding='utf8'):
+        """ Sign the given data. Pass `normalized` when all keys of `data`
+            are upper case already. """
+
+        signer = Ogone.get_signer(hash_method, secret, out, settings,
+                                  encoding)
+
+        return signer.sign(data, normalized=normalized)
+
+    @staticmethod
+    def _get_signer_config(hash_method=None, secret=None, out=False,
+                           settings=ogone_settings):
+        """ The (picklable) arguments for security.get_signer. """
 
         if not hash_method:
             hash_method = settings.HASH_METHOD
@@ -214,11 +275,80 @@ class Ogone(object):
             else:
                 secret = settings.SHA_PRE_SECRET
 
-        return ogone_security.OgoneSignature(data,
-                    hash_method=hash_method,
-                    secret=secret).signature()
+        version = getattr(settings, 'SHA_PARAMETERS_VERSION',
+                          ogone_settings.SHA_PARAMETERS_VERSION)
+
+        # Only tags the signature metric
+        merchant = getattr(settings, 'PSPID', None)
 
+        return hash_method, secret, version, out, merchant
+
+    @staticmethod
+    def get_signer(hash_method=None, secret=None, out=False,
+                   settings=ogone_settings, encoding='utf8'):
+        """ Return the shared signer for the SHA-IN (or SHA-OUT) flow. """
 
+        # Merchants come with their signers built
+        if not hash_method and not secret:
+            signer = getattr(settings, out and 'SHA_OUT_SIGNER' or
+                             'SHA_IN_SIGNER', None)
+            if signer is not None and signer.encoding == encoding:
+                return signer
+
+        return _get_signer(*Ogone._get_signer_config(hash_method, secret,
+                                                     out, settings),
+                           encoding=encoding)
+
+    @classmethod
+    def verify_many(cls, rows, settings=ogone_settings, chunk_size=1000,
+                    processes=None):
+        """ Verify the signatures of many postbacks, for instance when
+            replaying archived ones.
+
+            Yields ``(index, valid, parsed_params)`` for every mapping in
+            `rows`, in order. parsed_params is an
+            :class:`~django_ogone.result.OgoneResult`, or None for invalid
+            rows.
+            Rows are handled `chunk_size` at a time, optionally spread over
+            a pool of `processes`, and only a few chunks are held in memory
+            at once. """
+
+        import multiprocessing
+
+        config = cls._get_signer_config(out=True, settings=settings)
+        chunks = cls._chunk(enumerate(rows), chunk_size)
+
+        if not processes:
+            for chunk in chunks:
+                for result in _verify_chunk(config, chunk):
+                    yield result
+            return
+
+        pool = multiprocessing.Pool(processes)
+        pending = collections.deque()
+        try:
+            for chunk in chunks:
+                pending.append(pool.apply_async(_verify_chunk,
+                                                (config, chunk)))
+
+                if len(pending) >= processes * 2:
+                    for result in pending.popleft().get():
+                        yield result
+
+            while pending:
+                for result in pending.popleft().get():
+                    yield result
+        finally:
+            pool.terminate()
+
+    @staticmethod
+    def _chunk(iterable, size):
+        iterator = iter(iterable)
+        while True:
+            chunk = list(itertools.islice(iterator, size))
+            if not chunk:
+                return
+            yield chunk
 
     def get_ogone_signature(self):
         assert 'SHASIGN' in self.params, \
@@ -233,16 +363,44 @@ class Ogone(object):
         return status_codes.get_status_category(self.get_status())
 
 
+def _get_signer(hash_method, secret, version, out, merchant=None,
+                encoding='utf8'):
+    parameters = ogone_parameters.get_table(version, out=out)
+
+    return ogone_security.get_signer(hash_method, secret, encoding,
+                                     parameters=parameters, merchant=merchant)
+
+
+def _verify_chunk(config, chunk):
+    """ Verify a list of (index, params) pairs. Lives at module level so
+        it can be sent to a process pool. """
+
+    signer = _get_signer(*config)
+
+    results = []
+    for index, params in chunk:
+        params = Ogone._normalize_params(params)
+        signature = params.get('SHASIGN')
+
+        if signature and signer.sign(params, normalized=True) == signature:
+            results.append((index, True, ogone_result.OgoneResult(params)))
+        else:
+            results.append((index, False, None))
+
+    return results
+
+
 class OgoneDirectLink(Ogone):
     @staticmethod
     def get_action(production=None, settings=ogone_settings):
-        """ Get the relevant action parameter from the settings. """
+        """ Get the relevant action parameter from the settings: a url, or
+            a list of equivalent ones, which request() routes between. """
 
-        PROD_URL = settings.DIRECT_LINK_PROD_URL
-        TEST_URL = settings.DIRECT_LINK_TEST_URL
+        PROD_URL = OgoneDirectLink._endpoints(settings.DIRECT_LINK_PROD_URL)
+        TEST_URL = OgoneDirectLink._endpoints(settings.DIRECT_LINK_TEST_URL)
 
-        assert isinstance(PROD_URL, unicode) or isinstance(PROD_URL, str)
-        assert isinstance(TEST_URL, unicode) or isinstance(TEST_URL, str)
+        assert isinstance(PROD_URL, (unicode, str, list, tuple))
+        assert isinstance(TEST_URL, (unicode, str, list, tuple))
 
         if production is None:
             production = settings.PRODUCTION
@@ -254,6 +412,61 @@ class OgoneDirectLink(Ogone):
             log.debug('Returning test URL: %s', TEST_URL)
             return TEST_URL
 
+    @staticmethod
+    def _endpoints(urls):
+        """ The configured `urls`, unwrapping lists of a single one. Lists
+            of several are routed between per call, see
+            django_ogone.router. """
+
+        if isinstance(urls, (list, tuple)) and len(urls) == 1:
+            return urls[0]
+        return urls
+
+    @staticmethod
+    def get_query_action(production=None, settings=ogone_settings):
+        """ Get the url (or urls) of the status query endpoint from the
+            settings. """
+
+        if production is None:
+            production = settings.PRODUCTION
+
+        if production:
+            return OgoneDirectLink._endpoints(getattr(settings,
+                'DIRECT_LINK_QUERY_PROD_URL',
+                ogone_settings.DIRECT_LINK_QUERY_PROD_URL))
+        return OgoneDirectLink._endpoints(getattr(settings,
+            'DIRECT_LINK_QUERY_TEST_URL',
+            ogone_settings.DIRECT_LINK_QUERY_TEST_URL))
+
+    @staticmethod
+    def get_order_action(production=None, settings=ogone_settings):
+        """ Get the url (or urls) of the order endpoint, which charges
+            stored cards (aliases), from the settings. """
+
+        if production is None:
+            production = settings.PRODUCTION
+
+        if production:
+            return OgoneDirectLink._endpoints(getattr(settings,
+                'DIRECT_LINK_ORDER_PROD_URL',
+                ogone_settings.DIRECT_LINK_ORDER_PROD_URL))
+        return OgoneDirectLink._endpoints(getattr(settings,
+            'DIRECT_LINK_ORDER_TEST_URL',
+            ogone_settings.DIRECT_LINK_ORDER_TEST_URL))
+
+    @staticmethod
+    def _sign_request(data, settings):
+        credentials = getattr(settings, 'DIRECT_LINK_DATA', None)
+        if credentials is not None:
+            data.update(credentials)
+        else:
+            data['PSPID'] = settings.PSPID
+            data['USERID'] = settings.USERID
+            data['PSWD'] = settings.PSWD
+        data['SHASign'] = Ogone.sign(data, settings=settings)
+
+        return data
+
     @staticmethod
     def get_data(data, settings=ogone_settings):
         # Check required fields
@@ -262,29 +475,170 @@ class OgoneDirectLink(Ogone):
         # Make sure amount is an int
         assert isinstance(data['amount'], (int, long)) or data['amount'].isdigit()
 
-        data['PSPID'] = settings.PSPID
-        data['USERID'] = settings.USERID
-        data['PSWD'] = settings.PSWD
-        data['SHASign'] = Ogone.sign(data, settings=settings)
+        return OgoneDirectLink._sign_request(data, settings)
 
-        return data
+    @staticmethod
+    def get_order_data(data, settings=ogone_settings):
+        # A new order, on a stored card
+        assert 'orderID' in data
+        assert 'ALIAS' in data
+
+        return OgoneDirectLink.get_data(data, settings)
+
+    @staticmethod
+    def get_query_data(data, settings=ogone_settings):
+        assert 'orderID' in data or 'PAYID' in data
+
+        return OgoneDirectLink._sign_request(data, settings)
+
+    @classmethod
+    def request(cls, url, data, settings=ogone_settings, transport=None):
+        """ Send a maintenance request to DirectLink and return the
+            attributes of the ncresponse element. """
+
+        data = cls.get_data(data, settings)
+        return cls._post(url, data, transport, metric='directlink.request',
+                         operation=data.get('OPERATION'))
 
     @classmethod
-    def request(cls, url, data, settings=ogone_settings):
-        params = cls.get_data(data, settings)
+    def order(cls, url, data, settings=ogone_settings, transport=None):
+        """ Send a new order for the stored card (ALIAS) in `data` to
+            DirectLink and return the attributes of the ncresponse
+            element. Never retried once sent: that could charge twice. """
+
+        # 3-D Secure orders come back with the form to show the customer
+        return cls._post(url, cls.get_order_data(data, settings), transport,
+                         children=('HTML_ANSWER',), metric='directlink.order')
+
+    @classmethod
+    def query(cls, url, data, settings=ogone_settings, transport=None):
+        """ Ask DirectLink for the status of the order with the orderID or
+            PAYID in `data` and return the attributes of the ncresponse
+            element. """
+
+        return cls._post(url, cls.get_query_data(data, settings), transport,
+                         idempotent=True, metric='directlink.query')
+
+    @classmethod
+    def _post(cls, url, data, transport=None, idempotent=False, children=(),
+              metric='directlink.request', **tags):
+        """ Post `data` under the circuit breaker of the endpoint, retrying
+            failures as far as that is safe and keeping to the rate limits
+            of the merchant. `url` may also be a list of equivalent
+            endpoints or an EndpointRouter. The response is parsed as it
+            arrives, collecting the text of the elements in `children`.
+
+            Every attempt waits for a turn under the rate limits of the
+            merchant first. The call is timed as operation `metric` with
+            `tags` and the merchant. """
+
+        # Only DirectLink needs the HTTP machinery
+        import urllib
+        from django_ogone import transport as ogone_transport
+
+        if transport is None:
+            transport = ogone_transport.get_transport()
+
+        params = urllib.urlencode(data)
+
+        # Waiting for a turn is neither a failure of the endpoint nor part
+        # of its latency
+        limiter = ogone_ratelimit.get_limiter()
+        wait_for_turn = None
+        if limiter is not None:
+            wait_for_turn = lambda: limiter.acquire(data.get('PSPID'),
+                                                    data.get('OPERATION'))
+
+        if isinstance(url, (list, tuple)):
+            url = ogone_router.get_router(url)
+        router = None
+        if isinstance(url, ogone_router.EndpointRouter):
+            router = url
+
+        def send(url):
+            # A fresh parser for every attempt
+            parser = ogone_parsers.NCResponseParser(children)
+            post = lambda: transport.post(url, params,
+                {'Content-type': 'application/x-www-form-urlencoded'},
+                parser=parser)
+
+            if router is None:
+                return post()
+            return router.attempt(url, post)
+
+        def post(url):
+            return ogone_resilience.call(lambda: send(url),
+                policy=ogone_resilience.get_retry_policy(),
+                breaker=ogone_resilience.get_breaker(url),
+                idempotent=idempotent, name=url, before=wait_for_turn)
+
+        with ogone_metrics.timer(metric, merchant=data.get('PSPID'), **tags):
+            if router is not None:
+                response = router.call(post, idempotent)
+            else:
+                response = post(url)
+        log.debug('DirectLink response: %r', response)
+
+        return response
+
+    @classmethod
+    def request_many(cls, url, payloads, settings=ogone_settings,
+                     transport=None, workers=None):
+        """ Send many maintenance requests concurrently.
+
+            Yields ``(payload, result)`` pairs as the requests complete,
+            where result is either the parsed response or the exception
+            raised for that payload. """
 
-        request = urllib2.Request(url)
-        request.add_header("Content-type", "application/x-www-form-urlencoded")
-        params = urllib.urlencode(params)
-        response = urllib2.urlopen(request, params)
+        from django_ogone import transport as ogone_transport
 
-        xml_str = response.read()
-        log.info('DirectLink response: %s', xml_str)
+        if transport is None:
+            transport = ogone_transport.get_transport()
 
-        doc = xml.dom.minidom.parseString(xml_str)
-        attrs = doc.documentElement.attributes
-        return dict([(attrs.item(i).name, attrs.item(i).value) \
-                    for i in range(attrs.length)])
+        if workers is None:
+            workers = ogone_settings.DIRECT_LINK_WORKERS
+
+        def request(payload):
+            return cls.request(url, payload, settings, transport)
+
+        return ogone_pool.imap_unordered(request, payloads, workers=workers)
+
+    @classmethod
+    def request_async(cls, url, data, settings=ogone_settings,
+                      transport=None, pool=None):
+        """ Like :meth:`request`, but return a
+            :class:`~django_ogone.pool.Future` straight away instead of
+            waiting for Ogone. """
+
+        if pool is None:
+            pool = ogone_pool.get_pool()
+
+        return pool.submit(cls.request, url, data, settings, transport)
+
+    @classmethod
+    def gather(cls, url, payloads, settings=ogone_settings, transport=None,
+               limit=None, return_exceptions=False, pool=None):
+        """ Send all `payloads` with at most `limit` requests in flight and
+            return the parsed responses in the order of `payloads`. """
+
+        if pool is None:
+            pool = ogone_pool.get_pool()
+
+        semaphore = threading.BoundedSemaphore(limit or pool.workers)
+        release = lambda future: semaphore.release()
+
+        futures = []
+        for payload in payloads:
+            semaphore.acquire()
+            future = cls.request_async(url, payload, settings, transport, pool)
+            future.add_done_callback(release)
+            futures.append(future)
+
+        return ogone_pool.gather(futures, return_exceptions)
+
+    @staticmethod
+    def _parse_response(xml_str):
+        return ogone_parsers.parse_ncresponse(xml_str)
 
     # DirectLink doesn't return a signature, so, fake the signature coercion.
     def is_valid(self):
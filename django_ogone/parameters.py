@@ -0,0 +1,179 @@
+"""
+The parameters Ogone includes when computing SHA-IN and SHA-OUT signatures.
+
+Ogone only signs a fixed subset of the fields it receives or sends. Any
+other field (like tracking parameters appended to the postback url by a
+proxy or middleware) must be left out of the signature, otherwise
+verification fails.
+
+Ogone extends these lists from time to time, so the tables are versioned.
+``OGONE_SHA_PARAMETERS_VERSION`` picks the version to sign with; set it to
+None to sign every parameter, like this package used to.
+
+>>> 'ORDERID' in SHA_OUT, 'UTM_SOURCE' in SHA_OUT
+(True, False)
+>>> 'ITEMNAME12' in SHA_IN, 'ITEMNAMEX' in SHA_IN
+(True, False)
+>>> SHA_OUT.select({'STATUS': '9', 'ORDERID': '12', 'UTM_SOURCE': 'x'})
+[('ORDERID', '12'), ('STATUS', '9')]
+"""
+
+
+class ParameterTable(object):
+    """
+    A set of signed parameter names. `names` are matched exactly,
+    `patterns` are prefixes followed by a number (``ITEMID1``,
+    ``ITEMID2``, ...).
+    """
+
+    def __init__(self, name, version, names, patterns=()):
+        self.name = name
+        self.version = version
+        self.names = tuple(sorted(set(names)))
+        self.patterns = tuple(sorted(set(patterns)))
+
+        self._names = frozenset(self.names)
+
+    def __contains__(self, key):
+        return key in self._names or self._matches_pattern(key)
+
+    def _matches_pattern(self, key):
+        for pattern in self.patterns:
+            if key.startswith(pattern) and key[len(pattern):].isdigit():
+                return True
+
+        return False
+
+    def select(self, data):
+        """ Return the signed (key, value) pairs of `data` in signing order.
+            The keys of `data` have to be upper case. """
+
+        if not self.patterns:
+            # Walk our own, already sorted, names
+            return [(key, data[key]) for key in self.names if key in data]
+
+        names = self._names
+        pairs = [(key, value) for key, value in data.iteritems()
+                 if key in names or self._matches_pattern(key)]
+        pairs.sort()
+
+        return pairs
+
+    def __repr__(self):
+        return '<ParameterTable %s v%d>' % (self.name, self.version)
+
+
+SHA_IN = ParameterTable('SHA-IN', 1, names=(
+    'ACCEPTANCE', 'ACCEPTURL', 'ADDMATCH', 'ADDRMATCH', 'AIACTIONNUMBER',
+    'AIAGIATA', 'AIAIRNAME', 'AIAIRTAX', 'AICHDET', 'AICONJTI', 'AIDEPTCODE',
+    'AIEYCD', 'AIGLNUM', 'AIINVOICE', 'AIIRST', 'AIPASNAME', 'AIPROJNUM',
+    'AITIDATE', 'AITINUM', 'AITYPCH', 'AIVATAMNT', 'AIVATAPPL', 'ALIAS',
+    'ALIASOPERATION', 'ALIASPERSISTEDAFTERUSE', 'ALIASUSAGE',
+    'ALLOWCORRECTION', 'AMOUNT', 'AMOUNTHTVA', 'AMOUNTTVA', 'ARP_TRN',
+    'BACKURL', 'BATCHID', 'BGCOLOR', 'BIC', 'BIN', 'BLVERNUM', 'BRAND',
+    'BRANDVISUAL', 'BUTTONBGCOLOR', 'BUTTONTXTCOLOR', 'CANCELURL', 'CARDNO',
+    'CATALOGURL', 'CAVVALGORITHM_3D', 'CAVV_3D', 'CERTID', 'CHECK_AAV',
+    'CIVILITY', 'CN', 'COM', 'COMPLUS', 'CONVCCY', 'COSTCENTER', 'COSTCODE',
+    'CREDITCODE', 'CREDITDEBIT', 'CUID', 'CURRENCY', 'CVC', 'CVCFLAG', 'DATA',
+    'DATATYPE', 'DATEIN', 'DATEOUT', 'DBXML', 'DCC_COMMPERC',
+    'DCC_CONVAMOUNT', 'DCC_CONVCCY', 'DCC_EXCHRATE', 'DCC_EXCHRATETS',
+    'DCC_INDICATOR', 'DCC_MARGINPERC', 'DCC_REF', 'DCC_SOURCE', 'DCC_VALID',
+    'DECLINEURL', 'DELIVERYDATE', 'DEVICE', 'DISCOUNTRATE', 'DISPLAYMODE',
+    'ECI', 'ECI_3D', 'ECOM_BILLTO_COMPANY', 'ECOM_BILLTO_POSTAL_CITY',
+    'ECOM_BILLTO_POSTAL_COUNTRYCODE', 'ECOM_BILLTO_POSTAL_COUNTY',
+    'ECOM_BILLTO_POSTAL_NAME_FIRST', 'ECOM_BILLTO_POSTAL_NAME_LAST',
+    'ECOM_BILLTO_POSTAL_NAME_PREFIX', 'ECOM_BILLTO_POSTAL_POSTALCODE',
+    'ECOM_BILLTO_POSTAL_STREET_LINE1', 'ECOM_BILLTO_POSTAL_STREET_LINE2',
+    'ECOM_BILLTO_POSTAL_STREET_LINE3', 'ECOM_BILLTO_POSTAL_STREET_NUMBER',
+    'ECOM_BILLTO_TELECOM_MOBILE_NUMBER', 'ECOM_BILLTO_TELECOM_PHONE_NUMBER',
+    'ECOM_CONSUMERID', 'ECOM_CONSUMEROGID', 'ECOM_CONSUMERORDERID',
+    'ECOM_CONSUMERUSERALIAS', 'ECOM_CONSUMERUSERID', 'ECOM_CONSUMERUSERPWD',
+    'ECOM_CONSUMER_GENDER', 'ECOM_ESTIMATEDDELIVERYDATE',
+    'ECOM_ESTIMATEDELIVERYDATE', 'ECOM_PAYMENT_CARD_EXPDATE_MONTH',
+    'ECOM_PAYMENT_CARD_EXPDATE_YEAR', 'ECOM_PAYMENT_CARD_NAME',
+    'ECOM_PAYMENT_CARD_VERIFICATION', 'ECOM_SHIPMETHOD',
+    'ECOM_SHIPMETHODDETAILS', 'ECOM_SHIPMETHODSPEED', 'ECOM_SHIPMETHODTYPE',
+    'ECOM_SHIPTO_COMPANY', 'ECOM_SHIPTO_DOB', 'ECOM_SHIPTO_ONLINE_EMAIL',
+    'ECOM_SHIPTO_POSTAL_CITY', 'ECOM_SHIPTO_POSTAL_COUNTRYCODE',
+    'ECOM_SHIPTO_POSTAL_COUNTY', 'ECOM_SHIPTO_POSTAL_NAME_FIRST',
+    'ECOM_SHIPTO_POSTAL_NAME_LAST', 'ECOM_SHIPTO_POSTAL_NAME_PREFIX',
+    'ECOM_SHIPTO_POSTAL_POSTALCODE', 'ECOM_SHIPTO_POSTAL_STATE',
+    'ECOM_SHIPTO_POSTAL_STREET_LINE1', 'ECOM_SHIPTO_POSTAL_STREET_LINE2',
+    'ECOM_SHIPTO_POSTAL_STREET_NUMBER', 'ECOM_SHIPTO_TELECOM_FAX_NUMBER',
+    'ECOM_SHIPTO_TELECOM_MOBILE_NUMBER', 'ECOM_SHIPTO_TELECOM_PHONE_NUMBER',
+    'ECOM_SHIPTO_TVA', 'ED', 'EMAIL', 'EXCEPTIONURL', 'EXCLPMLIST',
+    'FIRSTCALL', 'FLAG3D', 'FONTTYPE', 'FORCECODE1', 'FORCECODE2',
+    'FORCECODEHASH', 'FORCEPROCESS', 'FORCETP', 'GENERIC_BL',
+    'GIROPAY_ACCOUNT_NUMBER', 'GIROPAY_BLZ', 'GIROPAY_OWNER_NAME',
+    'GLOBORDERID', 'GUID', 'HDFONTTYPE', 'HDTBLBGCOLOR', 'HDTBLTXTCOLOR',
+    'HEIGHTFRAME', 'HOMEURL', 'HTTP_ACCEPT', 'HTTP_USER_AGENT', 'INCLUDE_BIN',
+    'INCLUDE_COUNTRIES', 'INVDATE', 'INVDISCOUNT', 'INVLEVEL', 'INVORDERID',
+    'ISSUERID', 'IST_MOBILE', 'ITEM_COUNT', 'LANGUAGE', 'LEVEL1AUTHCPC',
+    'LIMITCLIENTSCRIPTUSAGE', 'LINE_REF', 'LINE_REF1', 'LINE_REF2',
+    'LINE_REF3', 'LINE_REF4', 'LINE_REF5', 'LINE_REF6', 'LIST_BIN',
+    'LIST_COUNTRIES', 'LOGO', 'MANDATEID', 'MERCHANTID', 'MODE', 'MTIME',
+    'MVER', 'NETAMOUNT', 'OPERATION', 'ORDERID', 'ORDERSHIPCOST',
+    'ORDERSHIPMETH', 'ORDERSHIPTAX', 'ORDERSHIPTAXCODE', 'ORIG',
+    'OR_INVORDERID', 'OR_ORDERID', 'OWNERADDRESS', 'OWNERADDRESS2',
+    'OWNERCTY', 'OWNERTELNO', 'OWNERTELNO2', 'OWNERTOWN', 'OWNERZIP',
+    'PAIDAMOUNT', 'PARAMPLUS', 'PARAMVAR', 'PAYID', 'PAYMETHOD', 'PM',
+    'PMLIST', 'PMLISTPMLISTTYPE', 'PMLISTTYPE', 'PMLISTTYPEPMLIST', 'PMTYPE',
+    'POPUP', 'POST', 'PSPID', 'PSWD', 'RECIPIENTACCOUNTNUMBER',
+    'RECIPIENTDOB', 'RECIPIENTLASTNAME', 'RECIPIENTZIP', 'REF', 'REFER',
+    'REFID', 'REFKIND', 'REF_CUSTOMERID', 'REF_CUSTOMERREF', 'REGISTRED',
+    'REMOTE_ADDR', 'REQGENFIELDS', 'RNPOFFERT', 'RTIMEOUT',
+    'RTIMEOUTREQUESTEDTIMEOUT', 'SCORINGCLIENT', 'SEQUENCETYPE', 'SETT_BATCH',
+    'SID', 'SIGNDATE', 'STATUS_3D', 'SUBSCRIPTION_ID', 'SUB_AM',
+    'SUB_AMOUNT', 'SUB_COM', 'SUB_COMMENT', 'SUB_CUR', 'SUB_ENDDATE',
+    'SUB_ORDERID', 'SUB_PERIOD_MOMENT', 'SUB_PERIOD_MOMENT_M',
+    'SUB_PERIOD_MOMENT_WW', 'SUB_PERIOD_NUMBER', 'SUB_PERIOD_NUMBER_D',
+    'SUB_PERIOD_NUMBER_M', 'SUB_PERIOD_NUMBER_WW', 'SUB_PERIOD_UNIT',
+    'SUB_STARTDATE', 'SUB_STATUS', 'TAAL', 'TBLBGCOLOR', 'TBLTXTCOLOR', 'TID',
+    'TITLE', 'TOTALAMOUNT', 'TP', 'TRACK2', 'TXTBADDR2', 'TXTCOLOR',
+    'TXTOKEN', 'TXTOKENTXTOKENPAYPAL', 'TYPE_COUNTRY',
+    'UCAF_AUTHENTICATION_DATA', 'UCAF_PAYMENT_CARD_CVC2',
+    'UCAF_PAYMENT_CARD_EXPDATE_MONTH', 'UCAF_PAYMENT_CARD_EXPDATE_YEAR',
+    'UCAF_PAYMENT_CARD_NUMBER', 'USERID', 'USERTYPE', 'VERSION',
+    'WBTU_MSISDN', 'WBTU_ORDERID', 'WEIGHTUNIT', 'WIN3DS', 'WITHROOT',
+), patterns=(
+    'AIBOOKIND', 'AICARRIER', 'AICLASS', 'AIDESTCITY', 'AIDESTCITYL',
+    'AIEXTRAPASNAME', 'AIFLDATE', 'AIFLNUM', 'AIORCITY', 'AIORCITYL',
+    'AISTOPOV', 'AITINUML', 'AMOUNT', 'EXECUTIONDATE', 'FACEXCL', 'FACTOTAL',
+    'ITEMATTRIBUTES', 'ITEMCATEGORY', 'ITEMCOMMENTS', 'ITEMDESC',
+    'ITEMDISCOUNT', 'ITEMID', 'ITEMNAME', 'ITEMPRICE', 'ITEMQUANT',
+    'ITEMQUANTORIG', 'ITEMUNITOFMEASURE', 'ITEMVAT', 'ITEMVATCODE',
+    'ITEMWEIGHT', 'LIDEXCL', 'MAXITEMQUANT', 'TAXINCLUDED',
+))
+
+SHA_OUT = ParameterTable('SHA-OUT', 1, names=(
+    'AAVADDRESS', 'AAVCHECK', 'AAVMAIL', 'AAVNAME', 'AAVPHONE', 'AAVZIP',
+    'ACCEPTANCE', 'ALIAS', 'AMOUNT', 'BIC', 'BIN', 'BRAND', 'CARDNO', 'CCCTY',
+    'CN', 'COLLECTOR_BIC', 'COLLECTOR_IBAN', 'COMPLUS', 'CREATION_STATUS',
+    'CREDITDEBIT', 'CURRENCY', 'CVCCHECK', 'DCC_COMMPERCENTAGE',
+    'DCC_CONVAMOUNT', 'DCC_CONVCCY', 'DCC_EXCHRATE', 'DCC_EXCHRATESOURCE',
+    'DCC_EXCHRATETS', 'DCC_INDICATOR', 'DCC_MARGINPERCENTAGE',
+    'DCC_VALIDHOURS', 'DEVICEID', 'DIGESTCARDNO', 'ECI', 'ED', 'EMAIL',
+    'ENCCARDNO', 'FXAMOUNT', 'FXCURRENCY', 'IP', 'IPCTY', 'MANDATEID',
+    'MOBILEMODE', 'NBREMAILUSAGE', 'NBRIPUSAGE', 'NBRIPUSAGE_ALLTX',
+    'NBRUSAGE', 'NCERROR', 'ORDERID', 'PAYID', 'PAYIDSUB',
+    'PAYMENT_REFERENCE', 'PM', 'SCORING', 'SCO_CATEGORY', 'SEQUENCETYPE',
+    'SIGNDATE', 'STATUS', 'SUBBRAND', 'SUBSCRIPTION_ID', 'TICKET', 'TRXDATE',
+    'VC',
+))
+
+# (SHA-IN, SHA-OUT) tables per version
+VERSIONS = {
+    1: (SHA_IN, SHA_OUT),
+}
+
+
+def get_table(version, out=False):
+    """ Return the SHA-IN (or SHA-OUT) table for `version`, or None when
+        every parameter should be signed. """
+
+    if version is None:
+        return None
+
+    sha_in, sha_out = VERSIONS[version]
+
+    return out and sha_out or sha_in
@@ -0,0 +1,102 @@
+"""
+Incremental parser for the ``ncresponse`` XML returned by DirectLink.
+
+Everything we need lives in the attributes of the root element, so the
+parser stops as soon as it has seen them instead of building a DOM. Nested
+payloads (like the base64 encoded ``HTML_ANSWER`` of a 3-D Secure
+response) are only collected when asked for.
+
+>>> sorted(parse_ncresponse(
+...     '<?xml version="1.0"?><ncresponse PAYID="1" STATUS="9"/>').items())
+[(u'PAYID', u'1'), (u'STATUS', u'9')]
+>>> parse_ncresponse(['<ncresponse PAYID="1" STATUS="46"><HTML_', 'ANSWER>PGZv',
+...                   'cm0+</HTML_ANSWER></ncresponse>'],
+...                  children=('HTML_ANSWER',))['HTML_ANSWER']
+u'PGZvcm0+'
+"""
+
+from xml.parsers import expat
+
+
+class _Done(Exception):
+    """ Raised from the expat handlers to stop parsing early. """
+    pass
+
+
+class NCResponseParser(object):
+    """
+    Collects the attributes of the root element and the text of the
+    direct children listed in `children`.
+
+    Feed it the response in one or more chunks; :meth:`feed` returns True
+    once everything of interest has been seen, after which the rest of the
+    response can be dropped.
+    """
+
+    def __init__(self, children=()):
+        self.children = frozenset(children)
+        self.result = {}
+        self.done = False
+
+        self._depth = 0
+        self._text = None
+
+        self._parser = expat.ParserCreate()
+        self._parser.buffer_text = True
+        self._parser.StartElementHandler = self._start
+        self._parser.EndElementHandler = self._end
+        self._parser.CharacterDataHandler = self._data
+
+    def _start(self, name, attrs):
+        self._depth += 1
+
+        if self._depth == 1:
+            self.result.update(attrs)
+            if not self.children:
+                raise _Done()
+        elif self._depth == 2 and name in self.children:
+            self._text = []
+
+    def _end(self, name):
+        if self._depth == 2 and self._text is not None:
+            self.result[name] = u''.join(self._text)
+            self._text = None
+        elif self._depth == 1:
+            raise _Done()
+
+        self._depth -= 1
+
+    def _data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+    def feed(self, data, final=False):
+        if self.done:
+            return True
+
+        try:
+            self._parser.Parse(data, final)
+        except _Done:
+            self.done = True
+
+        return self.done
+
+    def close(self):
+        self.feed('', final=True)
+
+        return self.result
+
+
+def parse_ncresponse(data, children=()):
+    """ Parse a response given as a string or an iterable of chunks. """
+
+    parser = NCResponseParser(children)
+
+    if isinstance(data, basestring):
+        data = (data,)
+
+    for chunk in data:
+        if parser.feed(chunk):
+            return parser.result
+
+    return parser.close()
@@ -0,0 +1,243 @@
+"""
+A minimal thread pool for running many blocking calls (usually DirectLink
+requests) concurrently.
+
+:func:`imap_unordered` streams results for batch jobs, while
+:class:`WorkerPool` hands out :class:`Future` objects so callers (an event
+loop for instance) can carry on and pick up the result later.
+"""
+
+import logging
+import threading
+import Queue
+
+from django_ogone import exceptions as ogone_exceptions
+from django_ogone import settings as ogone_settings
+
+log = logging.getLogger('django_ogone')
+
+# Sentinel telling a worker thread to exit
+_STOP = object()
+
+
+def _worker(func, tasks, results):
+    while True:
+        item = tasks.get()
+        if item is _STOP:
+            return
+
+        try:
+            result = func(item)
+        except Exception as e:
+            log.debug('Batch call for %r failed: %r', item, e)
+            result = e
+
+        results.put((item, result))
+
+
+def imap_unordered(func, iterable, workers=8, backlog=None):
+    """
+    Call `func` on every item of `iterable` from `workers` threads and
+    yield ``(item, result)`` pairs in completion order. If the call
+    raises, the exception instance takes the place of the result.
+
+    Items are pulled from `iterable` lazily and at most `backlog` (by
+    default twice the number of workers) are in flight at any time, so
+    memory use does not depend on the length of the input.
+
+    >>> sorted(imap_unordered(lambda x: x * 2, range(5), workers=2))
+    [(0, 0), (1, 2), (2, 4), (3, 6), (4, 8)]
+    """
+
+    assert workers > 0
+
+    if backlog is None:
+        backlog = workers * 2
+    assert backlog >= workers
+
+    tasks = Queue.Queue()
+    results = Queue.Queue()
+
+    threads = []
+    for i in range(workers):
+        thread = threading.Thread(target=_worker, args=(func, tasks, results))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    pending = 0
+    try:
+        for item in iterable:
+            tasks.put(item)
+            pending += 1
+
+            if pending >= backlog:
+                yield results.get()
+                pending -= 1
+
+        while pending:
+            yield results.get()
+            pending -= 1
+    finally:
+        # If the consumer stopped iterating halfway, drop the calls that
+        # have not started yet and let the workers exit.
+        while True:
+            try:
+                tasks.get_nowait()
+            except Queue.Empty:
+                break
+
+        for thread in threads:
+            tasks.put(_STOP)
+
+
+class Future(object):
+    """ The eventual result of a call submitted to a :class:`WorkerPool`. """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._result = None
+        self._exception = None
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """ Wait for the call to finish and return its result, raising the
+            exception instead if the call failed. """
+
+        exception = self.exception(timeout)
+        if exception is not None:
+            raise exception
+
+        return self._result
+
+    def exception(self, timeout=None):
+        """ Wait for the call to finish and return its exception, if any. """
+
+        if not self._done.wait(timeout):
+            raise ogone_exceptions.OgoneException(
+                'Call did not finish within %s seconds' % timeout)
+
+        return self._exception
+
+    def add_done_callback(self, callback):
+        """ Call `callback` with this future once it is done. Callbacks of
+            pending futures run on the worker thread, so hand off to your
+            event loop from there. """
+
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+
+        callback(self)
+
+    def _finish(self, result, exception):
+        with self._lock:
+            self._result = result
+            self._exception = exception
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                log.exception('Exception in future callback')
+
+
+class WorkerPool(object):
+    """
+    A fixed number of worker threads executing submitted calls.
+
+    >>> pool = WorkerPool(workers=2)
+    >>> pool.submit(sum, [1, 2, 3]).result()
+    6
+    >>> pool.shutdown()
+    """
+
+    def __init__(self, workers=8):
+        assert workers > 0
+
+        self.workers = workers
+        self._tasks = Queue.Queue()
+        self._threads = []
+
+        for i in range(workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            task = self._tasks.get()
+            if task is _STOP:
+                return
+
+            future, func, args, kwargs = task
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                future._finish(None, e)
+            else:
+                future._finish(result, None)
+
+    def submit(self, func, *args, **kwargs):
+        """ Schedule ``func(*args, **kwargs)`` and return a :class:`Future`. """
+
+        future = Future()
+        self._tasks.put((future, func, args, kwargs))
+
+        return future
+
+    def shutdown(self, wait=True):
+        """ Stop the workers once the calls already submitted are done. """
+
+        for thread in self._threads:
+            self._tasks.put(_STOP)
+
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+
+def gather(futures, return_exceptions=False):
+    """
+    Wait for all `futures` and return their results in the same order.
+
+    If `return_exceptions` is true, failed calls contribute their exception
+    to the list, otherwise the first failure (in input order) is raised.
+    """
+
+    results = []
+    for future in futures:
+        exception = future.exception()
+        if exception is not None and not return_exceptions:
+            raise exception
+        if exception is not None:
+            results.append(exception)
+        else:
+            results.append(future._result)
+
+    return results
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """ Return the shared worker pool, creating it on first use. """
+
+    global _pool
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = WorkerPool(ogone_settings.DIRECT_LINK_WORKERS)
+
+    return _pool
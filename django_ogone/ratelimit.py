@@ -0,0 +1,318 @@
+"""
+Keeping outbound DirectLink traffic under Ogone's limits.
+
+Ogone throttles DirectLink per PSPID. When many processes call it on
+their own, they trip that limit together and their retries make it worse.
+A :class:`RateLimiter` gives every call a turn from token buckets shared by
+all processes. Calls wait for their turn instead of being turned away, so
+the combined rate stays steady, just under the budget.
+
+Budgets are set per PSPID, and optionally per PSPID and DirectLink
+OPERATION, as a rate per second or as ``(rate, burst)``::
+
+    OGONE_DIRECT_LINK_RATE_LIMITS = {
+        '*': 20,                  # every merchant without its own budget
+        'mycutePS': (50, 100),
+        'mycutePS:SAS': 10,       # captures of mycutePS
+        '*:RFD': 5,               # refunds of any merchant
+    }
+
+A call takes a turn from the bucket of its merchant and from the one of
+its operation, if there is one. Calls which would have to wait more than
+``OGONE_DIRECT_LINK_RATE_LIMIT_TIMEOUT`` seconds raise RateLimitException.
+
+The buckets live in the process (``'local'``), in files shared by all
+processes on the host (``'file'``, the default) or in a backend of your
+own, for several hosts: set ``OGONE_DIRECT_LINK_RATE_LIMIT_BACKEND`` to the
+dotted path of a class with the :meth:`LocalBackend.reserve` method, and
+optionally :meth:`LocalBackend.release`.
+
+>>> limiter = RateLimiter({'*': (10, 2)}, LocalBackend())
+>>> [round(limiter.reserve('mycutePS'), 1) for i in range(4)]
+[0.0, 0.0, 0.1, 0.2]
+"""
+
+import errno
+import logging
+import os
+import re
+import stat
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, where the 'file' backend falls back to 'local'
+    fcntl = None
+
+from django_ogone import exceptions as ogone_exceptions
+from django_ogone import settings as ogone_settings
+from django_ogone import metrics as ogone_metrics
+
+log = logging.getLogger('django_ogone')
+
+# Budget key matching every merchant or operation
+ANY = '*'
+
+
+def _take(state, now, rate, burst, max_delay):
+    """ Take a token from the bucket `state`, a (tokens, time) pair, or
+        None for a full bucket. Returns the new state and the seconds to
+        wait for the token, or (None, None) if that is over `max_delay`.
+
+        Tokens may go negative: a waiting call has reserved the next
+        token, so the ones after it queue up behind it instead of all
+        waking up at once. """
+
+    if state is None:
+        tokens = burst
+    else:
+        tokens = min(burst, state[0] + (now - state[1]) * rate)
+
+    tokens -= 1
+    delay = tokens < 0 and -tokens / float(rate) or 0.0
+    if max_delay is not None and delay > max_delay:
+        return None, None
+
+    return (tokens, now), delay
+
+
+def _give(state, now, rate, burst):
+    """ Put a token taken with _take back into the bucket `state`. """
+
+    if state is None:
+        return None
+
+    return (min(burst, state[0] + (now - state[1]) * rate + 1), now)
+
+
+class LocalBackend(object):
+    """ Token buckets of this process. """
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, key, rate, burst, max_delay=None):
+        """ Take a token from the bucket `key` and return the seconds until
+            it may be used, or None without taking it if that is more than
+            `max_delay`. """
+
+        with self._lock:
+            state, delay = _take(self._buckets.get(key), time.time(), rate,
+                                 burst, max_delay)
+            if state is not None:
+                self._buckets[key] = state
+
+        return delay
+
+    def release(self, key, rate, burst):
+        """ Give back a token taken from the bucket `key`. """
+
+        with self._lock:
+            state = _give(self._buckets.get(key), time.time(), rate, burst)
+            if state is not None:
+                self._buckets[key] = state
+
+
+def _get_private_directory():
+    """ Return a directory under the temporary directory which only we
+        can write to, creating it if need be. """
+
+    import tempfile
+
+    directory = os.path.join(tempfile.gettempdir(),
+                             'django_ogone-%d' % os.getuid())
+    try:
+        os.mkdir(directory, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or \
+            info.st_mode & 0o077:
+        raise ogone_exceptions.OgoneException(
+            '%s is not a private directory' % directory)
+
+    return directory
+
+
+class FileBackend(object):
+    """ Token buckets in files under `directory`, locked with flock, which
+        all processes on the host share. By default the directory is one
+        of the current user under the temporary directory. """
+
+    _format = '=dd'
+
+    # Never follow a link someone planted where a bucket file should be
+    _flags = os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0)
+
+    def __init__(self, directory=None, prefix='ogone-ratelimit-'):
+        assert fcntl is not None, 'FileBackend needs fcntl'
+
+        if directory is None:
+            directory = _get_private_directory()
+
+        self.directory = directory
+        self.prefix = prefix
+
+    def get_path(self, key):
+        return os.path.join(self.directory, self.prefix +
+                            re.sub(r'[^A-Za-z0-9_-]', '_', key))
+
+    def _update(self, key, update):
+        """ Replace the state of the bucket `key` with the one `update`
+            returns for it, under an exclusive lock. Returns what else
+            `update` returned. """
+
+        size = struct.calcsize(self._format)
+
+        fd = os.open(self.get_path(key), self._flags, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+
+            data = os.read(fd, size)
+            state = len(data) == size and struct.unpack(self._format, data) \
+                or None
+
+            state, result = update(state)
+            if state is not None:
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.write(fd, struct.pack(self._format, *state))
+        finally:
+            # Closing releases the lock
+            os.close(fd)
+
+        return result
+
+    def reserve(self, key, rate, burst, max_delay=None):
+        return self._update(key, lambda state: _take(
+            state, time.time(), rate, burst, max_delay))
+
+    def release(self, key, rate, burst):
+        self._update(key, lambda state: (
+            _give(state, time.time(), rate, burst), None))
+
+
+def _parse_budget(budget):
+    if isinstance(budget, (list, tuple)):
+        rate, burst = budget
+    else:
+        # Allow a second's worth of calls at once
+        rate, burst = budget, max(1, budget)
+
+    assert rate > 0 and burst >= 1
+    return float(rate), float(burst)
+
+
+class RateLimiter(object):
+    """ Hands out turns for DirectLink calls according to `budgets`. """
+
+    def __init__(self, budgets, backend=None, timeout=30):
+        if backend is None:
+            backend = LocalBackend()
+
+        self.budgets = dict([(key, _parse_budget(budget))
+                             for key, budget in budgets.items()])
+        self.backend = backend
+        self.timeout = timeout
+
+    def get_buckets(self, merchant, operation=None):
+        """ Return the (key, rate, burst) of the buckets a call of
+            `merchant` takes a turn from. """
+
+        buckets = []
+
+        for key in (merchant, ANY):
+            if key in self.budgets:
+                buckets.append((key,) + self.budgets[key])
+                break
+
+        if operation:
+            for key in ('%s:%s' % (merchant, operation),
+                        '%s:%s' % (ANY, operation)):
+                if key in self.budgets:
+                    buckets.append((key,) + self.budgets[key])
+                    break
+
+        return buckets
+
+    def reserve(self, merchant, operation=None):
+        """ Reserve a turn and return the seconds until it comes. Raises
+            RateLimitException if that is more than `timeout`. """
+
+        wait = 0.0
+        taken = []
+        for key, rate, burst in self.get_buckets(merchant, operation):
+            # Every merchant gets a bucket of its own for the '*' budgets
+            bucket = key.startswith(ANY) and '%s%s' % (merchant, key[1:]) \
+                or key
+            delay = self.backend.reserve(bucket, rate, burst, self.timeout)
+            if delay is None:
+                # The turns we did get go to other calls
+                release = getattr(self.backend, 'release', None)
+                if release is not None:
+                    for args in taken:
+                        release(*args)
+
+                ogone_metrics.increment('directlink.rate_limited',
+                                        merchant=merchant)
+                raise ogone_exceptions.RateLimitException(
+                    'No DirectLink turn for %s within %ss' %
+                    (bucket, self.timeout))
+            taken.append((bucket, rate, burst))
+            wait = max(wait, delay)
+
+        return wait
+
+    def acquire(self, merchant, operation=None):
+        """ Wait for a turn for a call of `merchant`. """
+
+        wait = self.reserve(merchant, operation)
+        if wait > 0:
+            log.debug('Waiting %.3fs for a DirectLink turn for %s',
+                      wait, merchant)
+            ogone_metrics.increment('directlink.throttled', merchant=merchant)
+            time.sleep(wait)
+
+
+def _load_backend(path):
+    module_name, class_name = path.rsplit('.', 1)
+    module = __import__(module_name, {}, {}, [class_name])
+
+    return getattr(module, class_name)()
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    """ Return the limiter configured in the settings, None without any
+        budgets. """
+
+    global _limiter
+
+    if _limiter is None:
+        if not ogone_settings.DIRECT_LINK_RATE_LIMITS:
+            return None
+
+        with _limiter_lock:
+            if _limiter is None:
+                name = ogone_settings.DIRECT_LINK_RATE_LIMIT_BACKEND
+                if name == 'local' or (name == 'file' and fcntl is None):
+                    backend = LocalBackend()
+                elif name == 'file':
+                    backend = FileBackend(
+                        ogone_settings.DIRECT_LINK_RATE_LIMIT_DIRECTORY)
+                else:
+                    backend = _load_backend(name)
+
+                _limiter = RateLimiter(
+                    ogone_settings.DIRECT_LINK_RATE_LIMITS, backend,
+                    ogone_settings.DIRECT_LINK_RATE_LIMIT_TIMEOUT)
+
+    return _limiter
@@ -0,0 +1,308 @@
+"""
+Bringing local order statuses back in line with Ogone.
+
+A :class:`Reconciler` asks DirectLink for the status of every order it is
+given (a number of queries at a time), compares it with the status we have
+locally and hands the differences, one batch at a time, to an `apply`
+callable. :class:`QuerySetUpdater` applies them to a Django model with one
+UPDATE per status.
+
+Progress is written to a :class:`Checkpoint` file after every batch (but
+not on dry runs), so an interrupted run continues after the last order it
+finished when started again. This requires the orders to come in the order
+of their ids, as :func:`iter_queryset` does. Orders whose status query
+failed are written to the checkpoint too, which is kept after the run, and
+queried again first thing on the next run. The ``ogone_reconcile``
+management command puts it all together.
+"""
+
+import collections
+import json
+import logging
+import os
+
+from django_ogone import settings as ogone_settings
+from django_ogone import status_codes
+from django_ogone import exceptions as ogone_exceptions
+from django_ogone import pool as ogone_pool
+
+log = logging.getLogger('django_ogone')
+
+# The NCERROR of a status query for an order Ogone doesn't know
+UNKNOWN_ORDER_NCERROR = '50001130'
+
+
+class Change(collections.namedtuple('Change', 'order_id local remote')):
+    """ An order whose status at Ogone (`remote`) differs from ours. """
+
+    @property
+    def info(self):
+        return status_codes.get_status_info(self.remote)
+
+    @property
+    def category(self):
+        """ The category of the new status, 'other' for documented statuses
+            without one (refunds, deletions) and 'unknown' for statuses
+            Ogone doesn't document. """
+
+        info = self.info
+        if info is None:
+            return 'unknown'
+        return info.category or 'other'
+
+
+def _to_status(value):
+    if value is None or value == '':
+        return None
+    return int(value)
+
+
+def _to_local_status(value):
+    # A local status we can't read, say 'paid', never matches Ogone's
+    try:
+        return _to_status(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class Checkpoint(object):
+    """ Remembers the last order a run finished, its counts and the
+        orders whose status query failed. """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """ Return the saved (last order id, report, failed orders), or
+            (None, None, []). """
+
+        if not os.path.exists(self.path):
+            return None, None, []
+
+        with open(self.path) as f:
+            state = json.load(f)
+
+        failed = [tuple(order) for order in state.get('failed', [])]
+
+        return state['last_order_id'], state['report'], failed
+
+    def save(self, last_order_id, report, failed=()):
+        # Write to a temporary file first, so an interrupted write can't
+        # leave us without a checkpoint
+        temporary = '%s.tmp' % self.path
+        with open(temporary, 'w') as f:
+            json.dump({'last_order_id': last_order_id, 'report': report,
+                       'failed': list(failed)}, f)
+        os.rename(temporary, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Reconciler(object):
+    """
+    Queries Ogone for the status of orders and applies the differences.
+
+    `apply` is called with a list of :class:`Change` for every batch of
+    `batch_size` orders, unless `dry_run` is set. Changes to statuses
+    Ogone doesn't document are reported, but never applied. Dry runs
+    resume from the checkpoint, but leave it alone.
+    """
+
+    def __init__(self, apply=None, url=None, settings=ogone_settings,
+                 transport=None, workers=None, batch_size=500,
+                 checkpoint=None, dry_run=False):
+        from django_ogone.ogone import OgoneDirectLink
+
+        assert batch_size > 0
+        assert apply is not None or dry_run
+
+        if url is None:
+            url = OgoneDirectLink.get_query_action(settings=settings)
+        if workers is None:
+            workers = ogone_settings.DIRECT_LINK_WORKERS
+        if isinstance(checkpoint, basestring):
+            checkpoint = Checkpoint(checkpoint)
+
+        self.apply = apply
+        self.url = url
+        self.settings = settings
+        self.transport = transport
+        self.workers = workers
+        self.batch_size = batch_size
+        self.checkpoint = checkpoint
+        self.dry_run = dry_run
+
+        self.resume_after = None
+        self.report = self._new_report()
+        # (order id, local status) of the failed queries of the last run,
+        # still to retry, and of this one
+        self.retry = []
+        self.failed = []
+        if checkpoint is not None:
+            resume_after, report, retry = checkpoint.load()
+            if resume_after is not None:
+                log.info('Resuming reconciliation after order %s',
+                         resume_after)
+                self.resume_after = resume_after
+                self.report = report
+                self.retry = retry
+        self.last_order_id = self.resume_after
+
+    @staticmethod
+    def _new_report():
+        return {
+            'checked': 0,
+            'unchanged': 0,
+            'changed': 0,
+            'applied': 0,
+            'missing': 0,
+            'failed': 0,
+            'categories': {},
+        }
+
+    def query(self, order_id):
+        """ Return the status of `order_id` at Ogone, None if Ogone doesn't
+            know the order. Raises OgoneException for other errors. """
+
+        from django_ogone.ogone import OgoneDirectLink
+
+        response = OgoneDirectLink.query(self.url, {'orderID': order_id},
+                                         settings=self.settings,
+                                         transport=self.transport)
+        ncerror = response.get('NCERROR', '0')
+        if ncerror == UNKNOWN_ORDER_NCERROR:
+            return None
+        if ncerror != '0':
+            raise ogone_exceptions.OgoneException(
+                'Status query for order %s failed with NCERROR %s' %
+                (order_id, ncerror))
+
+        return _to_status(response.get('STATUS'))
+
+    def _check(self, order):
+        order_id, local = order
+        return self.query(order_id)
+
+    def _reconcile_batch(self, batch):
+        report = self.report
+        changes = []
+
+        for (order_id, local), remote in ogone_pool.imap_unordered(
+                self._check, batch, workers=self.workers):
+            report['checked'] += 1
+
+            if isinstance(remote, Exception):
+                log.error('Querying the status of order %s failed: %r',
+                          order_id, remote)
+                report['failed'] += 1
+                self.failed.append((order_id, local))
+            elif remote is None:
+                report['missing'] += 1
+            elif remote == _to_local_status(local):
+                report['unchanged'] += 1
+            else:
+                change = Change(order_id, local, remote)
+                report['changed'] += 1
+                categories = report['categories']
+                categories[change.category] = \
+                    categories.get(change.category, 0) + 1
+
+                if change.info is not None:
+                    changes.append(change)
+
+        if changes and not self.dry_run:
+            self.apply(changes)
+            report['applied'] += len(changes)
+
+    def run(self, orders):
+        """
+        Reconcile `orders`, an iterable of ``(order_id, local status)``,
+        and return the report: the number of orders checked, unchanged,
+        changed, applied, missing at Ogone and failed to query, and the
+        changes per status category.
+
+        When resuming from a checkpoint, `orders` should start after
+        :attr:`resume_after`. The orders in :attr:`retry`, whose status
+        query failed on the last run, are checked again first.
+        """
+
+        while self.retry:
+            batch = self.retry[:self.batch_size]
+            self.retry = self.retry[self.batch_size:]
+            # They were counted as failed, and are counted again now
+            self.report['checked'] -= len(batch)
+            self.report['failed'] -= len(batch)
+            self._finish_batch(batch)
+
+        batch = []
+        for order in orders:
+            batch.append(order)
+            if len(batch) >= self.batch_size:
+                self.last_order_id = batch[-1][0]
+                self._finish_batch(batch)
+                batch = []
+
+        if batch:
+            self.last_order_id = batch[-1][0]
+            self._finish_batch(batch)
+
+        if self.checkpoint is not None and not self.dry_run:
+            if self.failed:
+                log.warning('Keeping the reconciliation checkpoint, %d failed '
+                            'status queries are retried on the next run',
+                            len(self.failed))
+            else:
+                self.checkpoint.clear()
+
+        return self.report
+
+    def _finish_batch(self, batch):
+        self._reconcile_batch(batch)
+
+        if self.checkpoint is not None and not self.dry_run:
+            self.checkpoint.save(self.last_order_id, self.report,
+                                 self.failed + self.retry)
+
+
+class QuerySetUpdater(object):
+    """ Applies changes to the rows of `queryset`, with one UPDATE per
+        new status. """
+
+    def __init__(self, queryset, order_field, status_field):
+        self.queryset = queryset
+        self.order_field = order_field
+        self.status_field = status_field
+
+    def __call__(self, changes):
+        by_status = {}
+        for change in changes:
+            by_status.setdefault(change.remote, []).append(change.order_id)
+
+        for status, order_ids in by_status.items():
+            self.queryset.filter(**{
+                '%s__in' % self.order_field: order_ids,
+            }).update(**{self.status_field: status})
+
+
+def iter_queryset(queryset, order_field, status_field, after=None,
+                  chunk_size=1000):
+    """ Yield ``(order_id, status)`` for every row of `queryset`, ordered
+        by `order_field` and starting after `after`. Fetches `chunk_size`
+        rows at a time. """
+
+    queryset = queryset.order_by(order_field)
+
+    while True:
+        chunk = queryset
+        if after is not None:
+            chunk = chunk.filter(**{'%s__gt' % order_field: after})
+
+        rows = list(chunk.values_list(order_field, status_field)[:chunk_size])
+        for row in rows:
+            yield row
+
+        if len(rows) < chunk_size:
+            return
+        after = rows[-1][0]
@@ -0,0 +1,84 @@
+"""
+Renders the hidden inputs of the Ogone checkout form directly, without
+going through Django's form and widget machinery.
+
+The markup for a given set of field names is built once and cached, so
+rendering a checkout only has to escape and fill in the values.
+
+>>> print(render_hidden_inputs({'orderID': 14, 'COM': u'Fish & <chips>'}))
+<input type="hidden" name="COM" value="Fish &amp; &lt;chips&gt;" /><input type="hidden" name="orderID" value="14" />
+"""
+
+import sys
+
+# Forget about cached templates once we have this many
+MAX_TEMPLATES = 256
+
+_templates = {}
+
+_mark_safe = None
+
+
+def mark_safe(s):
+    """ Mark `s` safe for Django templates. Only imports Django when the
+        process uses it already; we do not need it to render the inputs. """
+
+    global _mark_safe
+
+    if _mark_safe is None:
+        if 'django' not in sys.modules:
+            return s
+        try:
+            from django.utils.safestring import mark_safe as _mark_safe
+        except ImportError:
+            _mark_safe = lambda s: s
+
+    return _mark_safe(s)
+
+
+def force_unicode(value):
+    if value is None:
+        return u''
+    if isinstance(value, str):
+        return value.decode('utf8')
+    return unicode(value)
+
+
+def escape(value):
+    """ Escape `value` for use in an HTML attribute. """
+
+    return force_unicode(value).replace(u'&', u'&amp;') \
+        .replace(u'<', u'&lt;').replace(u'>', u'&gt;') \
+        .replace(u'"', u'&quot;').replace(u"'", u'&#39;')
+
+
+def _get_template(keys):
+    template = _templates.get(keys)
+
+    if template is None:
+        if len(_templates) >= MAX_TEMPLATES:
+            _templates.clear()
+
+        template = u''.join([
+            u'<input type="hidden" name="%s" value="%%s" />' %
+                escape(key).replace(u'%', u'%%')
+            for key in keys])
+        _templates[keys] = template
+
+    return template
+
+
+def render_hidden_inputs(data):
+    """ Return the hidden inputs for all items in `data`, sorted by name. """
+
+    keys = tuple(sorted(data))
+    values = tuple([escape(data[key]) for key in keys])
+
+    return mark_safe(_get_template(keys) % values)
+
+
+def to_post_data(data):
+    """ Return `data` with all values as unicode strings, ready to be
+        posted or serialized. """
+
+    return dict([(key, force_unicode(value)) for key, value in data.items()])
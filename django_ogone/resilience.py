@@ -0,0 +1,300 @@
+"""
+Retries and circuit breaking for DirectLink calls.
+
+A :class:`RetryPolicy` decides whether a failed call is tried again and
+how long to wait first (exponential backoff with full jitter). Calls which
+never reached Ogone (the connection couldn't be made) are always safe to
+retry. Once a request has been sent, only idempotent calls, like status
+queries, are retried: retrying a capture or refund Ogone did receive could
+charge or refund twice.
+
+A :class:`CircuitBreaker` per endpoint keeps track of recent failures.
+When more than `failure_threshold` of the calls in the last `window`
+seconds failed, it opens and calls fail straight away with
+CircuitOpenException, instead of tying up a worker waiting for a broken
+Ogone. After `reset_timeout` seconds a single trial call is let through;
+the breaker closes again if it succeeds. A trial call failing for reasons
+that say nothing about Ogone (a 4xx, say) leaves the trial to the next
+call. Calls let through before the breaker opened don't count once they
+finish, only the trial decides. :func:`get_breakers` returns the
+state of all breakers for monitoring.
+
+>>> breaker = CircuitBreaker(failure_threshold=0.5, min_calls=2)
+>>> breaker.record(False); breaker.record(False)
+>>> breaker.state
+'open'
+>>> breaker.before_call()
+Traceback (most recent call last):
+...
+CircuitOpenException: Circuit breaker for DirectLink is open
+"""
+
+import collections
+import logging
+import random
+import threading
+import time
+import urlparse
+
+from django_ogone import exceptions as ogone_exceptions
+from django_ogone import settings as ogone_settings
+from django_ogone import metrics as ogone_metrics
+
+log = logging.getLogger('django_ogone')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+def is_failure(exception):
+    """ Whether `exception` says something about the health of Ogone, as
+        opposed to a problem with our request. """
+
+    if not isinstance(exception, ogone_exceptions.TransportException):
+        return False
+
+    return exception.status is None or exception.status >= 500
+
+
+class RetryPolicy(object):
+    """ Retries failed calls up to `retries` times, waiting a random time
+        of up to ``backoff * 2 ** attempt`` (capped at `max_backoff`)
+        seconds in between. """
+
+    def __init__(self, retries=2, backoff=0.5, max_backoff=10):
+        assert retries >= 0
+
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def should_retry(self, exception, attempt, idempotent=False):
+        if attempt >= self.retries:
+            return False
+
+        if isinstance(exception, ogone_exceptions.ConnectException):
+            return True
+
+        return idempotent and is_failure(exception)
+
+    def get_delay(self, attempt):
+        return random.uniform(0, min(self.max_backoff,
+                                     self.backoff * 2 ** attempt))
+
+
+class CircuitBreaker(object):
+    """ Fails calls fast while too many recent calls failed. Needs at least
+        `min_calls` calls in the window before it opens. """
+
+    def __init__(self, failure_threshold=0.5, min_calls=20, window=60,
+                 reset_timeout=30, name='DirectLink'):
+        assert 0 < failure_threshold <= 1
+
+        self.failure_threshold = failure_threshold
+        self.min_calls = min_calls
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.name = name
+
+        self.opened_at = None
+        self._state = CLOSED
+        self._trial = False
+        # Moves on whenever the state changes or a trial call is let
+        # through, so outcomes of calls let through before are ignored
+        self._generation = 0
+        # (time, succeeded) of the calls in the window
+        self._calls = collections.deque()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and \
+                    time.time() - self.opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def before_call(self):
+        """ Raise CircuitOpenException unless a call may go ahead. Returns
+            the token to pass to :meth:`record` or :meth:`release` for
+            it. """
+
+        with self._lock:
+            if self._state == CLOSED:
+                return self._generation
+
+            if time.time() - self.opened_at >= self.reset_timeout \
+                    and not self._trial:
+                # Let a single call find out whether Ogone is back
+                self._state = HALF_OPEN
+                self._trial = True
+                self._generation += 1
+                return self._generation
+
+        raise ogone_exceptions.CircuitOpenException(
+            'Circuit breaker for %s is open' % self.name)
+
+    def record(self, succeeded, token=None):
+        """ Record the outcome of the call before_call returned `token`
+            for. """
+
+        now = time.time()
+
+        with self._lock:
+            if token is not None and token != self._generation:
+                return
+
+            if self._state == HALF_OPEN:
+                self._trial = False
+                if succeeded:
+                    log.info('Closing the circuit breaker for %s', self.name)
+                    self._state = CLOSED
+                    self._generation += 1
+                    self._calls.clear()
+                else:
+                    self._open(now)
+                return
+
+            self._calls.append((now, succeeded))
+            self._expire(now)
+
+            if self._state == CLOSED and len(self._calls) >= self.min_calls:
+                failures = len([c for c in self._calls if not c[1]])
+                if failures >= self.failure_threshold * len(self._calls):
+                    self._open(now)
+
+    def release(self, token=None):
+        """ Give up the trial call of a half-open breaker without an
+            outcome, so another call gets to try. """
+
+        with self._lock:
+            if token is not None and token != self._generation:
+                return
+
+            if self._state == HALF_OPEN:
+                self._trial = False
+
+    def _open(self, now):
+        log.error('Opening the circuit breaker for %s', self.name)
+        ogone_metrics.increment('directlink.breaker_opened',
+                                endpoint=self.name)
+        self._state = OPEN
+        self._generation += 1
+        self.opened_at = now
+
+    def stats(self):
+        with self._lock:
+            self._expire(time.time())
+            calls = len(self._calls)
+            failures = len([c for c in self._calls if not c[1]])
+
+        return {
+            'state': self.state,
+            'calls': calls,
+            'failures': failures,
+            'error_rate': calls and float(failures) / calls or 0.0,
+            'opened_at': self.opened_at,
+        }
+
+
+def call(func, policy=None, breaker=None, idempotent=False, name=None,
+         before=None):
+    """ Call `func` under `breaker`, retrying as `policy` allows.
+        `before` is called ahead of every attempt, before the breaker lets
+        it through, and what it raises doesn't count against the breaker. """
+
+    attempt = 0
+    while True:
+        if before is not None:
+            before()
+
+        if breaker is not None:
+            token = breaker.before_call()
+
+        try:
+            result = func()
+        except Exception as e:
+            if breaker is not None:
+                if is_failure(e) or \
+                        isinstance(e, ogone_exceptions.ConnectException):
+                    breaker.record(False, token)
+                else:
+                    breaker.release(token)
+
+            if policy is None or \
+                    not policy.should_retry(e, attempt, idempotent):
+                raise
+
+            delay = policy.get_delay(attempt)
+            log.warning('DirectLink call to %s failed (%r), retrying in '
+                        '%.2fs', name, e, delay)
+            ogone_metrics.increment('directlink.retries', endpoint=name)
+            time.sleep(delay)
+            attempt += 1
+            continue
+        except BaseException:
+            if breaker is not None:
+                breaker.release(token)
+            raise
+
+        if breaker is not None:
+            breaker.record(True, token)
+
+        return result
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_endpoint(url):
+    parts = urlparse.urlsplit(url)
+    return '%s://%s' % (parts.scheme, parts.netloc)
+
+
+def get_breaker(url):
+    """ Return the circuit breaker for the endpoint of `url`, None if they
+        are disabled. """
+
+    if not ogone_settings.DIRECT_LINK_BREAKER_ENABLED:
+        return None
+
+    endpoint = get_endpoint(url)
+    breaker = _breakers.get(endpoint)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(endpoint)
+            if breaker is None:
+                breaker = _breakers[endpoint] = CircuitBreaker(
+                    ogone_settings.DIRECT_LINK_BREAKER_THRESHOLD,
+                    ogone_settings.DIRECT_LINK_BREAKER_MIN_CALLS,
+                    ogone_settings.DIRECT_LINK_BREAKER_WINDOW,
+                    ogone_settings.DIRECT_LINK_BREAKER_RESET_TIMEOUT,
+                    name=endpoint)
+
+    return breaker
+
+
+def get_breakers():
+    """ Return the stats of every circuit breaker, by endpoint. """
+
+    return dict([(endpoint, breaker.stats())
+                 for endpoint, breaker in _breakers.items()])
+
+
+_policy = None
+
+
+def get_retry_policy():
+    global _policy
+
+    if _policy is None:
+        _policy = RetryPolicy(ogone_settings.DIRECT_LINK_RETRIES,
+                              ogone_settings.DIRECT_LINK_RETRY_BACKOFF)
+
+    return _policy
@@ -0,0 +1,156 @@
+"""
+The parsed parameters of an Ogone postback.
+
+>>> result = OgoneResult({'ORDERID': '13', 'STATUS': '9', 'TRXDATE': '09/24/10',
+...                       'ED': '0111', 'AMOUNT': '6794.81', 'PM': 'CreditCard'})
+>>> result.status, result.order_id, result.amount
+(9, 13, Decimal('6794.81'))
+>>> result.transaction_date, result.expiry_date
+(datetime.date(2010, 9, 24), datetime.date(2011, 1, 1))
+>>> result['STATUS'], result['PM']
+(9, 'CreditCard')
+>>> result == dict(result.iteritems())
+True
+"""
+
+import collections
+import datetime
+
+
+def parse_trxdate(value):
+    """ Ogone sends transaction dates as MM/DD/YY. """
+
+    month, day, year = map(int, value.split('/'))
+    # Ogone responds with a year coded on 2 digits. Add, the 2000
+    # years delta.
+    year += 2000
+    # --//--
+    return datetime.date(year, month, day)
+
+
+def parse_ed(value):
+    """ Card expiry dates are sent as MMYY. """
+
+    month, year = int(value[:2]), int(value[-2:])
+    # Ogone responds with a year coded on 2 digits. Add, the 2000
+    # years delta.
+    year += 2000
+    # --//--
+    return datetime.date(year, month, 1)
+
+
+class OgoneResult(collections.Mapping):
+    """
+    Wraps the normalized (upper case keys) postback parameters. Fields are
+    converted to Python types the first time they are accessed and cached
+    after that.
+
+    It is a read-only mapping like the dict parse_params used to return,
+    and compares equal to that dict: ORDERID, STATUS, TRXDATE and ED are
+    converted, anything else is returned as is. Use :meth:`copy` for a
+    dict of your own.
+    """
+
+    __slots__ = ('params', 'valid', '_order_id', '_status', '_transaction_date',
+                 '_expiry_date', '_amount')
+
+    # Converted keys and the attribute holding their value
+    converted = {
+        'ORDERID': 'order_id',
+        'STATUS': 'status',
+        'TRXDATE': 'transaction_date',
+        'ED': 'expiry_date',
+    }
+
+    def __init__(self, params, valid=True):
+        self.params = params
+        self.valid = valid
+
+    @property
+    def order_id(self):
+        try:
+            return self._order_id
+        except AttributeError:
+            self._order_id = int(self.params.get('ORDERID'))
+            return self._order_id
+
+    @property
+    def status(self):
+        try:
+            return self._status
+        except AttributeError:
+            self._status = int(self.params.get('STATUS'))
+            return self._status
+
+    @property
+    def transaction_date(self):
+        try:
+            return self._transaction_date
+        except AttributeError:
+            value = self.params.get('TRXDATE')
+            self._transaction_date = parse_trxdate(value) if value else None
+            return self._transaction_date
+
+    @property
+    def expiry_date(self):
+        try:
+            return self._expiry_date
+        except AttributeError:
+            value = self.params.get('ED')
+            self._expiry_date = parse_ed(value) if value else None
+            return self._expiry_date
+
+    @property
+    def amount(self):
+        try:
+            return self._amount
+        except AttributeError:
+            value = self.params.get('AMOUNT')
+            if value:
+                # Slow to import, and most postbacks are never asked
+                import decimal
+                self._amount = decimal.Decimal(value)
+            else:
+                self._amount = None
+            return self._amount
+
+    def __getitem__(self, key):
+        attribute = self.converted.get(key)
+        if attribute is None:
+            return self.params[key]
+
+        if key not in self.params:
+            raise KeyError(key)
+        return getattr(self, attribute)
+
+    def get(self, key, default=None):
+        if key in self.params:
+            return self[key]
+        return default
+
+    def __contains__(self, key):
+        return key in self.params
+
+    def __iter__(self):
+        return iter(self.params)
+
+    def __len__(self):
+        return len(self.params)
+
+    def keys(self):
+        return self.params.keys()
+
+    def items(self):
+        return [(key, self[key]) for key in self.params]
+
+    def copy(self):
+        return dict(self.items())
+
+    def __getstate__(self):
+        return self.params, self.valid
+
+    def __setstate__(self, state):
+        self.params, self.valid = state
+
+    def __repr__(self):
+        return '<OgoneResult %r>' % self.params
@@ -0,0 +1,239 @@
+"""
+Spreading DirectLink traffic over equivalent endpoints.
+
+Configure a list of urls instead of a single one::
+
+    OGONE_DIRECT_LINK_PROD_URL = [
+        'https://secure.ogone.com/ncol/prod/maintenancedirect.asp',
+        'https://secure2.example.com/ncol/prod/maintenancedirect.asp',
+    ]
+
+and :meth:`OgoneDirectLink.get_action` (like ``get_query_action`` and
+``get_order_action``) returns the list, which :meth:`OgoneDirectLink.request`,
+:meth:`~OgoneDirectLink.query` and :meth:`~OgoneDirectLink.order` accept
+as their `url`, as they do an :class:`EndpointRouter`. Each call then goes
+to the endpoint with the best score: its moving average latency,
+penalized by its moving average error rate. Endpoints whose circuit
+breaker is open are skipped, and calls that failed without reaching Ogone
+(or that are safe to repeat) fail over to the next endpoint.
+
+Every attempt on an endpoint counts towards its averages, without the time
+spent waiting to retry it. Endpoints that are avoided don't get traffic to
+show they recovered, so routers probe all their endpoints every
+``OGONE_DIRECT_LINK_PROBE_INTERVAL`` seconds (30 by default), and whenever
+you call :meth:`EndpointRouter.probe`.
+
+>>> router = EndpointRouter(['http://a/', 'http://b/'])
+>>> router.record('http://a/', 0.2)
+>>> router.record('http://b/', 0.1)
+>>> router.choose()
+'http://b/'
+>>> router.record('http://b/', 0.1, failed=True)
+>>> router.choose()
+'http://a/'
+"""
+
+import atexit
+import logging
+import threading
+import time
+
+from django_ogone import exceptions as ogone_exceptions
+from django_ogone import settings as ogone_settings
+from django_ogone import resilience as ogone_resilience
+
+log = logging.getLogger('django_ogone')
+
+
+class EndpointStats(object):
+    """ Exponentially weighted moving averages of the latency and error
+        rate of an endpoint. """
+
+    def __init__(self, url, alpha=0.2, error_penalty=10):
+        self.url = url
+        self.alpha = alpha
+        self.error_penalty = error_penalty
+
+        self.samples = 0
+        self.latency = 0.0
+        self.error_rate = 0.0
+
+    def record(self, seconds, failed=False):
+        if not self.samples:
+            self.latency = seconds
+            self.error_rate = failed and 1.0 or 0.0
+        else:
+            self.latency += self.alpha * (seconds - self.latency)
+            self.error_rate += self.alpha * ((failed and 1.0 or 0.0) -
+                                             self.error_rate)
+        self.samples += 1
+
+    def score(self):
+        """ Lower is better. Endpoints without samples go first. """
+
+        if not self.samples:
+            return 0.0
+        return self.latency * (1 + self.error_penalty * self.error_rate)
+
+
+def _is_failed(exception):
+    return ogone_resilience.is_failure(exception) or \
+        isinstance(exception, ogone_exceptions.ConnectException)
+
+
+def _can_fail_over(exception, idempotent):
+    if isinstance(exception, (ogone_exceptions.ConnectException,
+                              ogone_exceptions.CircuitOpenException)):
+        return True
+
+    return idempotent and ogone_resilience.is_failure(exception)
+
+
+class EndpointRouter(object):
+    """ Routes calls to the best of `urls`. """
+
+    def __init__(self, urls, alpha=0.2, error_penalty=10):
+        assert urls, 'No endpoints given'
+
+        self.urls = tuple(urls)
+        self.stats = dict([(url, EndpointStats(url, alpha, error_penalty))
+                           for url in self.urls])
+
+        self._lock = threading.Lock()
+        self._prober = None
+        self._stopped = threading.Event()
+
+    def record(self, url, seconds, failed=False):
+        with self._lock:
+            self.stats[url].record(seconds, failed)
+
+    def _is_open(self, url):
+        breaker = ogone_resilience.get_breaker(url)
+        return breaker is not None and breaker.state == ogone_resilience.OPEN
+
+    def choose(self, exclude=()):
+        """ Return the url with the best score, preferring endpoints whose
+            circuit breaker isn't open. """
+
+        candidates = [url for url in self.urls if url not in exclude]
+        if not candidates:
+            return None
+
+        with self._lock:
+            ranked = sorted(candidates,
+                            key=lambda url: (self._is_open(url),
+                                             self.stats[url].score()))
+
+        return ranked[0]
+
+    def call(self, func, idempotent=False):
+        """ Call `func` with the url of the best endpoint, failing over to
+            the next one when that is safe. `func` should make its
+            attempts on the url through :meth:`attempt`. """
+
+        tried = []
+        while True:
+            url = self.choose(exclude=tried)
+            tried.append(url)
+
+            try:
+                return func(url)
+            except Exception as e:
+                if len(tried) < len(self.urls) and \
+                        _can_fail_over(e, idempotent):
+                    log.warning('DirectLink call to %s failed (%r), trying '
+                                'another endpoint', url, e)
+                    continue
+                raise
+
+    def attempt(self, url, func):
+        """ Call `func`, recording how long it took and whether it failed
+            as a single attempt on `url`. """
+
+        started = time.time()
+        try:
+            result = func()
+        except Exception as e:
+            self.record(url, time.time() - started, _is_failed(e))
+            raise
+
+        self.record(url, time.time() - started)
+        return result
+
+    def probe(self, transport=None):
+        """ Post an empty request to every endpoint and record how it went.
+            Ogone answers those with an error in an ncresponse, which tells
+            us it is up. """
+
+        if transport is None:
+            from django_ogone import transport as ogone_transport
+            transport = ogone_transport.get_transport()
+
+        for url in self.urls:
+            started = time.time()
+            try:
+                transport.post(url, '', {
+                    'Content-type': 'application/x-www-form-urlencoded'})
+                failed = False
+            except Exception as e:
+                log.debug('Probing %s failed: %r', url, e)
+                failed = ogone_resilience.is_failure(e)
+            self.record(url, time.time() - started, failed)
+
+    def start_probing(self, interval, transport=None):
+        """ Probe the endpoints every `interval` seconds from a background
+            thread. """
+
+        assert self._prober is None, 'Already probing'
+
+        def run():
+            while not self._stopped.wait(interval):
+                try:
+                    self.probe(transport)
+                except Exception:
+                    log.exception('Probing DirectLink endpoints failed')
+
+        self._stopped.clear()
+        self._prober = threading.Thread(target=run)
+        self._prober.daemon = True
+        self._prober.start()
+
+    def stop_probing(self):
+        if self._prober is not None:
+            self._stopped.set()
+            self._prober.join()
+            self._prober = None
+
+    def get_stats(self):
+        """ The latency, error rate and score of every endpoint. """
+
+        with self._lock:
+            return dict([(url, {'latency': stats.latency,
+                                'error_rate': stats.error_rate,
+                                'samples': stats.samples,
+                                'score': stats.score()})
+                         for url, stats in self.stats.items()])
+
+
+_routers = {}
+_routers_lock = threading.Lock()
+
+
+def get_router(urls):
+    """ Return the shared router for the endpoints `urls`. """
+
+    urls = tuple(urls)
+    router = _routers.get(urls)
+    if router is None:
+        with _routers_lock:
+            router = _routers.get(urls)
+            if router is None:
+                router = _routers[urls] = EndpointRouter(urls)
+                interval = ogone_settings.DIRECT_LINK_PROBE_INTERVAL
+                if interval:
+                    router.start_probing(interval)
+                    # Before the interpreter pulls the module out from
+                    # under the thread
+                    atexit.register(router.stop_probing)
+
+    return router
@@ -2,6 +2,10 @@ import hashlib, logging
 
 log = logging.getLogger('django_ogone')
 
+from django_ogone import metrics as ogone_metrics
+
+HASH_METHODS = ('sha1', 'sha256', 'sha512')
+
 class OgoneSignature(object):
     '''
 
@@ -10,7 +14,7 @@ class OgoneSignature(object):
     - if no value is present the value is removed
     - parameters are sorted alphabetically
     - they limit the keys to a subsection of fields
-      (not implemented in this api)
+      (pass one of the tables from django_ogone.parameters)
     - the secret is used between every parameter set and added to the end of
       the string
 
@@ -59,14 +63,16 @@ class OgoneSignature(object):
 
     '''
 
-    def __init__(self, data, hash_method, secret, encoding='utf8'):
-        assert hash_method in ['sha1', 'sha256', 'sha512']
+    def __init__(self, data, hash_method, secret, encoding='utf8',
+                 parameters=None):
+        assert hash_method in HASH_METHODS
         assert str(secret)
 
         self.data = data.copy()
         self.hash_method = hash_method
         self.secret = secret
         self.encoding = encoding
+        self.parameters = parameters
 
     def _sort_data(self, data):
         # This code uppercases two times and is not well readable
@@ -81,6 +87,8 @@ class OgoneSignature(object):
             valid = False
         if k == 'SHASIGN':
             valid = False
+        if self.parameters is not None and k not in self.parameters:
+            valid = False
         return valid
 
     def _merge_data(self, data):
@@ -93,6 +101,7 @@ class OgoneSignature(object):
         signed = hashmethod(pre_sign_string).hexdigest().upper()
         return signed
 
+    @ogone_metrics.timed('signature')
     def signature(self):
         log.debug('Making signature for data: %s', self.data)
         
@@ -111,3 +120,89 @@ class OgoneSignature(object):
         return self.signature()
 
 
+class OgoneSigner(object):
+    '''
+
+    Signs data exactly like OgoneSignature, but looks up the hash method
+    once and builds the string to sign in a single pass.
+    Create one per hash method and secret and reuse it, or let
+    get_signer do that for you. Signing is timed as the ``signature``
+    metric, tagged with the `merchant` the signer was built for.
+
+    >>> signer = OgoneSigner('sha512', 'c')
+    >>> signer.sign(dict(d='a', a='b'))
+    'B499539D7E0B2B1FB5CCFE9FFDDBAD1EDF345757C094443ED795662F879FB250EEEB22CBB2D2F3C129E2CAE735044CDB7B08397502204B0683EA370F6D76FB6A'
+
+    >>> data = dict(acceptance=1234, amount=15, brand='VISA',
+    ...             cardno='xxxxxxxxxxxx1111', currency='EUR', NCERROR=0,
+    ...             orderId=12, payid=32100123, pm='CreditCard', status=9,
+    ...             SHASIGN='ignored', cn='')
+    >>> OgoneSigner('sha1', 'Mysecretsig1875!?').sign(data)
+    'B209960D5703DD1047F95A0F97655FFE5AC8BD52'
+
+    >>> get_signer('sha1', 'Mysecretsig1875!?') is get_signer('sha1', 'Mysecretsig1875!?')
+    True
+
+    With a parameter table, only the parameters Ogone signs are used
+
+    >>> from django_ogone.parameters import SHA_OUT
+    >>> data['utm_source'] = 'newsletter'
+    >>> OgoneSigner('sha1', 'Mysecretsig1875!?', parameters=SHA_OUT).sign(data)
+    'B209960D5703DD1047F95A0F97655FFE5AC8BD52'
+
+    '''
+
+    def __init__(self, hash_method, secret, encoding='utf8', parameters=None,
+                 merchant=None):
+        assert hash_method in HASH_METHODS
+        assert str(secret)
+
+        self.hash_method = hash_method
+        self.secret = secret
+        self.encoding = encoding
+        self.parameters = parameters
+        self.merchant = merchant
+
+        self._hash = getattr(hashlib, hash_method)
+
+    @ogone_metrics.timed('signature',
+                         tags=lambda args: {'merchant': args['self'].merchant})
+    def sign(self, data, normalized=False):
+        """ Sign `data`. Pass `normalized` if all its keys are upper case
+            already, which lets a parameter table skip a copy of it. """
+
+        if self.parameters is None:
+            pairs = [(key.upper(), value) for key, value in data.iteritems()
+                     if value != '' and value is not None]
+            pairs.sort()
+        elif normalized:
+            pairs = [pair for pair in self.parameters.select(data)
+                     if pair[1] != '' and pair[1] is not None]
+        else:
+            pairs = self.parameters.select(dict(
+                [(key.upper(), value) for key, value in data.iteritems()
+                 if value != '' and value is not None]))
+
+        secret = self.secret
+        pre_sign_string = secret.join(['%s=%s' % pair for pair in pairs
+                                       if pair[0] != 'SHASIGN']) + secret
+
+        return self._hash(pre_sign_string.encode(self.encoding)) \
+            .hexdigest().upper()
+
+
+_signers = {}
+
+
+def get_signer(hash_method, secret, encoding='utf8', parameters=None,
+               merchant=None):
+    """ Return a shared OgoneSigner for the given configuration. """
+
+    key = (hash_method, secret, encoding, parameters, merchant)
+    signer = _signers.get(key)
+    if signer is None:
+        signer = _signers.setdefault(key, OgoneSigner(hash_method, secret,
+                                                      encoding, parameters,
+                                                      merchant))
+
+    return signer
@@ -9,11 +9,21 @@ Change this in your ogone admin interface
 
 '''
 
-try:
-    from django.conf import settings
-except ImportError:
-    # We do not need Django to used this package
-    settings = {}
+import os
+import sys
+
+# We do not need Django to use this package. Only read its settings when
+# the process uses Django, so signing and verifying don't import it.
+settings = {}
+if 'django' in sys.modules or os.environ.get('DJANGO_SETTINGS_MODULE'):
+    try:
+        from django.conf import settings as django_settings
+    except ImportError:
+        pass
+    else:
+        if django_settings.configured or \
+                os.environ.get('DJANGO_SETTINGS_MODULE'):
+            settings = django_settings
 
 #These four you probably want to change
 PSPID = getattr(settings, 'OGONE_PSPID', None)
@@ -34,11 +44,112 @@ TEST_URL = getattr(settings, "OGONE_TEST_URL",
 PROD_URL = getattr(settings, "OGONE_PROD_URL",
     "https://secure.ogone.com/ncol/prod/orderstandard.asp")
 
+# Version of the SHA-IN/SHA-OUT parameter lists in django_ogone.parameters.
+# None signs every parameter.
+SHA_PARAMETERS_VERSION = getattr(settings, 'OGONE_SHA_PARAMETERS_VERSION', 1)
+
+# Additional merchants, see django_ogone.merchants
+MERCHANTS = getattr(settings, 'OGONE_MERCHANTS', {})
+MERCHANT_ROUTE_PARAM = getattr(settings, 'OGONE_MERCHANT_ROUTE_PARAM', 'PSPID')
+MERCHANT_ROUTES = getattr(settings, 'OGONE_MERCHANT_ROUTES', {})
+
+# Remembering postbacks we have handled, see django_ogone.dedup. The
+# backend is either 'local' (per process) or 'django' (the cache framework)
+POSTBACK_DEDUP_BACKEND = getattr(settings, 'OGONE_POSTBACK_DEDUP_BACKEND',
+    'local')
+POSTBACK_DEDUP_CACHE_ALIAS = getattr(settings,
+    'OGONE_POSTBACK_DEDUP_CACHE_ALIAS', 'default')
+POSTBACK_DEDUP_TTL = getattr(settings, 'OGONE_POSTBACK_DEDUP_TTL', 3600)
+POSTBACK_DEDUP_MAX_ENTRIES = getattr(settings,
+    'OGONE_POSTBACK_DEDUP_MAX_ENTRIES', 10000)
+
+# How ogone_update_order is sent, 'sync' or 'async'. See
+# django_ogone.dispatch for the other dispatch settings.
+DISPATCH_MODE = getattr(settings, 'OGONE_DISPATCH_MODE', 'sync')
+DISPATCH_WORKERS = getattr(settings, 'OGONE_DISPATCH_WORKERS', 4)
+DISPATCH_QUEUE_SIZE = getattr(settings, 'OGONE_DISPATCH_QUEUE_SIZE', 1000)
+DISPATCH_POLICY = getattr(settings, 'OGONE_DISPATCH_POLICY', 'block')
+DISPATCH_TIMEOUT = getattr(settings, 'OGONE_DISPATCH_TIMEOUT', 5)
+
+# Dotted path of the class receiving timings, see django_ogone.metrics.
+# None disables them.
+METRICS_EXPORTER = getattr(settings, 'OGONE_METRICS_EXPORTER', None)
+
 # DirectLink
 USERID = getattr(settings, 'OGONE_USERID', None)
 PSWD = getattr(settings, 'OGONE_PSWD', None)
 
+# Each of the DirectLink urls may also be a list of equivalent endpoints,
+# see django_ogone.router
 DIRECT_LINK_TEST_URL = getattr(settings, "OGONE_DIRECT_LINK_TEST_URL",
     "https://secure.ogone.com/ncol/test/maintenancedirect.asp")
 DIRECT_LINK_PROD_URL = getattr(settings, "OGONE_DIRECT_LINK_PROD_URL",
     "https://secure.ogone.com/ncol/prod/maintenancedirect.asp")
+DIRECT_LINK_QUERY_TEST_URL = getattr(settings,
+    "OGONE_DIRECT_LINK_QUERY_TEST_URL",
+    "https://secure.ogone.com/ncol/test/querydirect.asp")
+DIRECT_LINK_QUERY_PROD_URL = getattr(settings,
+    "OGONE_DIRECT_LINK_QUERY_PROD_URL",
+    "https://secure.ogone.com/ncol/prod/querydirect.asp")
+DIRECT_LINK_ORDER_TEST_URL = getattr(settings,
+    "OGONE_DIRECT_LINK_ORDER_TEST_URL",
+    "https://secure.ogone.com/ncol/test/orderdirect.asp")
+DIRECT_LINK_ORDER_PROD_URL = getattr(settings,
+    "OGONE_DIRECT_LINK_ORDER_PROD_URL",
+    "https://secure.ogone.com/ncol/prod/orderdirect.asp")
+
+# Seconds between health probes of lists of DirectLink endpoints, so ones
+# we avoid can show they recovered. None to only probe on demand
+DIRECT_LINK_PROBE_INTERVAL = getattr(settings,
+    'OGONE_DIRECT_LINK_PROBE_INTERVAL', 30)
+
+# Persistent connections kept per DirectLink endpoint, and the number of
+# seconds an idle connection may sit in the pool before it is discarded.
+DIRECT_LINK_POOL_SIZE = getattr(settings, 'OGONE_DIRECT_LINK_POOL_SIZE', 10)
+DIRECT_LINK_POOL_IDLE_TIMEOUT = getattr(settings,
+    'OGONE_DIRECT_LINK_POOL_IDLE_TIMEOUT', 30)
+
+# Seconds to wait for a connection to DirectLink, and for its response
+DIRECT_LINK_CONNECT_TIMEOUT = getattr(settings,
+    'OGONE_DIRECT_LINK_CONNECT_TIMEOUT', 5)
+DIRECT_LINK_READ_TIMEOUT = getattr(settings,
+    'OGONE_DIRECT_LINK_READ_TIMEOUT', 30)
+
+# Retries of failed DirectLink calls, see django_ogone.resilience. The
+# backoff is the base in seconds of the randomized exponential backoff.
+DIRECT_LINK_RETRIES = getattr(settings, 'OGONE_DIRECT_LINK_RETRIES', 2)
+DIRECT_LINK_RETRY_BACKOFF = getattr(settings,
+    'OGONE_DIRECT_LINK_RETRY_BACKOFF', 0.5)
+
+# Fail fast once this fraction of at least MIN_CALLS calls in the last
+# WINDOW seconds failed. Try again after RESET_TIMEOUT seconds.
+DIRECT_LINK_BREAKER_ENABLED = getattr(settings,
+    'OGONE_DIRECT_LINK_BREAKER_ENABLED', True)
+DIRECT_LINK_BREAKER_THRESHOLD = getattr(settings,
+    'OGONE_DIRECT_LINK_BREAKER_THRESHOLD', 0.5)
+DIRECT_LINK_BREAKER_MIN_CALLS = getattr(settings,
+    'OGONE_DIRECT_LINK_BREAKER_MIN_CALLS', 20)
+DIRECT_LINK_BREAKER_WINDOW = getattr(settings,
+    'OGONE_DIRECT_LINK_BREAKER_WINDOW', 60)
+DIRECT_LINK_BREAKER_RESET_TIMEOUT = getattr(settings,
+    'OGONE_DIRECT_LINK_BREAKER_RESET_TIMEOUT', 30)
+
+# Calls per second to DirectLink per PSPID (and operation), see
+# django_ogone.ratelimit. The backend is 'local', 'file' or the dotted
+# path of a class; calls waiting longer than TIMEOUT seconds fail.
+DIRECT_LINK_RATE_LIMITS = getattr(settings, 'OGONE_DIRECT_LINK_RATE_LIMITS',
+    {})
+DIRECT_LINK_RATE_LIMIT_BACKEND = getattr(settings,
+    'OGONE_DIRECT_LINK_RATE_LIMIT_BACKEND', 'file')
+DIRECT_LINK_RATE_LIMIT_DIRECTORY = getattr(settings,
+    'OGONE_DIRECT_LINK_RATE_LIMIT_DIRECTORY', None)
+DIRECT_LINK_RATE_LIMIT_TIMEOUT = getattr(settings,
+    'OGONE_DIRECT_LINK_RATE_LIMIT_TIMEOUT', 30)
+
+# Number of requests OgoneDirectLink.request_many runs concurrently
+DIRECT_LINK_WORKERS = getattr(settings, 'OGONE_DIRECT_LINK_WORKERS', 8)
+
+# Charges per second and charges in flight of a recurring billing run,
+# see django_ogone.billing
+BILLING_RATE = getattr(settings, 'OGONE_BILLING_RATE', 10)
+BILLING_WORKERS = getattr(settings, 'OGONE_BILLING_WORKERS', 4)
@@ -58,6 +58,8 @@ Statuses in 2 digits correspond either to 'intermediary' situations or to abnorm
     * 5, this means our system hasn’t sent the requested transaction to the acquirer since the merchant will send the transaction to the acquirer himself, like he specified in his configuration.
 """
 
+import collections
+
 STATUS_DESCRIPTIONS = {
     0  : 'Incomplete or invalid',
     1  : 'Cancelled by client',
@@ -110,10 +112,73 @@ EXCEPTION_STATUS = 'exception'
 CANCEL_CODES = (1,)
 CANCEL_STATUS = 'cancel'
 
+# Statuses on hold or being processed, Ogone will send an update later
+INTERMEDIATE_CODES = (41, 51, 61, 71, 81, 91, 97, 98, 99)
+
+# Statuses for which you have to contact the acquirer (or get the
+# authorisation manually) to find out what happened
+MANUAL_CODES = (52, 59, 62, 63, 72, 73, 82, 83, 92, 93)
+
+
+class StatusInfo(collections.namedtuple('StatusInfo',
+        'code description category final intermediate manual')):
+    """ Everything we know about a status code. category is None for
+        statuses which don't map to one of the categories above. """
+    __slots__ = ()
+
+
+def _build_table():
+    categories = {}
+    for codes, category in ((SUCCESS_CODES, SUCCESS_STATUS),
+                            (PENDING_CODES, PENDING_STATUS),
+                            (DECLINE_CODES, DECLINE_STATUS),
+                            (EXCEPTION_CODES, EXCEPTION_STATUS),
+                            (CANCEL_CODES, CANCEL_STATUS)):
+        for code in codes:
+            categories[code] = category
+
+    table = [None] * 100
+    for code, description in STATUS_DESCRIPTIONS.items():
+        intermediate = code in INTERMEDIATE_CODES
+        manual = code in MANUAL_CODES
+        # Pending orders (4, stored) get an update later as well
+        final = code != 0 and not intermediate and not manual and \
+            code not in PENDING_CODES
+
+        table[code] = StatusInfo(code, description, categories.get(code),
+                                 final, intermediate, manual)
+
+    return tuple(table)
+
+# Status code -> StatusInfo (or None for unknown codes)
+STATUS_TABLE = _build_table()
+
+
+def get_status_info(status):
+    """ Return the StatusInfo for `status`, or None if Ogone doesn't define
+        it.
+
+    >>> get_status_info(92)
+    StatusInfo(code=92, description='Payment uncertain', category='exception', final=False, intermediate=False, manual=True)
+    >>> get_status_info(4).final
+    False
+    >>> get_status_info(3) is None
+    True
+    """
+
+    if 0 <= status < 100:
+        return STATUS_TABLE[status]
+    return None
+
+
 def get_status_description(status):
     assert isinstance(status, int)
 
-    return STATUS_DESCRIPTIONS[status]
+    info = get_status_info(status)
+    if info is None:
+        raise KeyError(status)
+
+    return info.description
 
 def get_status_category(status_id):
     """ The Ogone API allows for four kind of results:
@@ -125,17 +190,48 @@ def get_status_category(status_id):
         In this function we do mapping from the status
         number into one of these categories of results.
     """
-    if status_id in SUCCESS_CODES:
-        status = SUCCESS_STATUS
-    elif status_id in PENDING_CODES:
-        status = PENDING_STATUS
-    elif status_id in DECLINE_CODES:
-        status = DECLINE_STATUS
-    elif status_id in EXCEPTION_CODES:
-        status = EXCEPTION_STATUS
-    elif status_id in CANCEL_CODES:
-        status = CANCEL_STATUS
-    else:
+    info = get_status_info(status_id)
+    if info is None or info.category is None:
         from django_ogone.exceptions import UnknownStatusException
         raise UnknownStatusException(status_id)
-    return status
+    return info.category
+
+# The order in which the statuses of a payment follow each other, by their
+# first digit: authorisations (5x) come before payments (9x), refunds (8x)
+# after them
+STATUS_PROGRESSION = (0, 1, 2, 4, 5, 6, 7, 9, 8)
+
+
+def _progress(status):
+    major = status >= 10 and status // 10 or status
+    if major not in STATUS_PROGRESSION:
+        return (-1, False)
+
+    info = get_status_info(status)
+    return (STATUS_PROGRESSION.index(major), bool(info and info.final))
+
+
+def is_newer_status(status, previous):
+    """ Whether `status` may follow `previous` for the same payment, rather
+        than being a stale update that arrived late. A final status beats
+        the intermediate ones of the same stage.
+
+    >>> is_newer_status(9, 5), is_newer_status(9, 91), is_newer_status(8, 9)
+    (True, True, True)
+    >>> is_newer_status(5, 9), is_newer_status(91, 9)
+    (False, False)
+    """
+
+    return _progress(status) >= _progress(previous)
+
+def classify_statuses(statuses):
+    """ Look up a whole sequence of status codes at once, for reports.
+        Unknown codes map to None.
+
+    >>> [info and info.category for info in classify_statuses([9, 5, 93, 6, 3])]
+    ['success', 'success', 'decline', None, None]
+    """
+
+    table = STATUS_TABLE
+    return [table[status] if 0 <= status < 100 else None
+            for status in statuses]
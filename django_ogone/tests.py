@@ -1,8 +1,38 @@
 import unittest
 import doctest
 import datetime
+import decimal
+import threading
+import time
+import urlparse
+import os
+import shutil
+import tempfile
+import socket
+import subprocess
+import sys
+import xml.dom.minidom
+
+from django_ogone import security, transport, pool, parsers, parameters, result
+from django_ogone import status_codes, exceptions, rendering, merchants
+from django_ogone import dedup, signals, dispatch, testserver, loadgen
+from django_ogone import metrics, reconcile, importer, resilience, router
+from django_ogone import billing, ratelimit
+from django_ogone import settings as ogone_settings
+from django_ogone import Ogone, OgoneDirectLink
+
+NCRESPONSE = '<?xml version="1.0"?><ncresponse orderID="13" PAYID="8285812" PAYIDSUB="1" NCSTATUS="0" NCERROR="0" NCERRORPLUS="!" ACCEPTANCE="test123" STATUS="91" amount="67.94" currency="EUR"></ncresponse>'
+
+
+class Settings(object):
+    SHA_PRE_SECRET = 'test1234'
+    SHA_POST_SECRET = 'test12345'
+    HASH_METHOD = 'sha512'
+    PRODUCTION = False
+    PSPID = 'mycutePS'
+    USERID = 'api'
+    PSWD = 'secret'
 
-from django_ogone import security, Ogone
 
 class OgoneTestCase(unittest.TestCase):
     def setUp(self):
@@ -37,6 +67,20 @@ class OgoneTestCase(unittest.TestCase):
         o = self.ogone(params, settings=self.settings)
         self.assertFalse(o.is_valid())
 
+    def testUnsignedParametersAreIgnored(self):
+        params = {u'ORDERID': u'13', u'STATUS': u'9', u'CARDNO': u'XXXXXXXXXXXX1111', u'VC': u'NO', u'PAYID': u'8285812', u'CN': u'Kaast Achternaam', u'NCERROR': u'0', u'IP': u'82.139.114.10', u'IPCTY': u'NL', u'CURRENCY': u'EUR', u'CCCTY': u'US', u'AAVCHECK': u'NO', u'BRAND': u'VISA', u'ACCEPTANCE': u'test123', u'ECI': u'7', u'TRXDATE': u'09/24/10', u'AMOUNT': u'6794.81', u'CVCCHECK': u'NO', u'ED': u'0111', u'PM': u'CreditCard'}
+        params['SHASIGN'] = security.OgoneSignature(params,
+                                self.settings.HASH_METHOD,
+                                self.settings.SHA_POST_SECRET).signature()
+        params['utm_source'] = u'newsletter'
+
+        o = self.ogone(params, settings=self.settings)
+        self.assert_(o.is_valid())
+
+        self.settings.SHA_PARAMETERS_VERSION = None
+        o = self.ogone(params, settings=self.settings)
+        self.assertFalse(o.is_valid())
+
     def testParseParams(self):
         params = {u'ORDERID': u'13', u'STATUS': u'9', u'CARDNO': u'XXXXXXXXXXXX1111', u'VC': u'NO', u'PAYID': u'8285812', u'CN': u'Kaast Achternaam', u'NCERROR': u'0', u'IP': u'82.139.114.10', u'IPCTY': u'NL', u'CURRENCY': u'EUR', u'CCCTY': u'US', u'AAVCHECK': u'NO', u'BRAND': u'VISA', u'ACCEPTANCE': u'test123', u'ECI': u'7', u'TRXDATE': u'09/24/10', u'AMOUNT': u'6794.81', u'CVCCHECK': u'NO', u'ED': u'0111', u'PM': u'CreditCard'}
         params['SHASIGN'] = security.OgoneSignature(params,
@@ -51,6 +95,20 @@ class OgoneTestCase(unittest.TestCase):
         self.assertEqual(o.get_status_description(), 'Payment requested')
         self.assertEqual(o.get_transaction_date(), datetime.date(2010, 9, 24))
         self.assertEqual(o.get_expiry_date(), datetime.date(2011, 1, 1))
+        self.assertEqual(o.get_amount(), decimal.Decimal('6794.81'))
+        self.assertEqual(o.parse_params()['ORDERID'], 13)
+
+        expected = dict(params, ORDERID=13, STATUS=9,
+                        TRXDATE=datetime.date(2010, 9, 24),
+                        ED=datetime.date(2011, 1, 1))
+        result = o.parse_params()
+        self.assertEqual(result, expected)
+        self.assertEqual(expected, result)
+        self.assertEqual(dict(result.iteritems()), expected)
+        self.assert_(datetime.date(2011, 1, 1) in result.values())
+        copied = result.copy()
+        copied.update({'ORDERID': 14})
+        self.assertEqual(result['ORDERID'], 13)
 
     def testForm(self):
         data = {'orderID': 14, 'ownerstate': u'', 'cn': u'Kaast Achternaam', 'language': 'en_US', 'ownertown': u'Klaas', 'ownercty': u'NL', 'exceptionurl': u'http://127.0.0.1:8000/shop/checkout/ogone/failure/', 'ownerzip': u'Postcode', 'catalogurl': u'http://127.0.0.1:8000/shop/category/', 'currency': u'EUR', 'amount': u'579', 'declineurl': u'http://127.0.0.1:8000/shop/checkout/ogone/failure/', 'homeurl': u'http://127.0.0.1:8000/shop/', 'cancelurl': u'http://127.0.0.1:8000/shop/checkout/ogone/failure/', 'accepturl': u'http://127.0.0.1:8000/shop/checkout/ogone/success/', 'owneraddress': u'Straat', 'com': u'Order #14: Kaast Achternaam', 'email': u'mathijs@mathijsfietst.nl'}
@@ -62,8 +120,1206 @@ class OgoneTestCase(unittest.TestCase):
 
         self.assertEqual(form['SHASign'].field.initial, shasign)
 
+    def testSigner(self):
+        params = {u'orderID': u'44', u'CN': u'S\xe9bastien Fievet', u'STATUS': u'5', u'PAYID': u'8580040', u'AMOUNT': u'10', u'COM': u'', u'SHASIGN': u'X'}
+        for encoding in ('utf8', 'latin1'):
+            for hash_method in security.HASH_METHODS:
+                signer = security.get_signer(hash_method,
+                    self.settings.SHA_POST_SECRET, encoding)
+                signature = security.OgoneSignature(params, hash_method,
+                    self.settings.SHA_POST_SECRET, encoding).signature()
+                self.assertEqual(signer.sign(params), signature)
+
+    def testVerifyMany(self):
+        rows = []
+        for order_id in range(1, 8):
+            params = {'orderID': str(order_id), 'STATUS': '9', 'PAYID': '8285812', 'TRXDATE': '09/24/10', 'ED': '0111', 'AMOUNT': '10'}
+            params['SHASIGN'] = security.OgoneSignature(params,
+                                    self.settings.HASH_METHOD,
+                                    self.settings.SHA_POST_SECRET).signature()
+            rows.append(params)
+        rows[2]['STATUS'] = '5'
+        del rows[4]['SHASIGN']
+
+        for processes in (None, 2):
+            results = list(self.ogone.verify_many(iter(rows),
+                settings=self.settings, chunk_size=2, processes=processes))
+
+            self.assertEqual([index for index, valid, parsed in results],
+                             range(7))
+            self.assertEqual([valid for index, valid, parsed in results],
+                             [True, True, False, True, False, True, True])
+            self.assertEqual(results[1][2]['ORDERID'], 2)
+            self.assertEqual(results[1][2]['TRXDATE'],
+                             datetime.date(2010, 9, 24))
+            self.assertEqual(results[2][2], None)
+
+    def testFormHtml(self):
+        data = {'orderID': 14, 'cn': u'Kaast Achternaam', 'language': 'en_US', 'currency': u'EUR', 'amount': u'579', 'com': u'Order #14: "Kaast" & <co>'}
+        form = self.ogone.get_form(data.copy(), settings=self.settings)
+        html = self.ogone.get_form_html(data.copy(), settings=self.settings)
+
+        for name, field in form.fields.items():
+            self.assert_(u'name="%s" value="%s"' % (name,
+                         rendering.escape(field.initial)) in html)
+        self.assert_(u'&quot;Kaast&quot; &amp; &lt;co&gt;' in html)
+
+        post_data = self.ogone.get_post_data(data.copy(),
+                                             settings=self.settings)
+        self.assertEqual(post_data['SHASign'], form['SHASign'].field.initial)
+        self.assertEqual(post_data['orderID'], u'14')
+
+    def testImportsNoDjango(self):
+        script = '\n'.join([
+            'import sys',
+            'from django_ogone import Ogone, security',
+            'params = {"ORDERID": "13", "STATUS": "9", "AMOUNT": "67.94"}',
+            'params["SHASIGN"] = security.OgoneSignature(params, "sha512",',
+            '                                            "out").signature()',
+            'ogone = Ogone(params, settings=type("Settings", (), {',
+            '    "HASH_METHOD": "sha512", "SHA_POST_SECRET": "out"}))',
+            'print(ogone.is_valid(), ogone.get_amount(),',
+            '      "django" in sys.modules)',
+        ])
+        env = dict(os.environ)
+        env.pop('DJANGO_SETTINGS_MODULE', None)
+
+        output = subprocess.Popen([sys.executable, '-c', script],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            env=env, stdout=subprocess.PIPE).communicate()[0]
+        self.assertEqual(output.strip(), "(True, Decimal('67.94'), False)")
+
+    def testRedirectUrl(self):
+        data = {'orderID': 14, 'cn': u'S\xe9bastien Fievet', 'language': 'en_US', 'currency': u'EUR', 'amount': u'579'}
+        original = data.copy()
+        self.settings.TEST_URL = 'https://secure.ogone.com/ncol/test/orderstandard.asp'
+        self.settings.PROD_URL = 'https://secure.ogone.com/ncol/prod/orderstandard.asp'
+
+        for encoding in ('utf8', 'latin1'):
+            url = self.ogone.get_redirect_url(data, settings=self.settings,
+                                              encoding=encoding)
+            action, query = url.split('?')
+            self.assertEqual(action, self.ogone.get_action(
+                settings=self.settings))
+
+            params = dict([(key, value.decode(encoding)) for key, value in
+                           urlparse.parse_qsl(query)])
+            self.assertEqual(params['cn'], data['cn'])
+            self.assertEqual(params['SHASign'], self.ogone.sign(params,
+                settings=self.settings, encoding=encoding))
+
+        self.assert_('cn=S%E9bastien+Fievet' in url)
+        self.assertEqual(data, original)
+
+        post_data = self.ogone.get_post_data(data.copy(),
+                                             settings=self.settings)
+        url = self.ogone.get_redirect_url(data, settings=self.settings,
+                                          action='https://example.com/?a=1')
+        self.assert_(url.startswith('https://example.com/?a=1&'))
+        self.assert_('SHASign=%s' % post_data['SHASign'] in url)
+
+    def testMerchants(self):
+        registry = merchants.MerchantRegistry([
+            merchants.Merchant('shopNL', defaults=self.settings,
+                SHA_PRE_SECRET='nl-in', SHA_POST_SECRET='nl-out'),
+            merchants.Merchant('shopBE', defaults=self.settings,
+                SHA_PRE_SECRET='be-in', SHA_POST_SECRET='be-out',
+                HASH_METHOD='sha1', USERID='api', PSWD='secret'),
+        ], route_param='COMPLUS', routes={'be': 'shopBE'})
+
+        params = {'orderID': '13', 'STATUS': '9', 'PAYID': '8285812', 'complus': 'be'}
+        params['SHASIGN'] = security.OgoneSignature(params, 'sha1',
+                                                    'be-out').signature()
+        ogone = registry.ogone(params)
+        self.assertEqual(ogone.settings.PSPID, 'shopBE')
+        self.assert_(ogone.is_valid())
+
+        params['COMPLUS'] = 'shopNL'
+        self.assertEqual(registry.for_params(params).PSPID, 'shopNL')
+        params['COMPLUS'] = 'shopFR'
+        self.assertRaises(exceptions.UnknownMerchantException,
+                          registry.for_params, params)
+
+        merchant = registry.get('shopBE')
+        self.assert_(self.ogone.get_signer(settings=merchant) is
+                     merchant.SHA_IN_SIGNER)
+        data = OgoneDirectLink.get_data({'PAYID': '1', 'amount': 10},
+                                        settings=merchant)
+        self.assertEqual(data['USERID'], 'api')
+        self.assertEqual(data['SHASign'], security.OgoneSignature(data,
+                         'sha1', 'be-in').signature())
+
+    def testDeduplicator(self):
+        params = {u'ORDERID': u'13', u'STATUS': u'9', u'PAYID': u'8285812', u'AMOUNT': u'6794.81'}
+        params['SHASIGN'] = security.OgoneSignature(params,
+                                self.settings.HASH_METHOD,
+                                self.settings.SHA_POST_SECRET).signature()
+
+        received = []
+        def receiver(sender, ogone, **kwargs):
+            received.append(ogone)
+        signals.ogone_update_order.connect(receiver)
+
+        deduplicator = dedup.PostbackDeduplicator()
+        try:
+            for i in range(3):
+                ogone = self.ogone(params, settings=self.settings)
+                self.assert_(deduplicator.process(ogone))
+            for forged in (dict(params, STATUS=u'5'),
+                           dict(params, AMOUNT=u'1.00'),
+                           dict(params, ORDERID=u'14')):
+                self.assertFalse(deduplicator.process(
+                    self.ogone(forged, settings=self.settings)))
+        finally:
+            signals.ogone_update_order.disconnect(receiver)
+
+        self.assertEqual(len(received), 1)
+        self.assertEqual(deduplicator.stats(), {'hits': 2, 'misses': 4})
+
+    def testDeduplicatorRetriesFailedDispatches(self):
+        params = {u'ORDERID': u'13', u'STATUS': u'9', u'PAYID': u'8285812'}
+        params['SHASIGN'] = security.OgoneSignature(params,
+                                self.settings.HASH_METHOD,
+                                self.settings.SHA_POST_SECRET).signature()
+
+        received = []
+        def receiver(sender, ogone, **kwargs):
+            received.append(ogone)
+            if len(received) == 1:
+                raise ValueError('Database down')
+        signals.ogone_update_order.connect(receiver)
+
+        deduplicator = dedup.PostbackDeduplicator()
+        try:
+            self.assertRaises(ValueError, deduplicator.process,
+                              self.ogone(params, settings=self.settings))
+            # Ogone retries the postback we didn't acknowledge
+            for i in range(2):
+                self.assert_(deduplicator.process(
+                    self.ogone(params, settings=self.settings)))
+        finally:
+            signals.ogone_update_order.disconnect(receiver)
+
+        self.assertEqual(len(received), 2)
+
+    def testDeduplicatorRetriesFailedAsyncDispatches(self):
+        params = {u'ORDERID': u'13', u'STATUS': u'9', u'PAYID': u'8285812'}
+        params['SHASIGN'] = security.OgoneSignature(params,
+                                self.settings.HASH_METHOD,
+                                self.settings.SHA_POST_SECRET).signature()
+
+        received = []
+        def receiver(sender, ogone, **kwargs):
+            received.append(ogone)
+            if len(received) == 1:
+                raise ValueError('Database down')
+        signals.ogone_update_order.connect(receiver)
+
+        deduplicator = dedup.PostbackDeduplicator()
+        mode = ogone_settings.DISPATCH_MODE
+        ogone_settings.DISPATCH_MODE = 'async'
+        try:
+            for i in range(3):
+                dispatch._dispatcher = dispatch.AsyncDispatcher(workers=1)
+                self.assert_(deduplicator.process(
+                    self.ogone(params, settings=self.settings)))
+                # Waits for the worker to send the update
+                dispatch._dispatcher.shutdown()
+        finally:
+            ogone_settings.DISPATCH_MODE = mode
+            dispatch._dispatcher = None
+            signals.ogone_update_order.disconnect(receiver)
+
+        # The failed update is forgotten, the retried one is not
+        self.assertEqual(len(received), 2)
+
+    def testAsyncDispatcher(self):
+        received = []
+        def receiver(sender, ogone, **kwargs):
+            received.append((ogone.params['ORDERID'], ogone.params['STATUS']))
+        signals.ogone_update_order.connect(receiver)
+
+        dispatcher = dispatch.AsyncDispatcher(workers=3, maxsize=6)
+        try:
+            for status in range(10):
+                for order_id in ('1', '2', '3', '4'):
+                    params = {'ORDERID': order_id, 'STATUS': str(status)}
+                    self.assert_(dispatcher.dispatch(
+                        self.ogone(params, settings=self.settings)))
+            dispatcher.shutdown()
+        finally:
+            signals.ogone_update_order.disconnect(receiver)
+
+        self.assertEqual(len(received), 40)
+        for order_id in ('1', '2', '3', '4'):
+            self.assertEqual([s for o, s in received if o == order_id],
+                             [str(status) for status in range(10)])
+
+        self.assertRaises(exceptions.DispatcherShutdownException,
+                          dispatcher.dispatch,
+                          self.ogone({'ORDERID': '1'}, settings=self.settings))
+
+    def testAsyncDispatcherDropsWhenFull(self):
+        blocked = threading.Event()
+        def receiver(sender, ogone, **kwargs):
+            blocked.wait(5)
+        signals.ogone_update_order.connect(receiver)
+
+        dispatcher = dispatch.AsyncDispatcher(workers=1, maxsize=1,
+                                              policy='drop')
+        try:
+            results = [dispatcher.dispatch(self.ogone({'ORDERID': '1'},
+                       settings=self.settings)) for i in range(5)]
+            self.assert_(False in results)
+        finally:
+            blocked.set()
+            dispatcher.shutdown()
+            signals.ogone_update_order.disconnect(receiver)
+
+    def testAsyncDispatcherShutdownWaitsForPuts(self):
+        received = []
+        blocked = threading.Event()
+        def receiver(sender, ogone, **kwargs):
+            blocked.wait(5)
+            received.append(ogone)
+        signals.ogone_update_order.connect(receiver)
+
+        dispatcher = dispatch.AsyncDispatcher(workers=1, maxsize=1)
+        try:
+            for i in range(2):
+                dispatcher.dispatch(self.ogone({'ORDERID': '1'},
+                                               settings=self.settings))
+            # Blocks on the full queue until the receiver is released
+            putter = threading.Thread(target=dispatcher.dispatch, args=(
+                self.ogone({'ORDERID': '1'}, settings=self.settings),))
+            putter.start()
+            while not dispatcher._putting:
+                time.sleep(0.01)
+
+            stopper = threading.Thread(target=dispatcher.shutdown)
+            stopper.start()
+            blocked.set()
+            putter.join()
+            stopper.join()
+        finally:
+            blocked.set()
+            signals.ogone_update_order.disconnect(receiver)
+
+        self.assertEqual(len(received), 3)
+
+    def testStatusCodes(self):
+        for code, description in status_codes.STATUS_DESCRIPTIONS.items():
+            self.assertEqual(status_codes.get_status_description(code),
+                             description)
+        self.assertEqual(status_codes.get_status_category(91), 'pending')
+        self.assertRaises(KeyError, status_codes.get_status_description, 3)
+        self.assertRaises(KeyError, status_codes.get_status_description, -1)
+        self.assertRaises(exceptions.UnknownStatusException,
+                          status_codes.get_status_category, 6)
+        self.assertRaises(exceptions.UnknownStatusException,
+                          status_codes.get_status_category, 100)
+
+class OgoneDirectLinkTestCase(unittest.TestCase):
+    def setUp(self):
+        self.settings = Settings()
+
+        self.server = testserver.DirectLinkServer().start()
+        self.url = self.server.get_url()
+
+    def tearDown(self):
+        self.server.close()
+
+    def get_payload(self):
+        return {'PAYID': '8285812', 'amount': '6794', 'OPERATION': 'SAS'}
+
+    def testRequest(self):
+        result = OgoneDirectLink.request(self.url, self.get_payload(),
+            settings=self.settings, transport=transport.UrllibTransport())
+
+        self.assertEqual(result['PAYID'], '8285812')
+        self.assertEqual(result['STATUS'], '91')
+
+        # The server forgets connections once they are closed
+        for i in range(100):
+            if not self.server.threads:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.server.threads, [])
+        self.assertEqual(self.server.sockets, [])
+
+    def testPooledTransportReusesConnections(self):
+        pooled = transport.PooledTransport(pool_size=2)
+        for i in range(5):
+            result = OgoneDirectLink.request(self.url, self.get_payload(),
+                settings=self.settings, transport=pooled)
+            self.assertEqual(result['STATUS'], '91')
+        pooled.close()
+
+        self.assertEqual(self.server.connections, 1)
+
+    def testPooledTransportNoticesDroppedConnections(self):
+        pooled = transport.PooledTransport(pool_size=2)
+        OgoneDirectLink.request(self.url, self.get_payload(),
+            settings=self.settings, transport=pooled)
+
+        # The server hangs up on the idle connection
+        for request in list(self.server.sockets):
+            request.shutdown(socket.SHUT_RDWR)
+        time.sleep(0.05)
+
+        result = OgoneDirectLink.request(self.url, self.get_payload(),
+            settings=self.settings, transport=pooled)
+        pooled.close()
+
+        self.assertEqual(result['STATUS'], '91')
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(self.server.requests, 2)
+
+    def testThreeDSecureOrder(self):
+        self.server.aliases['ALIAS3DS'] = testserver.IDENTIFICATION_STATUS
+        url = self.server.get_url(testserver.ORDER_PATH)
+
+        pooled = transport.PooledTransport(pool_size=2)
+        for order_id in ('13', '14'):
+            result = OgoneDirectLink.order(url, {'orderID': order_id,
+                'ALIAS': 'ALIAS3DS', 'amount': 995, 'currency': 'EUR'},
+                settings=self.settings, transport=pooled)
+            self.assertEqual(result['STATUS'], '46')
+            self.assertEqual(result['HTML_ANSWER'], testserver.HTML_ANSWER)
+        pooled.close()
+
+        # The response was read in chunks, and all of it
+        self.assert_(len(testserver.HTML_ANSWER) > transport.CHUNK_SIZE)
+        self.assertEqual(self.server.connections, 1)
+
+    def testPooledTransportEvictsIdleConnections(self):
+        pooled = transport.PooledTransport(pool_size=2, idle_timeout=-1)
+        for i in range(3):
+            OgoneDirectLink.request(self.url, self.get_payload(),
+                settings=self.settings, transport=pooled)
+        pooled.close()
+
+        self.assertEqual(self.server.connections, 3)
+
+    def testRequestMany(self):
+        payloads = [self.get_payload() for i in range(20)]
+        payloads[5] = {'PAYID': '8285812', 'OPERATION': 'SAS'}
+
+        pooled = transport.PooledTransport(pool_size=4)
+        results = list(OgoneDirectLink.request_many(self.url, iter(payloads),
+            settings=self.settings, transport=pooled, workers=4))
+        pooled.close()
+
+        self.assertEqual(len(results), 20)
+        errors = [r for p, r in results if isinstance(r, Exception)]
+        self.assertEqual(len(errors), 1)
+        self.assert_(isinstance(errors[0], AssertionError))
+        for payload, result in results:
+            if not isinstance(result, Exception):
+                self.assertEqual(result['STATUS'], '91')
+
+    def testInjectedErrors(self):
+        server = testserver.DirectLinkServer(error_rate=1).start()
+        try:
+            try:
+                OgoneDirectLink.request(server.get_url(), self.get_payload(),
+                    settings=self.settings,
+                    transport=transport.UrllibTransport())
+            except exceptions.TransportException as e:
+                self.assertEqual(e.status, 500)
+            else:
+                self.fail('No TransportException raised')
+
+            server.error_status = None
+            result = OgoneDirectLink.request(server.get_url(),
+                self.get_payload(), settings=self.settings,
+                transport=transport.UrllibTransport())
+            self.assertEqual(result['NCERROR'], testserver.INJECTED_NCERROR)
+            self.assertEqual(result['STATUS'], '0')
+            self.assertEqual(server.errors, 2)
+        finally:
+            server.close()
+
+    def testMetrics(self):
+        exporter = metrics.enable()
+        try:
+            pooled = transport.PooledTransport()
+            for i in range(3):
+                OgoneDirectLink.request(self.url, self.get_payload(),
+                    settings=self.settings, transport=pooled)
+            pooled.close()
+
+            params = {'ORDERID': '13', 'STATUS': '9', 'SHASIGN': 'invalid'}
+            ogone = Ogone(params, settings=self.settings)
+            self.assertRaises(exceptions.InvalidSignatureException,
+                              ogone.parse_params)
+            self.assertFalse(Ogone(params, settings=self.settings).is_valid())
+
+            security.OgoneSignature(params, 'sha1', 'secret').signature()
+        finally:
+            metrics.disable()
+
+        histogram = exporter.get_histogram('directlink.request',
+            merchant='mycutePS', operation='SAS')
+        self.assertEqual(histogram.count, 3)
+        endpoint = '127.0.0.1'
+        self.assertEqual(exporter.get_histogram('directlink.connect',
+                         endpoint=endpoint).count, 1)
+        for phase in ('send', 'wait'):
+            self.assertEqual(exporter.get_histogram('directlink.' + phase,
+                             endpoint=endpoint).count, 3)
+
+        self.assertEqual(exporter.get_histogram('is_valid',
+                         merchant='mycutePS').count, 2)
+        self.assertEqual(exporter.get_counter('parse_params.errors',
+                         merchant='mycutePS'), 1)
+        # Three DirectLink requests signed, two postbacks verified
+        self.assertEqual(exporter.get_histogram('signature',
+                         merchant='mycutePS').count, 5)
+        self.assertEqual(exporter.get_histogram('signature').count, 1)
+
+        # Nothing is recorded once disabled
+        Ogone(params, settings=self.settings).is_valid()
+        self.assertEqual(exporter.get_histogram('is_valid',
+                         merchant='mycutePS').count, 2)
+        self.assertEqual(exporter.get_histogram('signature',
+                         merchant='mycutePS').count, 5)
+
+    def testParseResponse(self):
+        doc = xml.dom.minidom.parseString(NCRESPONSE)
+        attrs = doc.documentElement.attributes
+        expected = dict([(attrs.item(i).name, attrs.item(i).value) \
+                         for i in range(attrs.length)])
+
+        self.assertEqual(parsers.parse_ncresponse(NCRESPONSE), expected)
+        chunks = [NCRESPONSE[i:i + 7] for i in range(0, len(NCRESPONSE), 7)]
+        self.assertEqual(parsers.parse_ncresponse(chunks), expected)
+
+    def testRequestAsync(self):
+        pooled = transport.PooledTransport()
+        expected = OgoneDirectLink.request(self.url, self.get_payload(),
+            settings=self.settings, transport=pooled)
+        future = OgoneDirectLink.request_async(self.url, self.get_payload(),
+            settings=self.settings, transport=pooled)
+        self.assertEqual(future.result(timeout=5), expected)
+
+        payloads = [self.get_payload() for i in range(6)]
+        payloads[3] = {'PAYID': '8285812', 'OPERATION': 'SAS'}
+        results = OgoneDirectLink.gather(self.url, payloads,
+            settings=self.settings, transport=pooled, limit=2,
+            return_exceptions=True)
+        pooled.close()
+
+        self.assertEqual(len(results), 6)
+        self.assert_(isinstance(results[3], AssertionError))
+        self.assertEqual(results[0], expected)
+
+class ReconcileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.settings = Settings()
+        self.server = testserver.DirectLinkServer(
+            statuses={'3': 8, '5': 2, '6': 3, '7': None, '11': 91}).start()
+        self.transport = transport.PooledTransport()
+
+        self.directory = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.directory, 'checkpoint.json')
+
+        self.orders = [(i, '9') for i in range(1, 13)]
+        self.applied = []
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.close()
+        shutil.rmtree(self.directory)
+
+    def get_reconciler(self, apply=None):
+        return reconcile.Reconciler(apply or self.applied.extend,
+            url=self.server.get_url(testserver.QUERY_PATH),
+            settings=self.settings, transport=self.transport, workers=3,
+            batch_size=4, checkpoint=self.checkpoint)
+
+    def testQuery(self):
+        result = OgoneDirectLink.query(
+            self.server.get_url(testserver.QUERY_PATH), {'orderID': '3'},
+            settings=self.settings, transport=self.transport)
+        self.assertEqual(result['STATUS'], '8')
+        self.assertEqual(OgoneDirectLink.get_query_action(settings=self.settings),
+                         'https://secure.ogone.com/ncol/test/querydirect.asp')
+
+    def testReconcile(self):
+        report = self.get_reconciler().run(self.orders)
+
+        self.assertEqual(report['checked'], 12)
+        self.assertEqual(report['unchanged'], 7)
+        self.assertEqual(report['missing'], 1)
+        self.assertEqual(report['changed'], 3 + 1)
+        self.assertEqual(report['applied'], 3)
+        self.assertEqual(report['categories'],
+                         {'other': 1, 'decline': 1, 'unknown': 1,
+                          'pending': 1})
+        self.assertEqual(sorted(self.applied), [(3, '9', 8), (5, '9', 2),
+                                                (11, '9', 91)])
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def testResume(self):
+        def interrupt(changes):
+            if changes[0].order_id > 4:
+                raise KeyboardInterrupt()
+            self.applied.extend(changes)
+
+        self.assertRaises(KeyboardInterrupt,
+                          self.get_reconciler(interrupt).run, self.orders)
+        self.assertEqual(self.applied, [(3, '9', 8)])
+
+        reconciler = self.get_reconciler()
+        self.assertEqual(reconciler.resume_after, 4)
+        self.assertEqual(reconciler.report['checked'], 4)
+
+        orders = [order for order in self.orders if order[0] > 4]
+        report = reconciler.run(orders)
+        self.assertEqual(report['checked'], 12)
+        self.assertEqual(report['applied'], 3)
+        self.assertEqual(sorted(self.applied), [(3, '9', 8), (5, '9', 2),
+                                                (11, '9', 91)])
+
+    def testFailedQueriesAreRetried(self):
+        def fail_from_now_on(changes):
+            # Ogone turns every query down with NCERROR 50001111
+            self.server.error_rate = 1
+            self.server.error_status = None
+            self.applied.extend(changes)
+
+        self.orders[1] = (2, 'paid')
+        report = self.get_reconciler(fail_from_now_on).run(self.orders)
+        self.assertEqual(report['checked'], 12)
+        self.assertEqual(report['failed'], 8)
+        self.assertEqual(report['missing'], 0)
+        self.assertEqual(sorted(self.applied), [(2, 'paid', 9), (3, '9', 8)])
+
+        # The run went on, and the failed orders are retried
+        self.server.error_rate = 0
+        reconciler = self.get_reconciler()
+        self.assertEqual(reconciler.resume_after, 12)
+        self.assertEqual(sorted(reconciler.retry),
+                         [order for order in self.orders if order[0] > 4])
+        report = reconciler.run([])
+        self.assertEqual(report['checked'], 12)
+        self.assertEqual(report['failed'], 0)
+        self.assertEqual(report['missing'], 1)
+        self.assertEqual(len(self.applied), 4)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def testDryRunLeavesCheckpointAlone(self):
+        reconcile.Checkpoint(self.checkpoint).save(4, dict(
+            reconcile.Reconciler._new_report(), checked=4), [(2, '9')])
+
+        reconciler = reconcile.Reconciler(
+            url=self.server.get_url(testserver.QUERY_PATH),
+            settings=self.settings, transport=self.transport, workers=3,
+            batch_size=4, checkpoint=self.checkpoint, dry_run=True)
+        report = reconciler.run(
+            [order for order in self.orders if order[0] > 4])
+        self.assertEqual(report['checked'], 12)
+        self.assertEqual(report['changed'], 3)
+
+        self.assertEqual(reconcile.Checkpoint(self.checkpoint).load(),
+                         (4, dict(reconcile.Reconciler._new_report(),
+                                  checked=4), [(2, '9')]))
+
+
+class ResilienceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.policy = resilience.RetryPolicy(retries=2, backoff=0.001)
+        self.calls = 0
+
+    def fail_with(self, exception_class, times=None, status=None):
+        def func():
+            self.calls += 1
+            if times is None or self.calls <= times:
+                raise exception_class('Failed', status=status)
+            return 'ok'
+        return func
+
+    def testRetries(self):
+        func = self.fail_with(exceptions.TransportException, times=2)
+        self.assertEqual(resilience.call(func, self.policy, idempotent=True),
+                         'ok')
+        self.assertEqual(self.calls, 3)
+
+        # Requests Ogone may have received are not sent twice
+        self.calls = 0
+        func = self.fail_with(exceptions.TimeoutException, times=1)
+        self.assertRaises(exceptions.TimeoutException, resilience.call, func,
+                          self.policy)
+        self.assertEqual(self.calls, 1)
+
+        # Unless they never made it
+        self.calls = 0
+        func = self.fail_with(exceptions.ConnectException, times=2)
+        self.assertEqual(resilience.call(func, self.policy), 'ok')
+
+        # Our own mistakes aren't retried
+        self.calls = 0
+        func = self.fail_with(exceptions.TransportException, status=404)
+        self.assertRaises(exceptions.TransportException, resilience.call,
+                          func, self.policy, idempotent=True)
+        self.assertEqual(self.calls, 1)
+
+        # And we give up eventually
+        self.calls = 0
+        func = self.fail_with(exceptions.TransportException, status=503)
+        self.assertRaises(exceptions.TransportException, resilience.call,
+                          func, self.policy, idempotent=True)
+        self.assertEqual(self.calls, 3)
+
+    def testCircuitBreaker(self):
+        breaker = resilience.CircuitBreaker(failure_threshold=0.5,
+                                            min_calls=4, reset_timeout=0.05)
+        succeed = lambda: 'ok'
+        fail = self.fail_with(exceptions.TransportException)
+
+        resilience.call(succeed, breaker=breaker)
+        resilience.call(succeed, breaker=breaker)
+        for i in range(2):
+            self.assertRaises(exceptions.TransportException,
+                              resilience.call, fail, breaker=breaker)
+        self.assertEqual(breaker.state, resilience.OPEN)
+        self.assertEqual(breaker.stats()['error_rate'], 0.5)
+
+        self.assertRaises(exceptions.CircuitOpenException, resilience.call,
+                          succeed, breaker=breaker)
+        self.assertEqual(self.calls, 2)
+
+        # A single trial call after reset_timeout, which fails
+        time.sleep(0.05)
+        self.assertEqual(breaker.state, resilience.HALF_OPEN)
+        self.assertRaises(exceptions.TransportException, resilience.call,
+                          fail, breaker=breaker)
+        self.assertRaises(exceptions.CircuitOpenException, resilience.call,
+                          succeed, breaker=breaker)
+
+        # One that is turned away, which doesn't tell
+        time.sleep(0.05)
+        self.assertRaises(exceptions.TransportException, resilience.call,
+                          self.fail_with(exceptions.TransportException,
+                                         status=404), breaker=breaker)
+        self.assertEqual(breaker.state, resilience.HALF_OPEN)
+
+        # And one that succeeds
+        self.assertEqual(resilience.call(succeed, breaker=breaker), 'ok')
+        self.assertEqual(breaker.state, resilience.CLOSED)
+
+    def testCircuitBreakerTrialDecides(self):
+        breaker = resilience.CircuitBreaker(failure_threshold=0.5,
+                                            min_calls=2, reset_timeout=0.05)
+        slow = [breaker.before_call() for i in range(3)]
+        breaker.record(False, breaker.before_call())
+        breaker.record(False, breaker.before_call())
+        self.assertEqual(breaker.state, resilience.OPEN)
+
+        time.sleep(0.05)
+        trial = breaker.before_call()
+        # Calls let through before the breaker opened finish now
+        breaker.record(True, slow[0])
+        breaker.record(False, slow[1])
+        breaker.release(slow[2])
+        self.assertEqual(breaker.state, resilience.HALF_OPEN)
+        self.assertRaises(exceptions.CircuitOpenException,
+                          breaker.before_call)
+
+        breaker.record(True, trial)
+        self.assertEqual(breaker.state, resilience.CLOSED)
+
+    def testTimeouts(self):
+        server = testserver.DirectLinkServer(latency=0.2).start()
+        payload = {'PAYID': '8285812', 'amount': '6794', 'OPERATION': 'SAS'}
+        try:
+            for client in (transport.PooledTransport(read_timeout=0.05),
+                           transport.UrllibTransport(timeout=0.05)):
+                started = time.time()
+                self.assertRaises(exceptions.TimeoutException,
+                    OgoneDirectLink.request, server.get_url(), payload.copy(),
+                    settings=Settings(), transport=client)
+                self.assert_(time.time() - started < 0.2)
+                client.close()
+        finally:
+            server.close()
+
+        # Nothing listens on a port we just closed
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        url = 'http://127.0.0.1:%d/' % listener.getsockname()[1]
+        listener.close()
+        for client in (transport.PooledTransport(connect_timeout=1),
+                       transport.UrllibTransport(timeout=1)):
+            self.assertRaises(exceptions.ConnectException, client.post,
+                              url, '')
+
+        self.assert_(resilience.get_endpoint(server.get_url()) in
+                     resilience.get_breakers())
+
+
+class RouterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.fast = testserver.DirectLinkServer().start()
+        self.slow = testserver.DirectLinkServer(latency=0.05).start()
+        self.transport = transport.PooledTransport()
+
+        self.policy = resilience._policy
+        resilience._policy = resilience.RetryPolicy(retries=0)
+
+    def tearDown(self):
+        resilience._policy = self.policy
+        self.transport.close()
+        self.fast.close()
+        self.slow.close()
+
+    def query(self, url):
+        return OgoneDirectLink.query(url, {'orderID': '13'},
+                                     settings=Settings(),
+                                     transport=self.transport)
+
+    def testPrefersTheFastestEndpoint(self):
+        slow = self.slow.get_url(testserver.QUERY_PATH)
+        fast = self.fast.get_url(testserver.QUERY_PATH)
+        endpoints = router.EndpointRouter([slow, fast])
+
+        for i in range(10):
+            self.assertEqual(self.query(endpoints)['STATUS'], '9')
+
+        # Both are tried once, then everything goes to the fast one
+        self.assertEqual(self.slow.requests, 1)
+        self.assertEqual(self.fast.requests, 9)
+        stats = endpoints.get_stats()
+        self.assert_(stats[slow]['score'] > stats[fast]['score'])
+
+        # Until probing shows the other one has become faster
+        self.slow.latency, self.fast.latency = 0, 0.05
+        for i in range(10):
+            endpoints.probe(self.transport)
+        self.assertEqual(endpoints.choose(), slow)
+
+    def testFailsOver(self):
+        broken = testserver.DirectLinkServer(error_rate=1).start()
+        try:
+            # Queries are safe to repeat on another endpoint
+            url = broken.get_url(testserver.QUERY_PATH)
+            endpoints = router.EndpointRouter([
+                url, self.fast.get_url(testserver.QUERY_PATH)])
+            self.assertEqual(self.query(endpoints)['STATUS'], '9')
+            self.assertEqual(self.fast.requests, 1)
+            self.assertEqual(endpoints.get_stats()[url]['error_rate'], 1)
+
+            # Maintenance requests Ogone may have received are not
+            endpoints = router.EndpointRouter([broken.get_url(),
+                                               self.fast.get_url()])
+            payload = {'PAYID': '8285812', 'amount': '6794',
+                       'OPERATION': 'SAS'}
+            self.assertRaises(exceptions.TransportException,
+                              OgoneDirectLink.request, endpoints, payload,
+                              settings=Settings(), transport=self.transport)
+            self.assertEqual(self.fast.requests, 1)
+        finally:
+            broken.close()
+
+    def testRecordsEveryAttempt(self):
+        class SlowRetries(resilience.RetryPolicy):
+            def get_delay(self, attempt):
+                return 0.1
+
+        broken = testserver.DirectLinkServer(error_rate=1).start()
+        resilience._policy = SlowRetries(retries=1)
+        try:
+            url = broken.get_url(testserver.QUERY_PATH)
+            endpoints = router.EndpointRouter([
+                url, self.fast.get_url(testserver.QUERY_PATH)])
+            self.assertEqual(self.query(endpoints)['STATUS'], '9')
+        finally:
+            broken.close()
+
+        # Two attempts, without the wait in between
+        stats = endpoints.get_stats()[url]
+        self.assertEqual(stats['samples'], 2)
+        self.assert_(stats['latency'] < 0.1)
+
+    def testUrlLists(self):
+        fast = self.fast.get_url(testserver.QUERY_PATH)
+        slow = self.slow.get_url(testserver.QUERY_PATH)
+
+        settings = Settings()
+        settings.DIRECT_LINK_QUERY_TEST_URL = [fast]
+        self.assertEqual(OgoneDirectLink.get_query_action(settings=settings),
+                         fast)
+
+        self.assert_(router.get_router([fast, slow]) is
+                     router.get_router((fast, slow)))
+        self.assertEqual(self.query([fast, slow])['STATUS'], '9')
+
+        # Every call is routed, not just the first
+        settings.DIRECT_LINK_QUERY_TEST_URL = [slow, fast]
+        urls = OgoneDirectLink.get_query_action(settings=settings)
+        self.assertEqual(urls, [slow, fast])
+        reconciler = reconcile.Reconciler(dry_run=True, settings=settings,
+                                          transport=self.transport, workers=1)
+        reconciler.run([(str(i), '9') for i in range(10)])
+        self.assertEqual(reconciler.report['unchanged'], 10)
+        stats = router.get_router(urls).get_stats()
+        self.assertEqual(stats[slow]['samples'] + stats[fast]['samples'], 10)
+        self.assert_(self.fast.requests > self.slow.requests)
+
+
+class BillingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = testserver.DirectLinkServer(default_status=None,
+            aliases={'REFUSED': 2}).start()
+        self.directory = tempfile.mkdtemp()
+        self.journal = os.path.join(self.directory, 'billing.journal')
+        self.results = []
+
+        self.policy = resilience._policy
+        resilience._policy = resilience.RetryPolicy(retries=0)
+
+    def tearDown(self):
+        resilience._policy = self.policy
+        self.server.close()
+        shutil.rmtree(self.directory)
+
+    def get_biller(self, server=None, **kwargs):
+        server = server or self.server
+        kwargs.setdefault('rate', 0)
+        return billing.Biller(self.journal, self.results.extend,
+                              url=server.get_url(testserver.ORDER_PATH),
+                              query_url=server.get_url(testserver.QUERY_PATH),
+                              settings=Settings(), batch_size=2, **kwargs)
+
+    def get_charges(self, count):
+        charges = [billing.Charge('sub-%d' % n, 'ALIAS%d' % n, 995)
+                   for n in range(count)]
+        charges[1] = charges[1]._replace(alias='REFUSED')
+        return charges
+
+    def testCharges(self):
+        started = time.time()
+        report = self.get_biller(rate=200).run(self.get_charges(10))
+        self.assert_(time.time() - started >= 9 / 200.0)
+
+        self.assertEqual(report['due'], 10)
+        self.assertEqual(report['charged'], 10)
+        self.assertEqual(report['categories'], {'success': 9, 'decline': 1})
+        self.assertEqual(len(self.results), 10)
+        self.assertEqual(self.server.statuses['sub-3'], 9)
+
+        refused = [r for r in self.results if r.charge.alias == 'REFUSED'][0]
+        self.assertEqual(refused.status, 2)
+        self.assertEqual(refused.ncerror, testserver.REFUSED_NCERROR)
+
+        # Nothing is charged twice
+        report = self.get_biller().run(self.get_charges(10))
+        self.assertEqual(report['skipped'], 10)
+        self.assertEqual(self.server.requests, 10)
+
+    def testResumes(self):
+        # A run died with two orders in flight, of which Ogone got one
+        journal = billing.Journal(self.journal)
+        journal.record('sub-0', billing.PENDING)
+        journal.record('sub-1', billing.PENDING)
+        journal.close()
+        with open(self.journal, 'a') as f:
+            f.write('{"order_id": "sub-2", "sta')
+        self.server.statuses['sub-0'] = 9
+
+        report = self.get_biller().run(self.get_charges(3))
+        self.assertEqual(report['resolved'], 1)
+        self.assertEqual(report['charged'], 2)
+
+        # A query for both, and orders for the others
+        self.assertEqual(self.server.requests, 4)
+        entries = billing.Journal(self.journal).load()
+        self.assertEqual([entries['sub-%d' % n]['state'] for n in range(3)],
+                         [billing.DONE] * 3)
+
+    def testJournalSurvivesCutLines(self):
+        with open(self.journal, 'w') as f:
+            f.write('{"order_id": "sub-1", "state": "pending"}\n'
+                    '{"order_id": "sub-1", "sta')
+
+        # The next run goes on after the broken line, not on it
+        journal = billing.Journal(self.journal)
+        journal.record('sub-2', billing.PENDING)
+        journal.close()
+
+        entries = billing.Journal(self.journal).load()
+        self.assertEqual(entries['sub-1']['state'], billing.PENDING)
+        self.assertEqual(entries['sub-2']['state'], billing.PENDING)
+
+    def testReappliesAfterCrash(self):
+        # A run charged two orders, but died before applying one of them
+        journal = billing.Journal(self.journal)
+        journal.record('sub-0', billing.DONE, status=9, ncerror='0',
+                       payid='3000001')
+        journal.record('sub-1', billing.DONE, status=2,
+                       ncerror=testserver.REFUSED_NCERROR, payid='3000002')
+        journal.record_applied(['sub-1'])
+        journal.close()
+
+        report = self.get_biller().run(self.get_charges(3))
+        self.assertEqual(report['skipped'], 1)
+        self.assertEqual(report['resolved'], 1)
+        self.assertEqual(report['charged'], 1)
+        self.assertEqual(self.server.requests, 1)
+
+        self.assertEqual(sorted([(r.charge.order_id, r.status, r.payid)
+                                 for r in self.results])[0],
+                         ('sub-0', 9, '3000001'))
+
+        # Nothing left to apply
+        report = self.get_biller().run(self.get_charges(3))
+        self.assertEqual(report['skipped'], 3)
+        self.assertEqual(len(self.results), 2)
+
+    def testFailures(self):
+        # Orders Ogone may have received stay pending
+        broken = testserver.DirectLinkServer(error_rate=1).start()
+        try:
+            report = self.get_biller(broken).run(self.get_charges(2))
+        finally:
+            broken.close()
+        self.assertEqual(report['uncertain'], 2)
+        self.assertEqual(self.results, [])
+
+        # Also while we can't look them up
+        report = self.get_biller(broken).run(self.get_charges(2))
+        self.assertEqual(report['uncertain'], 2)
+
+        # Orders which never went out failed
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        url = 'http://127.0.0.1:%d/' % listener.getsockname()[1]
+        listener.close()
+        biller = billing.Biller(self.journal, url=url, query_url=url,
+                                settings=Settings(), rate=0)
+        report = biller.run([billing.Charge('sub-9', 'ALIAS9', 995)])
+        self.assertEqual(report['failed'], 1)
+        self.assertEqual(billing.Journal(self.journal).load()['sub-9']
+                         ['state'], billing.FAILED)
+
+        # And all of them are charged next time
+        report = self.get_biller().run(self.get_charges(2) +
+            [billing.Charge('sub-9', 'ALIAS9', 995)])
+        self.assertEqual(report['charged'], 3)
+
+
+class RateLimitTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        ratelimit._limiter = None
+        shutil.rmtree(self.directory)
+
+    def testBudgets(self):
+        limiter = ratelimit.RateLimiter({'*': 20, 'shopBE': (5, 10),
+                                         'shopBE:SAS': 1, '*:RFD': 2})
+
+        self.assertEqual(limiter.get_buckets('shopNL'), [('*', 20, 20)])
+        self.assertEqual(limiter.get_buckets('shopBE', 'SAS'),
+                         [('shopBE', 5, 10), ('shopBE:SAS', 1, 1)])
+        self.assertEqual(limiter.get_buckets('shopNL', 'RFD'),
+                         [('*', 20, 20), ('*:RFD', 2, 2)])
+
+        # Merchants don't share the '*' budget
+        self.assertEqual(limiter.reserve('shopNL', 'RFD'), 0)
+        self.assertEqual(limiter.reserve('shopFR', 'RFD'), 0)
+        self.assertEqual(limiter.reserve('shopFR', 'RFD'), 0)
+        self.assert_(limiter.reserve('shopFR', 'RFD') > 0.4)
+
+        limiter = ratelimit.RateLimiter({'*': 1}, timeout=0.5)
+        limiter.acquire('shopNL')
+        self.assertRaises(exceptions.RateLimitException, limiter.acquire,
+                          'shopNL')
+
+    def testTurnsAreGivenBack(self):
+        for backend in (ratelimit.LocalBackend(),
+                        ratelimit.FileBackend(self.directory)):
+            limiter = ratelimit.RateLimiter({'shopBE': (1, 5),
+                                             'shopBE:SAS': (1, 1)},
+                                            backend, timeout=0.5)
+            self.assertEqual(limiter.reserve('shopBE', 'SAS'), 0)
+            self.assertRaises(exceptions.RateLimitException,
+                              limiter.reserve, 'shopBE', 'SAS')
+
+            # The failed call didn't use up a turn of the merchant
+            self.assertEqual([limiter.reserve('shopBE') for i in range(4)],
+                             [0] * 4)
+
+    def testFileBackendIsPrivate(self):
+        backend = ratelimit.FileBackend()
+        info = os.stat(backend.directory)
+        self.assertEqual(info.st_uid, os.getuid())
+        self.assertEqual(info.st_mode & 0o077, 0)
+
+        # Links to somewhere else aren't followed
+        backend = ratelimit.FileBackend(self.directory)
+        target = os.path.join(self.directory, 'target')
+        open(target, 'w').close()
+        os.symlink(target, backend.get_path('shopNL'))
+        self.assertRaises(OSError, backend.reserve, 'shopNL', 1, 1)
+        self.assertEqual(os.path.getsize(target), 0)
+
+    def testFilesAreShared(self):
+        delays = []
+
+        def reserve():
+            # Its own backend, as in another process
+            backend = ratelimit.FileBackend(self.directory)
+            for i in range(10):
+                delays.append(backend.reserve('shopNL', 100, 1))
+
+        threads = [threading.Thread(target=reserve) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Each of the 20 calls got a turn of its own
+        self.assertEqual(len([d for d in delays if d == 0]), 1)
+        self.assert_(max(delays) > 0.15)
+
+    def testDirectLink(self):
+        ratelimit._limiter = ratelimit.RateLimiter(
+            {Settings.PSPID: (100, 1)},
+            ratelimit.FileBackend(self.directory))
+        server = testserver.DirectLinkServer().start()
+        payload = {'PAYID': '8285812', 'amount': '6794', 'OPERATION': 'SAS'}
+        try:
+            started = time.time()
+            for i in range(6):
+                OgoneDirectLink.request(server.get_url(), payload.copy(),
+                                        settings=Settings())
+            self.assert_(time.time() - started >= 0.05)
+        finally:
+            server.close()
+
+
+    def testEveryAttemptTakesATurn(self):
+        reservations = []
+        class CountingLimiter(ratelimit.RateLimiter):
+            def reserve(self, merchant, operation=None):
+                reservations.append(merchant)
+                return 0
+
+        ratelimit._limiter = CountingLimiter({})
+        policy = resilience._policy
+        resilience._policy = resilience.RetryPolicy(retries=2, backoff=0.001)
+        broken = testserver.DirectLinkServer(error_rate=1,
+                                             error_status=503).start()
+        server = testserver.DirectLinkServer().start()
+        try:
+            # Retried twice
+            self.assertRaises(exceptions.TransportException,
+                OgoneDirectLink.query, broken.get_url(testserver.QUERY_PATH),
+                {'orderID': '13'}, settings=Settings())
+            self.assertEqual(len(reservations), 3)
+
+            # And failed over to the other endpoint
+            resilience._policy = resilience.RetryPolicy(retries=0)
+            OgoneDirectLink.query(router.EndpointRouter([
+                broken.get_url(testserver.QUERY_PATH),
+                server.get_url(testserver.QUERY_PATH)]), {'orderID': '13'},
+                settings=Settings())
+            self.assertEqual(reservations, [Settings.PSPID] * 5)
+        finally:
+            resilience._policy = policy
+            broken.close()
+            server.close()
+
+
+class PostbackHandler(testserver.DirectLinkHandler):
+    """ Accepts valid postbacks like examples/views.py does. """
+
+    def do_GET(self):
+        query = urlparse.urlsplit(self.path).query
+        params = dict([(key, value.decode('latin1')) for key, value in
+                       urlparse.parse_qsl(query)])
+
+        valid = Ogone(params, settings=Settings()).is_valid()
+        self.send_response(valid and 302 or 400)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class LoadGeneratorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = testserver.DirectLinkServer(handler=PostbackHandler)
+        self.server.start()
+        self.url = self.server.get_url('/order_status_update/')
+
+    def tearDown(self):
+        self.server.close()
+
+    def testPostbacksAreValid(self):
+        template = dict(loadgen.POSTBACK, CN=u'S\xe9bastien Fievet')
+        params = loadgen.make_postback(3, Settings.SHA_POST_SECRET,
+                                       template=template)
+        self.assert_(Ogone(params, settings=Settings()).is_valid())
+        self.assert_('CN=S%E9bastien+Fievet' in loadgen.encode_postback(params))
+
+        generator = loadgen.LoadGenerator(self.url, Settings.SHA_POST_SECRET,
+                                          rate=500, workers=2)
+        report = generator.run(count=20)
+
+        self.assertEqual(report.sent, 20)
+        self.assertEqual(report.failed, 0)
+        self.assertEqual(report.statuses, {302: 20})
+        self.assertEqual(self.server.connections, 2)
+
+    def testFailuresAreReported(self):
+        generator = loadgen.LoadGenerator(self.url, 'wrong secret', rate=500)
+        report = generator.run(count=5)
+        self.assertEqual(report.failed, 5)
+        self.assertEqual(report.statuses, {400: 5})
+
+        self.server.close()
+        report = generator.run(count=3)
+        self.assertEqual(report.failed, 3)
+        self.assertEqual(report.statuses, {})
+
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(doctest.DocTestSuite(security))
+    suite.addTest(doctest.DocTestSuite(pool))
+    suite.addTest(doctest.DocTestSuite(parsers))
+    suite.addTest(doctest.DocTestSuite(parameters))
+    suite.addTest(doctest.DocTestSuite(result))
+    suite.addTest(doctest.DocTestSuite(status_codes))
+    suite.addTest(doctest.DocTestSuite(rendering))
+    suite.addTest(doctest.DocTestSuite(dedup))
+    suite.addTest(doctest.DocTestSuite(testserver))
+    suite.addTest(doctest.DocTestSuite(loadgen))
+    suite.addTest(doctest.DocTestSuite(metrics))
+    suite.addTest(doctest.DocTestSuite(importer))
+    suite.addTest(doctest.DocTestSuite(resilience))
+    suite.addTest(doctest.DocTestSuite(router))
+    suite.addTest(doctest.DocTestSuite(billing))
+    suite.addTest(doctest.DocTestSuite(ratelimit))
     suite.addTest(unittest.TestLoader().loadTestsFromTestCase(OgoneTestCase))
+    suite.addTest(unittest.TestLoader().loadTestsFromTestCase(
+        OgoneDirectLinkTestCase))
+    suite.addTest(unittest.TestLoader().loadTestsFromTestCase(
+        ReconcileTestCase))
+    suite.addTest(unittest.TestLoader().loadTestsFromTestCase(
+        ResilienceTestCase))
+    suite.addTest(unittest.TestLoader().loadTestsFromTestCase(
+        RouterTestCase))
+    suite.addTest(unittest.TestLoader().loadTestsFromTestCase(
+        BillingTestCase))
+    suite.addTest(unittest.TestLoader().loadTestsFromTestCase(
+        RateLimitTestCase))
+    suite.addTest(unittest.TestLoader().loadTestsFromTestCase(
+        LoadGeneratorTestCase))
+
+    # These need Django's settings and a test database
+    from django_ogone import tests_models
+    suite.addTest(unittest.TestLoader().loadTestsFromModule(tests_models))
     return suite
@@ -0,0 +1,163 @@
+"""
+Tests for the Payment model and what stores payments in it. Unlike
+:mod:`django_ogone.tests` these need Django's settings and a test database.
+"""
+
+import datetime
+import decimal
+import os
+import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from django_ogone import exceptions, merchants, testserver, loadgen, importer
+from django_ogone.models import Payment
+from django_ogone.tests import Settings
+from django_ogone import Ogone
+
+
+class PaymentTestCase(TestCase):
+    def setUp(self):
+        self.settings = Settings()
+
+    def get_postbacks(self, count, status=9):
+        return [Ogone(loadgen.make_postback(i, Settings.SHA_POST_SECRET,
+                                            status=status),
+                      settings=self.settings) for i in range(count)]
+
+    def testBulkUpsert(self):
+        self.assertEqual(Payment.objects.bulk_upsert(self.get_postbacks(5),
+                                                     batch_size=2), (5, 0))
+
+        payment = Payment.objects.get(payid=8000003)
+        self.assertEqual(payment.orderid, '3')
+        self.assertEqual(payment.status, 9)
+        self.assertEqual(payment.status_category, 'success')
+        self.assertEqual(payment.amount, decimal.Decimal('6794.81'))
+        self.assertEqual(payment.trxdate, datetime.date(2010, 9, 24))
+        self.assertEqual(payment.ed, datetime.date(2011, 1, 1))
+        self.assertEqual(payment.brand, 'VISA')
+
+        # Late "payment processing" postbacks don't undo "paid" ones
+        postbacks = self.get_postbacks(7, status=91)[3:]
+        self.assertEqual(Payment.objects.bulk_upsert(postbacks), (2, 0))
+        self.assertEqual(Payment.objects.count(), 7)
+        self.assertEqual(Payment.objects.filter(status=91).count(), 2)
+        self.assertEqual(Payment.objects.get(pk=payment.pk).status, 9)
+
+        # Refunds do, whatever order a batch has them in
+        postbacks = self.get_postbacks(5, status=8)[3:] + \
+            self.get_postbacks(5, status=5)[3:]
+        self.assertEqual(Payment.objects.bulk_upsert(postbacks), (0, 2))
+        self.assertEqual(Payment.objects.get(pk=payment.pk).status, 8)
+
+        invalid = self.get_postbacks(1)[0]
+        invalid.params['STATUS'] = '5'
+        self.assertRaises(exceptions.InvalidSignatureException,
+                          Payment.objects.bulk_upsert, [invalid])
+
+    def testBulkUpsertRacesOtherWriters(self):
+        manager = Payment.objects
+        calls = []
+
+        def bulk_create(payments):
+            calls.append(payments)
+            if len(calls) == 1:
+                # Another process got to the first payment before us
+                Payment(orderid='x', payid=payments[0].payid, status=5).save()
+            return type(manager).bulk_create(manager, payments)
+
+        manager.bulk_create = bulk_create
+        try:
+            self.assertEqual(manager.bulk_upsert(self.get_postbacks(3)),
+                             (3, 0))
+        finally:
+            del manager.bulk_create
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(Payment.objects.filter(status=9).count(), 3)
+
+    def testReconcileCommand(self):
+        Payment.objects.bulk_upsert(self.get_postbacks(4))
+        server = testserver.DirectLinkServer(statuses={'2': 8}).start()
+        registry = merchants.get_registry()
+        registry.register(merchants.Merchant('mycutePS',
+            defaults=self.settings, SHA_PRE_SECRET=Settings.SHA_PRE_SECRET,
+            USERID=Settings.USERID, PSWD=Settings.PSWD))
+        try:
+            call_command('ogone_reconcile', 'django_ogone.Payment',
+                         order_field='orderid', status_field='status',
+                         merchant='mycutePS', batch_size=3,
+                         url=server.get_url(testserver.QUERY_PATH),
+                         stdout=open(os.devnull, 'w'))
+        finally:
+            registry._merchants.pop('mycutePS')
+            server.close()
+
+        self.assertEqual(Payment.objects.get(orderid='2').status, 8)
+        self.assertEqual(Payment.objects.filter(status=9).count(), 3)
+
+
+class ImporterTestCase(TestCase):
+    def get_rows(self, count):
+        for i in range(count):
+            yield {'PAYID': 8000000 + i, 'ORDERID': i, 'STATUS': 9,
+                   'AMOUNT': '12.50', 'TRXDATE': '09/24/10',
+                   'CN': u'S\xe9bastien Fievet'}
+
+    def testCSV(self):
+        lines = ['PAYID,ORDERID,STATUS,AMOUNT,TRXDATE,CN']
+        for row in self.get_rows(25):
+            lines.append('%(PAYID)s,%(ORDERID)s,%(STATUS)s,%(AMOUNT)s,'
+                         '%(TRXDATE)s,%(CN)s' % row)
+        lines.insert(5, '1,,,,,')
+        # Rows the sink can't store
+        lines.insert(6, ',30,9,12.50,09/24/10,')
+        lines.insert(7, '8000031,31,9,12.50,24.09.2010,')
+        lines.insert(8, '8000032,32,9,lots,09/24/10,')
+        export = StringIO.StringIO('\n'.join(lines).encode('latin1'))
+
+        report = importer.Importer(importer.UpsertSink(),
+                                   batch_size=10).run(export)
+        self.assertEqual(report, {'rows': 29, 'imported': 25, 'invalid': 4,
+                                  'batches': 3})
+
+        payment = Payment.objects.get(payid=8000007)
+        self.assertEqual(payment.orderid, '7')
+        self.assertEqual(payment.cn, u'S\xe9bastien Fievet')
+        self.assertEqual(payment.amount, decimal.Decimal('12.50'))
+        self.assertEqual(payment.trxdate, datetime.date(2010, 9, 24))
+
+    def testRowsAreConvertedOnce(self):
+        converted = []
+        def get_fields(result):
+            converted.append(result.order_id)
+            return Payment.get_fields(result)
+
+        lines = ['PAYID,ORDERID,STATUS']
+        for row in self.get_rows(5):
+            lines.append('%(PAYID)s,%(ORDERID)s,%(STATUS)s' % row)
+        export = StringIO.StringIO('\n'.join(lines))
+
+        report = importer.Importer(importer.BulkCreateSink(Payment,
+                                   get_fields), batch_size=2).run(export)
+        self.assertEqual(report['imported'], 5)
+        self.assertEqual(converted, range(5))
+        self.assertEqual(Payment.objects.count(), 5)
+
+    def testXML(self):
+        elements = ['<PAYMENT PAYID="%(PAYID)s" ORDERID="%(ORDERID)s" '
+                    'STATUS="%(STATUS)s"><CN>%(CN)s</CN></PAYMENT>' % row
+                    for row in self.get_rows(5)]
+        export = StringIO.StringIO((u'<?xml version="1.0" encoding="utf-8"?>'
+                                    u'<PAYMENTS>%s</PAYMENTS>' %
+                                    u''.join(elements)).encode('utf8'))
+
+        batches = []
+        report = importer.Importer(batches.append, format='xml',
+                                   batch_size=2).run(export)
+        self.assertEqual(report['imported'], 5)
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        self.assertEqual(batches[2][0].order_id, 4)
+        self.assertEqual(batches[2][0]['CN'], u'S\xe9bastien Fievet')
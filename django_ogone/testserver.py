@@ -0,0 +1,344 @@
+"""
+A local stand-in for the Ogone DirectLink endpoint, for tests, benchmarks
+and load tests.
+
+The server answers maintenance requests with the ncresponse Ogone would
+send. To see how a client copes with a slow or failing Ogone, give it a
+`latency` (plus random `jitter`) in seconds and an `error_rate`: that
+fraction of the requests fails with HTTP `error_status`, or with an
+ncresponse carrying an NCERROR when `error_status` is None.
+
+Run it standalone with ``python -m django_ogone.testserver --port 8000``.
+
+>>> server = DirectLinkServer().start()
+>>> from django_ogone import transport
+>>> print(transport.UrllibTransport().post(server.get_url(),
+...     'PAYID=123&OPERATION=RFD&amount=100'))
+<?xml version="1.0"?><ncresponse NCERROR="0" NCERRORPLUS="!" NCSTATUS="0" PAYID="123" PAYIDSUB="1" STATUS="81" amount="1.00"></ncresponse>
+>>> server.close()
+"""
+
+import BaseHTTPServer
+import SocketServer
+import base64
+import optparse
+import random
+import socket
+import sys
+import threading
+import time
+import urlparse
+from xml.sax.saxutils import quoteattr
+
+MAINTENANCE_PATH = '/ncol/test/maintenancedirect.asp'
+QUERY_PATH = '/ncol/test/querydirect.asp'
+ORDER_PATH = '/ncol/test/orderdirect.asp'
+
+# The status Ogone answers a maintenance operation with
+OPERATION_STATUSES = {
+    'REN': 5,
+    'DEL': 61,
+    'DES': 61,
+    'SAL': 91,
+    'SAS': 91,
+    'RFD': 81,
+    'RFS': 81,
+}
+
+# Sent for injected errors when error_status is None
+INJECTED_NCERROR = '50001111'
+
+# Sent when querying an order we don't know
+UNKNOWN_ORDER_NCERROR = '50001130'
+
+# Sent when an order is refused
+REFUSED_NCERROR = '30001301'
+
+# Status of an order waiting for the 3-D Secure identification
+IDENTIFICATION_STATUS = 46
+
+# The form sent along with IDENTIFICATION_STATUS, padded to some size
+HTML_ANSWER = base64.b64encode(
+    '<form name="downloadform3D" action="https://secure.ogone.com/ncol/'
+    'test/3dsecure.asp" method="post">%s</form>' %
+    ''.join(['<input type="hidden" name="F%d" value="%s">' % (n, 'x' * 64)
+             for n in range(200)]))
+
+
+def render_ncresponse(attributes, children=None):
+    return '<?xml version="1.0"?><ncresponse %s>%s</ncresponse>' % (
+        ' '.join(['%s=%s' % (name, quoteattr(str(value)))
+                  for name, value in sorted(attributes.items())]),
+        ''.join(['<%s>%s</%s>' % (name, value, name)
+                 for name, value in sorted((children or {}).items())]))
+
+
+class DirectLinkHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # Write each response in one go; writing the status line and headers
+    # one by one stalls keep-alive clients on Nagle's algorithm
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.count('connections')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        params = dict(urlparse.parse_qsl(self.rfile.read(length)))
+        self.server.count('requests')
+
+        status, body = self.server.handle_post(self.path, params)
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class DirectLinkServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ Answers maintenance requests the way the Ogone test environment
+        does. Binds to a free local port unless told otherwise.
+
+        Status queries are answered from `statuses`, a dict from orderID to
+        status, falling back to `default_status`. With a default_status of
+        None, orders missing from `statuses` are unknown.
+
+        New orders get the status in `aliases` for their ALIAS, falling
+        back to 9 (5 for authorizations), and are remembered in
+        `statuses`. Orders with status 46 come back with the HTML_ANSWER
+        of a 3-D Secure identification. """
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), handler=DirectLinkHandler,
+                 latency=0, jitter=0, error_rate=0, error_status=500,
+                 seed=None, statuses=None, default_status=9, aliases=None):
+        assert 0 <= error_rate <= 1
+
+        BaseHTTPServer.HTTPServer.__init__(self, address, handler)
+
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.statuses = dict(statuses or {})
+        self.default_status = default_status
+        self.aliases = dict(aliases or {})
+
+        self.connections = 0
+        self.requests = 0
+        self.errors = 0
+        self.threads = []
+        self.sockets = []
+        self._lock = threading.Lock()
+
+    def count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get_url(self, path=MAINTENANCE_PATH):
+        host, port = self.server_address[:2]
+        return 'http://%s:%d%s' % (host, port, path)
+
+    def handle_post(self, path, params):
+        """ Return the HTTP status and body to answer a request with. """
+
+        with self._lock:
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            failed = self.random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+
+        if delay:
+            time.sleep(delay)
+
+        if not failed:
+            if path.startswith(QUERY_PATH):
+                return 200, self.respond_query(params)
+            if path.startswith(ORDER_PATH):
+                return 200, self.respond_order(params)
+            return 200, self.respond(path, params)
+        if self.error_status is not None:
+            return self.error_status, 'Injected error'
+
+        return 200, render_ncresponse({
+            'PAYID': params.get('PAYID', '0'),
+            'NCSTATUS': '5',
+            'NCERROR': INJECTED_NCERROR,
+            'NCERRORPLUS': 'Injected error',
+            'STATUS': '0',
+        })
+
+    def respond(self, path, params):
+        """ Return the ncresponse XML for the posted `params`. """
+
+        params = dict([(key.upper(), value) for key, value in params.items()])
+        status = OPERATION_STATUSES.get(params.get('OPERATION'), 91)
+
+        attributes = {
+            'PAYID': params.get('PAYID', '8285812'),
+            'PAYIDSUB': '1',
+            'NCSTATUS': '0',
+            'NCERROR': '0',
+            'NCERRORPLUS': '!',
+            'STATUS': status,
+        }
+        if 'ORDERID' in params:
+            attributes['orderID'] = params['ORDERID']
+        if params.get('AMOUNT', '').isdigit():
+            attributes['amount'] = '%.2f' % (int(params['AMOUNT']) / 100.0)
+
+        return render_ncresponse(attributes)
+
+    def respond_order(self, params):
+        """ Return the ncresponse XML for a new order on an alias. """
+
+        params = dict([(key.upper(), value) for key, value in params.items()])
+        order_id = params.get('ORDERID')
+        default = params.get('OPERATION') == 'RES' and 5 or 9
+        status = self.aliases.get(params.get('ALIAS'), default)
+
+        with self._lock:
+            self.statuses[order_id] = status
+            payid = 3000000 + len(self.statuses)
+
+        refused = status in (0, 2, 93)
+        children = None
+        if status == IDENTIFICATION_STATUS:
+            children = {'HTML_ANSWER': HTML_ANSWER}
+
+        return render_ncresponse({
+            'orderID': order_id or '',
+            'PAYID': payid,
+            'NCSTATUS': refused and '3' or '0',
+            'NCERROR': refused and REFUSED_NCERROR or '0',
+            'NCERRORPLUS': refused and 'Card refused' or '!',
+            'STATUS': status,
+            'amount': '%.2f' % (int(params.get('AMOUNT', 0)) / 100.0),
+            'currency': params.get('CURRENCY', ''),
+            'ALIAS': params.get('ALIAS', ''),
+        }, children)
+
+    def respond_query(self, params):
+        """ Return the ncresponse XML for a status query. """
+
+        params = dict([(key.upper(), value) for key, value in params.items()])
+        order_id = params.get('ORDERID')
+        status = self.statuses.get(order_id, self.default_status)
+
+        if status is None:
+            return render_ncresponse({
+                'orderID': order_id or '',
+                'NCSTATUS': '5',
+                'NCERROR': UNKNOWN_ORDER_NCERROR,
+                'NCERRORPLUS': 'unknown orderid %s' % order_id,
+                'STATUS': '',
+            })
+
+        return render_ncresponse({
+            'orderID': order_id or '',
+            'PAYID': params.get('PAYID', '8285812'),
+            'PAYIDSUB': '0',
+            'NCSTATUS': '0',
+            'NCERROR': '0',
+            'NCERRORPLUS': '!',
+            'STATUS': status,
+        })
+
+    def process_request(self, request, client_address):
+        # Like ThreadingMixIn, but keep track of the threads so close()
+        # can wait for them
+        thread = threading.Thread(target=self._process_request_thread,
+                                  args=(request, client_address))
+        thread.daemon = True
+        with self._lock:
+            self.threads.append(thread)
+            self.sockets.append(request)
+        thread.start()
+
+    def _process_request_thread(self, request, client_address):
+        try:
+            self.process_request_thread(request, client_address)
+        finally:
+            # Only track connections which are still open
+            with self._lock:
+                self.threads.remove(threading.current_thread())
+                self.sockets.remove(request)
+
+    def handle_error(self, request, client_address):
+        # Clients giving up on slow responses are expected here
+        if isinstance(sys.exc_info()[1], socket.error):
+            return
+
+        BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+    def start(self):
+        """ Serve from a background thread. """
+
+        thread = threading.Thread(target=self.serve_forever,
+                                  kwargs={'poll_interval': 0.01})
+        thread.daemon = True
+        thread.start()
+
+        return self
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+        with self._lock:
+            sockets = list(self.sockets)
+            threads = list(self.threads)
+
+        # Hang up on clients keeping their connections open
+        for request in sockets:
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+        for thread in threads:
+            thread.join(1)
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--host', default='127.0.0.1')
+    parser.add_option('--port', type='int', default=8000)
+    parser.add_option('--latency', type='float', default=0,
+                      help='seconds to wait before answering [%default]')
+    parser.add_option('--jitter', type='float', default=0,
+                      help='random extra seconds to wait [%default]')
+    parser.add_option('--error-rate', type='float', default=0,
+                      help='fraction of the requests to fail [%default]')
+    parser.add_option('--error-status', type='int', default=500,
+                      help='HTTP status of failed requests, 200 answers '
+                           'them with an NCERROR instead [%default]')
+    options, args = parser.parse_args(argv)
+
+    error_status = options.error_status
+    if error_status == 200:
+        error_status = None
+
+    server = DirectLinkServer((options.host, options.port),
+                              latency=options.latency, jitter=options.jitter,
+                              error_rate=options.error_rate,
+                              error_status=error_status)
+    print('Serving DirectLink on %s' % server.get_url())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+"""
+HTTP transports used to talk to the Ogone DirectLink endpoints.
+
+A transport only knows how to POST a body to a url and hand back the raw
+response body, or feed it to a parser as it arrives. The default is a
+:class:`PooledTransport`, which keeps a small pool of persistent
+(keep-alive) connections per endpoint so that consecutive captures,
+refunds and cancels do not pay for a new TCP connection and TLS handshake
+every time.
+
+To use something else, pass ``transport=`` to
+:meth:`OgoneDirectLink.request` or replace the default with
+:func:`set_transport`.
+"""
+
+import httplib
+import logging
+import select
+import socket
+import threading
+import time
+import urllib2
+import urlparse
+
+from django_ogone import exceptions as ogone_exceptions
+from django_ogone import settings as ogone_settings
+from django_ogone import metrics as ogone_metrics
+
+log = logging.getLogger('django_ogone')
+
+# Bytes of the response read at a time when it is fed to a parser
+CHUNK_SIZE = 8192
+
+
+class Transport(object):
+    """ Base class for transports. """
+
+    def post(self, url, body, headers=None, parser=None):
+        """ POST `body` to `url` and return the response body. With a
+            `parser` (see django_ogone.parsers.NCResponseParser) the body
+            is fed to it in chunks instead and its result is returned. """
+        raise NotImplementedError
+
+    @staticmethod
+    def _read(response, parser=None):
+        if parser is None:
+            return response.read()
+
+        while True:
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                return parser.close()
+            if parser.feed(chunk):
+                return parser.result
+
+    def close(self):
+        """ Release any resources held by the transport. """
+        pass
+
+
+class UrllibTransport(Transport):
+    """ Opens a new connection for every request using urllib2. urllib2
+        has a single `timeout`, for connecting and for every read. """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+
+    def post(self, url, body, headers=None, parser=None):
+        request = urllib2.Request(url, body, headers or {})
+        try:
+            if self.timeout is None:
+                response = urllib2.urlopen(request)
+            else:
+                response = urllib2.urlopen(request, timeout=self.timeout)
+            try:
+                return self._read(response, parser)
+            finally:
+                response.close()
+        except urllib2.HTTPError as e:
+            raise ogone_exceptions.TransportException(
+                'Ogone returned HTTP %d for %s' % (e.code, url), status=e.code)
+        except urllib2.URLError as e:
+            if isinstance(e.reason, socket.timeout):
+                raise ogone_exceptions.TimeoutException(
+                    'Timed out connecting to %s' % url)
+            raise ogone_exceptions.ConnectException(
+                'Could not connect to %s: %s' % (url, e.reason))
+        except socket.timeout:
+            raise ogone_exceptions.TimeoutException(
+                'Timed out waiting for %s' % url)
+        except (httplib.HTTPException, socket.error) as e:
+            raise ogone_exceptions.TransportException(
+                'Request to %s failed: %r' % (url, e))
+
+
+class PooledTransport(Transport):
+    """
+    Keeps up to `pool_size` idle keep-alive connections per
+    (scheme, host, port). Connections which have been idle for more than
+    `idle_timeout` seconds are closed instead of being reused.
+
+    Safe to share between threads: a connection is only ever used by the
+    thread that checked it out of the pool.
+
+    Python 2 does not expose TLS session resumption, so we avoid the
+    handshake altogether by keeping the connection itself alive.
+    """
+
+    connection_classes = {
+        'http': httplib.HTTPConnection,
+        'https': httplib.HTTPSConnection,
+    }
+
+    def __init__(self, pool_size=10, idle_timeout=30, timeout=None,
+                 connect_timeout=None, read_timeout=None):
+        assert pool_size > 0
+
+        if connect_timeout is None:
+            connect_timeout = timeout
+        if read_timeout is None:
+            read_timeout = timeout
+
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        # (scheme, host, port) -> list of (connection, last used)
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _split_url(url):
+        parts = urlparse.urlsplit(url)
+        scheme = parts.scheme.lower()
+        assert scheme in ('http', 'https'), 'Unsupported url: %s' % url
+
+        port = parts.port or (scheme == 'https' and 443 or 80)
+        path = parts.path or '/'
+        if parts.query:
+            path = '%s?%s' % (path, parts.query)
+
+        return (scheme, parts.hostname, port), path
+
+    def _new_connection(self, key):
+        scheme, host, port = key
+        connection_class = self.connection_classes[scheme]
+
+        log.debug('Opening new connection to %s://%s:%d', scheme, host, port)
+        if self.connect_timeout is None:
+            return connection_class(host, port)
+        return connection_class(host, port, timeout=self.connect_timeout)
+
+    def _acquire(self, key):
+        """ Return an idle connection for `key` and whether it was reused. """
+
+        now = time.time()
+        stale = []
+
+        with self._lock:
+            pool = self._pools.get(key)
+            connection = None
+            while pool:
+                candidate, last_used = pool.pop()
+                if now - last_used > self.idle_timeout or \
+                        self._is_dropped(candidate):
+                    stale.append(candidate)
+                else:
+                    connection = candidate
+                    break
+
+        for candidate in stale:
+            candidate.close()
+
+        if connection is not None:
+            return connection, True
+
+        return self._new_connection(key), False
+
+    @staticmethod
+    def _is_dropped(connection):
+        """ Whether the server closed the idle `connection`: there is
+            nothing for us to read until we send a request, unless it is
+            the end of the stream. """
+
+        sock = connection.sock
+        if sock is None:
+            return True
+
+        try:
+            if hasattr(select, 'poll'):
+                # select can't watch descriptors over FD_SETSIZE
+                poller = select.poll()
+                poller.register(sock, select.POLLIN)
+                return bool(poller.poll(0))
+            return bool(select.select([sock], [], [], 0)[0])
+        except (select.error, socket.error, ValueError):
+            return True
+
+    def _release(self, key, connection):
+        with self._lock:
+            pool = self._pools.setdefault(key, [])
+            if len(pool) < self.pool_size:
+                pool.append((connection, time.time()))
+                return
+
+        connection.close()
+
+    def _send(self, connection, path, body, headers):
+        if connection.sock is None:
+            with ogone_metrics.timer('directlink.connect',
+                                     endpoint=connection.host):
+                try:
+                    connection.connect()
+                except socket.error as e:
+                    raise ogone_exceptions.ConnectException(
+                        'Could not connect to %s:%d: %r' % (
+                            connection.host, connection.port, e))
+
+            if self.read_timeout != self.connect_timeout:
+                connection.sock.settimeout(self.read_timeout)
+
+        with ogone_metrics.timer('directlink.send', endpoint=connection.host):
+            connection.request('POST', path, body, headers)
+
+    def _receive(self, connection, parser=None):
+        with ogone_metrics.timer('directlink.wait', endpoint=connection.host):
+            response = connection.getresponse()
+            if parser is None or response.status >= 400:
+                data = response.read()
+            else:
+                data = self._read(response, parser)
+                # Drain whatever the parser didn't need, so the connection
+                # can be reused
+                response.read()
+
+        return response, data
+
+    def post(self, url, body, headers=None, parser=None):
+        key, path = self._split_url(url)
+        headers = headers or {}
+
+        connection, reused = self._acquire(key)
+        try:
+            try:
+                self._send(connection, path, body, headers)
+            except socket.timeout:
+                raise
+            except (httplib.HTTPException, socket.error):
+                connection.close()
+                if not reused:
+                    raise
+
+                # The server closed the keep-alive connection while it was
+                # idle and the request didn't go out, try once more on a
+                # fresh connection.
+                log.debug('Reused connection to %s failed, reconnecting', url)
+                connection = self._new_connection(key)
+                self._send(connection, path, body, headers)
+
+            # Ogone may have acted on the request from here on, so whether
+            # to send it again is up to the RetryPolicy
+            response, data = self._receive(connection, parser)
+        except ogone_exceptions.TransportException:
+            connection.close()
+            raise
+        except socket.timeout:
+            connection.close()
+            raise ogone_exceptions.TimeoutException(
+                'Timed out waiting for %s' % url)
+        except (httplib.HTTPException, socket.error) as e:
+            connection.close()
+            raise ogone_exceptions.TransportException(
+                'Request to %s failed: %r' % (url, e))
+        except Exception:
+            # The parser gave up half way through the response
+            connection.close()
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(key, connection)
+
+        if response.status >= 400:
+            raise ogone_exceptions.TransportException(
+                'Ogone returned HTTP %d for %s' % (response.status, url),
+                status=response.status)
+
+        return data
+
+    def close(self):
+        """ Close all idle connections. """
+
+        with self._lock:
+            pools, self._pools = self._pools, {}
+
+        for pool in pools.values():
+            for connection, last_used in pool:
+                connection.close()
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """ Return the default transport, creating it on first use. """
+
+    global _transport
+
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = PooledTransport(
+                    pool_size=ogone_settings.DIRECT_LINK_POOL_SIZE,
+                    idle_timeout=ogone_settings.DIRECT_LINK_POOL_IDLE_TIMEOUT,
+                    connect_timeout=ogone_settings.DIRECT_LINK_CONNECT_TIMEOUT,
+                    read_timeout=ogone_settings.DIRECT_LINK_READ_TIMEOUT)
+
+    return _transport
+
+
+def set_transport(transport):
+    """ Replace the default transport, closing the previous one. """
+
+    global _transport
+
+    with _transport_lock:
+        previous, _transport = _transport, transport
+
+    if previous is not None and previous is not transport:
+        previous.close()
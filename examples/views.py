@@ -9,6 +9,7 @@ from django.shortcuts import render_to_response
 from django_ogone.ogone import Ogone
 from django_ogone.forms import ogone_forms
 from django_ogone import ogone_settings
+from django_ogone import dedup
 
 
 def checkout(request):
@@ -48,10 +49,11 @@ def order_status_update(request):
     # --//--
     ogone = Ogone(params)
 
-    if ogone.is_valid():
-        #update the order data, different for each site
-        #need the ogone data and custom logic, use signals for this
-        ogone_signals.ogone_update_order.send(sender=Ogone, ogone=ogone)
+    #update the order data, different for each site
+    #need the ogone data and custom logic, use signals for this
+    #repeated notifications of the same status are only sent once
+    #set OGONE_DISPATCH_MODE = 'async' to send it from a worker thread
+    if dedup.get_deduplicator().process(ogone):
 
         #redirect to the appropriate view
         order_id = ogone.get_order_id()